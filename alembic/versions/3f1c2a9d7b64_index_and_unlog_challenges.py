@@ -0,0 +1,31 @@
+"""Index challenges.created_at and make the table unlogged
+
+Revision ID: 3f1c2a9d7b64
+Revises: 482f016f00d7
+Create Date: 2026-10-18 10:12:41.518903
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "3f1c2a9d7b64"
+down_revision: Union[str, Sequence[str], None] = "482f016f00d7"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+	# Lets the expiry sweeper find old rows without scanning the table
+	op.execute(
+		"CREATE INDEX IF NOT EXISTS challenges_created_at_idx ON challenges (created_at)"
+	)
+	# Challenges are ephemeral, so skip WAL writes for them
+	op.execute("ALTER TABLE challenges SET UNLOGGED")
+
+
+def downgrade() -> None:
+	op.execute("ALTER TABLE challenges SET LOGGED")
+	op.execute("DROP INDEX IF EXISTS challenges_created_at_idx")
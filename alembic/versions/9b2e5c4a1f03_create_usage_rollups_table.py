@@ -0,0 +1,39 @@
+"""create_usage_rollups_table
+
+Revision ID: 9b2e5c4a1f03
+Revises: 3f1c2a9d7b64
+Create Date: 2026-10-18 14:03:27.604118
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "9b2e5c4a1f03"
+down_revision: Union[str, Sequence[str], None] = "3f1c2a9d7b64"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+	# Hourly per-user, per-model token usage, upserted by the usage ledger
+	op.execute("""
+        CREATE TABLE usage_rollups (
+            user_id VARCHAR(255) NOT NULL,
+            model VARCHAR(255) NOT NULL,
+            bucket_start TIMESTAMPTZ NOT NULL,
+            prompt_tokens BIGINT NOT NULL DEFAULT 0,
+            completion_tokens BIGINT NOT NULL DEFAULT 0,
+            requests BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, model, bucket_start)
+        )
+    """)
+	op.execute(
+		"CREATE INDEX usage_rollups_bucket_start_idx ON usage_rollups (bucket_start)"
+	)
+
+
+def downgrade() -> None:
+	op.drop_table("usage_rollups")
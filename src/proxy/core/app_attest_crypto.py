@@ -0,0 +1,96 @@
+"""
+CPU-bound App Attest verification. Kept free of app state (DB, config, metrics)
+so these functions can run in a worker process as well as a thread; it lives
+outside the routers package so unpickling them in a worker doesn't import the
+app through the package `__init__`.
+"""
+
+import time
+from functools import lru_cache
+
+import cbor2
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from pyattest.assertion import Assertion
+from pyattest.attestation import Attestation
+from pyattest.configs.apple import AppleConfig
+
+
+def timed_call(fn, *args):
+	"""Runs fn in the worker and reports when it started and how long it took."""
+	start_time = time.time()
+	result = fn(*args)
+	return result, start_time, time.time() - start_time
+
+
+@lru_cache(maxsize=8)
+def _assertion_config(app_id: str, root_ca_pem: bytes) -> AppleConfig:
+	# Assertion verification doesn't depend on key_id
+	return AppleConfig(
+		key_id=None, app_id=app_id, root_ca=root_ca_pem, production=False
+	)
+
+
+@lru_cache(maxsize=4096)
+def _load_public_key(public_key_der: bytes) -> ec.EllipticCurvePublicKey:
+	return serialization.load_der_public_key(public_key_der)
+
+
+def verify_attestation(
+	key_id: str,
+	challenge: bytes,
+	attestation_obj: bytes,
+	app_id: str,
+	root_ca_pem: bytes,
+) -> str:
+	"""Verifies an attestation object and returns the attested public key as PEM."""
+	config = AppleConfig(
+		key_id=key_id, app_id=app_id, root_ca=root_ca_pem, production=False
+	)
+	attestation = Attestation(attestation_obj, challenge, config)
+	attestation.verify()
+
+	# Retrieve verified public key
+	verified_data = attestation.data["data"]
+	credential_id = verified_data["credential_id"]
+	auth_data = verified_data["raw"]["authData"]
+	cred_id_len = len(credential_id)
+	# Offset = 37 bytes (for rpIdHash, flags, counter) + 16 (aaguid) + 2 (len) + cred_id_len
+	public_key_offset = 37 + 16 + 2 + cred_id_len
+	# Slice the authData to get the raw COSE public key
+	cose_public_key_bytes = auth_data[public_key_offset:]
+	# Decode the COSE key and convert it to PEM format.
+	cose_key_obj = cbor2.loads(cose_public_key_bytes)
+	# COSE Key Map for EC2 keys: 1=kty, -1=crv, -2=x, -3=y
+	if cose_key_obj.get(1) != 2 or cose_key_obj.get(-1) != 1:  # kty=EC2, crv=P-256
+		raise ValueError("Public key is not a P-256 elliptic curve key.")
+	x_coord = cose_key_obj.get(-2)
+	y_coord = cose_key_obj.get(-3)
+
+	public_key = ec.EllipticCurvePublicNumbers(
+		x=int.from_bytes(x_coord, "big"),
+		y=int.from_bytes(y_coord, "big"),
+		curve=ec.SECP256R1(),
+	).public_key()
+
+	return public_key.public_bytes(
+		encoding=serialization.Encoding.PEM,
+		format=serialization.PublicFormat.SubjectPublicKeyInfo,
+	).decode("utf-8")
+
+
+def verify_assertion(
+	assertion: bytes,
+	expected_hash: bytes,
+	public_key: ec.EllipticCurvePublicKey | bytes,
+	app_id: str,
+	root_ca_pem: bytes,
+):
+	"""
+	Verifies an assertion signature. `public_key` is passed as DER bytes when
+	running in a worker process, since key objects can't be pickled.
+	"""
+	if isinstance(public_key, bytes):
+		public_key = _load_public_key(public_key)
+	config = _assertion_config(app_id, root_ca_pem)
+	Assertion(assertion, expected_hash, public_key, config).verify()
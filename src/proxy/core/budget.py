@@ -0,0 +1,139 @@
+import asyncio
+
+from .cache import budget_cache
+from .config import LITELLM_HEADERS, env
+from .http_client import litellm_http
+from .pg_services.services import litellm_pg
+from .prometheus_metrics import metrics
+from .upstream import upstream_pool
+
+
+class UserBudget:
+	__slots__ = ("max_budget", "spend", "pending")
+
+	def __init__(self, max_budget: float | None, spend: float):
+		self.max_budget = max_budget
+		self.spend = spend  # as last reported by LiteLLM
+		self.pending = 0.0  # charged locally since then
+
+	@property
+	def exceeded(self) -> bool:
+		return (
+			self.max_budget is not None and self.spend + self.pending >= self.max_budget
+		)
+
+
+def max_budget_of(user: dict) -> float | None:
+	"""Reads the max budget from a DB row or a LiteLLM customer/info response."""
+	if "max_budget" in user:
+		return user["max_budget"]
+	return (user.get("litellm_budget_table") or {}).get("max_budget")
+
+
+def response_cost(headers) -> float:
+	"""The cost LiteLLM reports for a completion, or 0 if it didn't."""
+	try:
+		return float(headers.get("x-litellm-response-cost") or 0)
+	except ValueError:
+		return 0.0
+
+
+class BudgetTracker:
+	"""
+	Tracks each user's budget and running spend in `budget_cache` so requests
+	from over-budget users can be rejected before any upstream work. Upstream
+	calls charge the cost LiteLLM reports for them; users with a budget whose
+	spend changed are periodically reconciled with LiteLLM's own spend.
+	"""
+
+	def __init__(self):
+		self._dirty: set[str] = set()
+
+	def track(self, user_id: str, user: dict):
+		if user_id not in budget_cache:
+			budget_cache.set(
+				user_id, UserBudget(max_budget_of(user), float(user.get("spend") or 0))
+			)
+
+	def is_exceeded(self, user_id: str) -> bool:
+		budget = budget_cache.get(user_id)
+		if budget is None or not budget.exceeded:
+			return False
+		# Rejected users aren't charged again, so queue them for reconciliation
+		# to pick up a spend reset or a raised budget
+		self._dirty.add(user_id)
+		return True
+
+	def charge(self, user_id: str | None, cost: float):
+		"""
+		Adds `cost` to the user's running spend. Users with a budget are queued
+		for reconciliation even at zero cost, since LiteLLM reports no cost for
+		streams.
+		"""
+		budget = budget_cache.get(user_id) if user_id else None
+		if budget is None:
+			return
+		if cost > 0:
+			budget.pending += cost
+		if budget.max_budget is not None:
+			self._dirty.add(user_id)
+
+	async def reconcile(self):
+		user_ids = []
+		while self._dirty and len(user_ids) < env.BUDGET_RECONCILE_BATCH_SIZE:
+			user_ids.append(self._dirty.pop())
+		if not user_ids:
+			return
+		# Charges made while the lookup is in flight stay pending
+		charged = {
+			user_id: budget.pending
+			for user_id in user_ids
+			if (budget := budget_cache.get(user_id)) is not None
+		}
+		try:
+			spend = await self._fetch_spend(list(charged))
+		except Exception as e:
+			print(f"Error reconciling budgets: {e}")
+			self._dirty.update(charged)
+			metrics.budget_reconciliations.labels(result="error").inc(len(charged))
+			return
+
+		for user_id, pending in charged.items():
+			budget = budget_cache.get(user_id)
+			if budget is None or user_id not in spend:
+				continue
+			budget.spend = float(spend[user_id]["spend"] or 0)
+			budget.max_budget = max_budget_of(spend[user_id])
+			budget.pending = max(0.0, budget.pending - pending)
+		metrics.budget_reconciliations.labels(result="success").inc(len(spend))
+
+	async def _fetch_spend(self, user_ids: list[str]) -> dict[str, dict]:
+		if env.USER_DB_FAST_PATH:
+			try:
+				rows = await litellm_pg.get_spend(user_ids)
+				return {row["user_id"]: row for row in rows}
+			except Exception as e:
+				print(f"DB spend lookup failed, falling back to LiteLLM API: {e}")
+
+		semaphore = asyncio.Semaphore(20)
+
+		async def fetch(user_id: str) -> dict:
+			async with semaphore, upstream_pool.use() as backend:
+				response = await litellm_http.client.get(
+					backend.url("/customer/info"),
+					params={"end_user_id": user_id},
+					headers=LITELLM_HEADERS,
+				)
+				response.raise_for_status()
+				return response.json()
+
+		users = await asyncio.gather(*(fetch(user_id) for user_id in user_ids))
+		return {user_id: user for user_id, user in zip(user_ids, users)}
+
+	async def reconcile_forever(self):
+		while True:
+			await asyncio.sleep(env.BUDGET_RECONCILE_INTERVAL_SECONDS)
+			await self.reconcile()
+
+
+budget_tracker = BudgetTracker()
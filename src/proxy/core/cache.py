@@ -0,0 +1,127 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+from .config import env
+from .prometheus_metrics import metrics
+
+
+class TTLCache:
+	"""
+	Bounded in-process LRU cache whose entries expire after `ttl` seconds.
+	Optionally also bounded by `max_bytes`, using the size given to `set`.
+	Hits, misses, evictions and bytes are exported under the cache's `name`.
+	"""
+
+	def __init__(
+		self,
+		name: str,
+		max_size: int,
+		ttl: float | None = None,
+		max_bytes: int | None = None,
+	):
+		self.name = name
+		self.max_size = max_size
+		self.ttl = ttl
+		self.max_bytes = max_bytes
+		self.size_bytes = 0
+		self._data: OrderedDict[Hashable, tuple[float | None, Any, int]] = OrderedDict()
+
+	def get(self, key: Hashable, default: Any = None) -> Any:
+		entry = self._data.get(key)
+		if entry is not None:
+			expires_at, value, _ = entry
+			if expires_at is None or expires_at > time.monotonic():
+				self._data.move_to_end(key)
+				metrics.cache_requests.labels(cache=self.name, result="hit").inc()
+				return value
+			self.pop(key)
+		metrics.cache_requests.labels(cache=self.name, result="miss").inc()
+		return default
+
+	def set(self, key: Hashable, value: Any, ttl: float | None = None, size: int = 0):
+		"""Store `value`, optionally with a shorter/longer `ttl` than the default."""
+		if self.max_bytes is not None and size > self.max_bytes:
+			return
+		ttl = self.ttl if ttl is None else ttl
+		expires_at = time.monotonic() + ttl if ttl is not None else None
+		self.pop(key)
+		self._data[key] = (expires_at, value, size)
+		self.size_bytes += size
+		while len(self._data) > self.max_size or (
+			self.max_bytes is not None and self.size_bytes > self.max_bytes
+		):
+			_, (_, _, evicted_size) = self._data.popitem(last=False)
+			self.size_bytes -= evicted_size
+			metrics.cache_evictions.labels(cache=self.name).inc()
+		if self.max_bytes is not None:
+			metrics.cache_bytes.labels(cache=self.name).set(self.size_bytes)
+
+	def pop(self, key: Hashable, default: Any = None) -> Any:
+		entry = self._data.pop(key, None)
+		if entry is None:
+			return default
+		self.size_bytes -= entry[2]
+		return entry[1]
+
+	def clear(self):
+		self._data.clear()
+		self.size_bytes = 0
+
+	def __contains__(self, key: Hashable) -> bool:
+		entry = self._data.get(key)
+		return entry is not None and (entry[0] is None or entry[0] > time.monotonic())
+
+	def __len__(self) -> int:
+		return len(self._data)
+
+
+class SingleFlight:
+	"""
+	Collapses concurrent calls for the same key into one in-flight call.
+	The call runs as its own task, so a cancelled caller doesn't fail the others.
+	"""
+
+	def __init__(self):
+		self._calls: dict[Hashable, asyncio.Task] = {}
+
+	async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+		task = self._calls.get(key)
+		if task is None:
+			task = asyncio.ensure_future(fn())
+			self._calls[key] = task
+			task.add_done_callback(lambda t: self._done(key, t))
+		return await asyncio.shield(task)
+
+	def _done(self, key: Hashable, task: asyncio.Task):
+		if self._calls.get(key) is task:
+			del self._calls[key]
+		if not task.cancelled():
+			task.exception()  # mark retrieved if every caller went away
+
+	def __contains__(self, key: Hashable) -> bool:
+		return key in self._calls
+
+
+user_cache = TTLCache(
+	"user", max_size=env.USER_CACHE_MAX_SIZE, ttl=env.USER_CACHE_TTL_SECONDS
+)
+
+# user_id -> UserBudget, the locally tracked budget and running spend
+budget_cache = TTLCache(
+	"budget", max_size=env.BUDGET_CACHE_MAX_SIZE, ttl=env.BUDGET_CACHE_TTL_SECONDS
+)
+
+# key_id -> deserialized App Attest public key (keys never change once attested)
+public_key_cache = TTLCache(
+	"app_attest_key", max_size=env.APP_ATTEST_KEY_CACHE_MAX_SIZE
+)
+
+# Opt-in exact-match cache of non-streaming completion responses
+response_cache = TTLCache(
+	"response",
+	max_size=env.RESPONSE_CACHE_MAX_SIZE,
+	ttl=env.RESPONSE_CACHE_TTL_SECONDS,
+	max_bytes=env.RESPONSE_CACHE_MAX_BYTES,
+)
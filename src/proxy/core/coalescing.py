@@ -0,0 +1,130 @@
+import asyncio
+from typing import AsyncIterator, Callable
+
+from .prometheus_metrics import metrics
+
+
+class StreamBroadcast:
+	"""
+	Fans a single upstream byte stream out to any number of subscribers.
+	Chunks are kept so late joiners replay the prefix they missed. Each
+	subscriber leaves independently; the upstream is cancelled only once
+	nobody is listening anymore. The source may fill in `summary` (e.g. its
+	token usage) for subscribers to account once they have read everything.
+	"""
+
+	def __init__(
+		self,
+		source_factory: Callable[[dict], AsyncIterator[bytes]],
+		on_done: Callable[[], None],
+	):
+		self.summary: dict = {}
+		self._chunks: list[bytes] = []
+		self._done = False
+		self._subscribers = 0
+		self._updated = asyncio.Event()
+		self._on_done = on_done
+		self._task = asyncio.ensure_future(self._pump(source_factory(self.summary)))
+		# Also runs if the pump is cancelled before it ever started
+		self._task.add_done_callback(lambda _: self._finish())
+
+	async def _pump(self, source: AsyncIterator[bytes]):
+		try:
+			async for chunk in source:
+				self._chunks.append(chunk)
+				self._notify()
+		finally:
+			await source.aclose()
+			self._finish()
+
+	def _finish(self):
+		if self._done:
+			return
+		self._done = True
+		self._on_done()
+		self._notify()
+
+	def _notify(self):
+		# Wake everyone waiting on the current event and start a fresh one
+		self._updated.set()
+		self._updated = asyncio.Event()
+
+	def subscribe(
+		self,
+		on_complete: Callable[[dict], None] | None = None,
+		on_close: list[Callable[[], None]] | None = None,
+	) -> AsyncIterator[bytes]:
+		# Counted here rather than on first iteration, so the upstream isn't
+		# cancelled between the leader leaving and a follower starting. Leaving
+		# is also appended to `on_close`, for responses whose body is never read
+		self._subscribers += 1
+		left = False
+
+		def leave():
+			nonlocal left
+			if left:
+				return
+			left = True
+			self._subscribers -= 1
+			if self._subscribers == 0 and not self._done:
+				self._task.cancel()
+
+		if on_close is not None:
+			on_close.append(leave)
+		return self._iterate(on_complete, leave)
+
+	async def _iterate(
+		self, on_complete: Callable[[dict], None] | None, leave: Callable[[], None]
+	) -> AsyncIterator[bytes]:
+		index = 0
+		try:
+			while True:
+				while index < len(self._chunks):
+					yield self._chunks[index]
+					index += 1
+				if self._done:
+					if on_complete is not None:
+						on_complete(self.summary)
+					return
+				await self._updated.wait()
+		finally:
+			leave()
+
+
+class StreamCoalescer:
+	"""Shares one upstream stream between concurrent requests with the same key."""
+
+	def __init__(self):
+		self._streams: dict[str, StreamBroadcast] = {}
+
+	def __contains__(self, key: str) -> bool:
+		return key in self._streams
+
+	def subscribe(
+		self,
+		key: str,
+		source_factory: Callable[[dict], AsyncIterator[bytes]] | None,
+		on_complete: Callable[[dict], None] | None = None,
+		on_close: list[Callable[[], None]] | None = None,
+		on_source_done: Callable[[], None] | None = None,
+	) -> AsyncIterator[bytes]:
+		"""
+		Joins the stream for `key`, starting it from `source_factory` if there is
+		none. `on_complete` is called with the stream's summary once this
+		subscriber has read it to the end, and this subscriber's release is
+		appended to `on_close`. A new stream calls `on_source_done` once its
+		source has finished or been cancelled.
+		"""
+		broadcast = self._streams.get(key)
+		if broadcast is None:
+
+			def done():
+				self._streams.pop(key, None)
+				if on_source_done is not None:
+					on_source_done()
+
+			broadcast = StreamBroadcast(source_factory, on_done=done)
+			self._streams[key] = broadcast
+		else:
+			metrics.coalesced_requests.labels(mode="stream").inc()
+		return broadcast.subscribe(on_complete, on_close)
@@ -0,0 +1,171 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from .config import env
+from .prometheus_metrics import metrics
+from .resilience import is_upstream_failure
+
+
+class UpstreamOverloaded(Exception):
+	pass
+
+
+class AdaptiveConcurrencyLimiter:
+	"""
+	AIMD limit on concurrent upstream requests. The limit grows by roughly one
+	per `limit` requests that succeed within their latency target and is cut
+	multiplicatively on upstream failures or slow responses, at most once per
+	generation of requests: those already in flight at a cut can't cut it again.
+	Requests over the limit wait in a bounded FIFO queue and are shed when it is
+	full or their deadline passes.
+	"""
+
+	def __init__(
+		self,
+		initial_limit: int,
+		min_limit: int,
+		max_limit: int,
+		backoff_ratio: float,
+		max_queue: int,
+		queue_timeout: float,
+	):
+		self.limit = float(initial_limit)
+		self.min_limit = min_limit
+		self.max_limit = max_limit
+		self.backoff_ratio = backoff_ratio
+		self.max_queue = max_queue
+		self.queue_timeout = queue_timeout
+		self.in_flight = 0
+		self._last_decrease = float("-inf")
+		self._waiters: deque[asyncio.Future] = deque()
+		metrics.upstream_concurrency_limit.set(int(self.limit))
+
+	def _shed(self, reason: str):
+		metrics.upstream_shed.labels(reason=reason).inc()
+		raise UpstreamOverloaded(f"Upstream overloaded ({reason})")
+
+	async def acquire(self):
+		if self.in_flight < int(self.limit) and not self._waiters:
+			self.in_flight += 1
+			metrics.upstream_in_flight.set(self.in_flight)
+			return
+		if len(self._waiters) >= self.max_queue:
+			self._shed("queue_full")
+
+		waiter = asyncio.get_running_loop().create_future()
+		self._waiters.append(waiter)
+		metrics.upstream_queue_depth.set(len(self._waiters))
+		try:
+			await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+		except asyncio.TimeoutError:
+			if not waiter.done():
+				waiter.cancel()
+				self._shed("timeout")
+		except asyncio.CancelledError:
+			if waiter.done() and not waiter.cancelled():
+				self.release()  # the slot was handed over as we were cancelled
+			waiter.cancel()
+			raise
+		finally:
+			if waiter in self._waiters:
+				self._waiters.remove(waiter)
+			metrics.upstream_queue_depth.set(len(self._waiters))
+
+	def release(
+		self,
+		latency: float | None = None,
+		target: float | None = None,
+		success: bool = True,
+	):
+		"""Frees a slot; pass the observed latency and its target to adapt the limit."""
+		if latency is not None and target is not None:
+			now = time.monotonic()
+			if success and latency <= target:
+				self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+			elif now - latency >= self._last_decrease:
+				self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+				self._last_decrease = now
+			metrics.upstream_concurrency_limit.set(int(self.limit))
+		self.in_flight -= 1
+		# Hand freed slots directly to the oldest waiters
+		while self._waiters and self.in_flight < int(self.limit):
+			waiter = self._waiters.popleft()
+			if not waiter.done():
+				self.in_flight += 1
+				waiter.set_result(None)
+		metrics.upstream_in_flight.set(self.in_flight)
+		metrics.upstream_queue_depth.set(len(self._waiters))
+
+	@asynccontextmanager
+	async def slot(self, target: float):
+		await self.acquire()
+		start_time = time.monotonic()
+		try:
+			yield
+		except Exception as e:
+			if is_upstream_failure(e):
+				self.release(time.monotonic() - start_time, target, success=False)
+			else:
+				# Client errors (e.g. a 4xx) say nothing about upstream capacity
+				self.release()
+			raise
+		except BaseException:
+			self.release()
+			raise
+		self.release(time.monotonic() - start_time, target)
+
+	async def stream_slot(self, target: float) -> "StreamSlot":
+		await self.acquire()
+		return StreamSlot(self, target)
+
+
+class StreamSlot:
+	"""
+	A slot held for the life of a streaming response. `track` adapts the limit
+	on the stream's time to first chunk; `release` frees the slot exactly once,
+	and must also be called by the response in case the stream is never iterated.
+	"""
+
+	def __init__(self, limiter: AdaptiveConcurrencyLimiter, target: float):
+		self.limiter = limiter
+		self.target = target
+		self._start_time = time.monotonic()
+		self._ttft: float | None = None
+		self._released = False
+
+	async def track(self, stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+		try:
+			async for chunk in stream:
+				if self._ttft is None:
+					self._ttft = time.monotonic() - self._start_time
+				yield chunk
+		finally:
+			self.release()
+
+	def release(self):
+		if self._released:
+			return
+		self._released = True
+		if self._ttft is not None:
+			self.limiter.release(self._ttft, self.target)
+			return
+		# Nothing was streamed: a client error, an abandoned response or an
+		# upstream error swallowed by the stream. Only slowness is a signal
+		elapsed = time.monotonic() - self._start_time
+		if elapsed > self.target:
+			self.limiter.release(elapsed, self.target)
+		else:
+			self.limiter.release()
+
+
+upstream_limiter = AdaptiveConcurrencyLimiter(
+	initial_limit=env.UPSTREAM_CONCURRENCY_INITIAL,
+	min_limit=env.UPSTREAM_CONCURRENCY_MIN,
+	max_limit=env.UPSTREAM_CONCURRENCY_MAX,
+	backoff_ratio=env.UPSTREAM_CONCURRENCY_BACKOFF,
+	max_queue=env.UPSTREAM_QUEUE_MAX_SIZE,
+	queue_timeout=env.UPSTREAM_QUEUE_TIMEOUT_SECONDS,
+)
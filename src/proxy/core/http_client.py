@@ -0,0 +1,54 @@
+import httpx
+
+from .config import env
+
+
+class HTTPClientService:
+	"""
+	Long-lived, pooled httpx client. Opened in the app lifespan so keep-alive
+	connections are reused across requests; each upstream gets its own service
+	so one can't exhaust the other's connection pool.
+	"""
+
+	def __init__(
+		self,
+		max_connections: int,
+		max_keepalive_connections: int,
+		http2: bool = False,
+	):
+		self.max_connections = max_connections
+		self.max_keepalive_connections = max_keepalive_connections
+		self.http2 = http2
+		self._client: httpx.AsyncClient | None = None
+
+	@property
+	def client(self) -> httpx.AsyncClient:
+		# Lazily created so code paths running outside the lifespan still work
+		if self._client is None or self._client.is_closed:
+			self._client = httpx.AsyncClient(
+				limits=httpx.Limits(
+					max_connections=self.max_connections,
+					max_keepalive_connections=self.max_keepalive_connections,
+					keepalive_expiry=env.HTTPX_KEEPALIVE_EXPIRY_SECONDS,
+				),
+				http2=self.http2,
+			)
+		return self._client
+
+	async def connect(self):
+		_ = self.client
+
+	async def disconnect(self):
+		if self._client is not None:
+			await self._client.aclose()
+			self._client = None
+
+
+# Every LiteLLM call: completions, user lookups, health probes
+litellm_http = HTTPClientService(
+	max_connections=env.HTTPX_MAX_CONNECTIONS,
+	max_keepalive_connections=env.HTTPX_MAX_KEEPALIVE_CONNECTIONS,
+	http2=env.HTTPX_HTTP2,
+)
+# FxA JWKS refreshes, which are infrequent
+fxa_http = HTTPClientService(max_connections=4, max_keepalive_connections=1)
@@ -0,0 +1,71 @@
+import time
+from typing import Iterable
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .config import env
+from .prometheus_metrics import metrics
+from .timing import metrics_log, start_request_timer
+
+
+class InstrumentationMiddleware:
+	"""
+	Pure ASGI middleware that measures request latency, counts total requests,
+	and tracks requests in progress. Requests are timed to their last body
+	message, so streaming responses count as in progress until the stream ends.
+	Messages are passed through untouched.
+	"""
+
+	def __init__(self, app: ASGIApp, skip_paths: Iterable[str] = ()):
+		self.app = app
+		self.skip_paths = tuple(skip_paths)
+
+	async def __call__(self, scope: Scope, receive: Receive, send: Send):
+		if scope["type"] != "http" or scope["path"].startswith(self.skip_paths):
+			await self.app(scope, receive, send)
+			return
+
+		start_time = time.time()
+		status_code = 500
+		finished = False
+		timer = start_request_timer()
+		metrics.in_progress_requests.inc()
+
+		def finish():
+			nonlocal finished
+			finished = True
+			# The router stores the matched route in the shared scope
+			route = scope.get("route")
+			endpoint = route.path if route else scope["path"]
+			method = scope["method"]
+			metrics.request_latency.labels(method=method, endpoint=endpoint).observe(
+				time.time() - start_time
+			)
+			metrics.requests_total.labels(method=method, endpoint=endpoint).inc()
+			metrics.response_status_codes.labels(status_code=status_code).inc()
+			metrics.in_progress_requests.dec()
+			if env.METRICS_LOG_ENABLED and timer.stages:
+				metrics_log.write(
+					{"timestamp": start_time, **timer.stages, "total": timer.elapsed()}
+				)
+
+		async def send_wrapper(message: Message):
+			nonlocal status_code
+			if message["type"] == "http.response.start":
+				status_code = message["status"]
+				await send(message)
+			elif message["type"] == "http.response.body" and not message.get(
+				"more_body", False
+			):
+				await send(message)
+				if not finished:
+					finish()
+			else:
+				await send(message)
+
+		try:
+			await self.app(scope, receive, send_wrapper)
+		finally:
+			# The app raised or the client went away before the last body message
+			if not finished:
+				finish()
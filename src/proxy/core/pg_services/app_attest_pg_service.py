@@ -1,3 +1,4 @@
+from ..cache import public_key_cache
 from ..config import env
 from .pg_service import PGService
 
@@ -9,7 +10,7 @@ class AppAttestPGService(PGService):
 	# Challenges #
 	async def store_challenge(self, key_id: str, challenge: str):
 		try:
-			await self.pg.execute(
+			await self.execute(
 				"""
 				INSERT INTO challenges (key_id, challenge)
 				VALUES ($1, $2)
@@ -25,22 +26,54 @@ class AppAttestPGService(PGService):
 
 	async def get_challenge(self, key_id: str) -> dict | None:
 		try:
-			return await self.pg.fetchrow(
+			return await self.fetchrow(
 				"SELECT challenge, created_at FROM challenges WHERE key_id = $1", key_id
 			)
 		except Exception as e:
 			print(f"Error retrieving challenge: {e}")
 
+	async def consume_challenge(self, key_id: str) -> dict | None:
+		"""Atomically fetch and delete the challenge for key_id (one use only)."""
+		try:
+			return await self.fetchrow(
+				"DELETE FROM challenges WHERE key_id = $1 RETURNING challenge, created_at",
+				key_id,
+			)
+		except Exception as e:
+			print(f"Error consuming challenge: {e}")
+
+	async def delete_expired_challenges(
+		self, max_age_seconds: float, batch_size: int
+	) -> int:
+		"""Deletes up to batch_size expired challenges, returning how many were removed."""
+		try:
+			status = await self.execute(
+				"""
+				DELETE FROM challenges WHERE key_id IN (
+					SELECT key_id FROM challenges
+					WHERE created_at < NOW() - make_interval(secs => $1)
+					LIMIT $2
+					FOR UPDATE SKIP LOCKED
+				)
+				""",
+				float(max_age_seconds),
+				batch_size,
+			)
+			return int(status.split()[-1])  # "DELETE <count>"
+		except Exception as e:
+			print(f"Error deleting expired challenges: {e}")
+			return 0
+
 	async def delete_challenge(self, key_id: str):
 		try:
-			await self.pg.execute("DELETE FROM challenges WHERE key_id = $1", key_id)
+			await self.execute("DELETE FROM challenges WHERE key_id = $1", key_id)
 		except Exception as e:
 			print(f"Error deleting challenge: {e}")
 
 	# Keys #
 	async def store_key(self, key_id: str, public_key: str):
 		try:
-			await self.pg.execute(
+			await self.execute(
 				"""
 				INSERT INTO public_keys (key_id, public_key)
 				VALUES ($1, $2)
@@ -53,7 +86,7 @@ class AppAttestPGService(PGService):
 
 	async def get_key(self, key_id: str) -> str | None:
 		try:
-			record = await self.pg.fetchrow(
+			record = await self.fetchrow(
 				"""
 				SELECT public_key FROM public_keys
 				WHERE key_id = $1
@@ -68,7 +101,73 @@ class AppAttestPGService(PGService):
 			return None
 
 	async def delete_key(self, key_id: str):
+		public_key_cache.pop(key_id)
 		try:
-			await self.pg.execute("DELETE FROM public_keys WHERE key_id = $1", key_id)
+			await self.execute("DELETE FROM public_keys WHERE key_id = $1", key_id)
 		except Exception as e:
 			print(f"Error deleting key: {e}")
+
+	# Usage #
+	async def store_usage(self, rows: list[tuple]) -> bool:
+		"""
+		Adds (user_id, model, bucket_start, prompt_tokens, completion_tokens,
+		requests) rows onto the hourly rollups. Returns False if the write failed.
+		"""
+		try:
+			await self.executemany(
+				"""
+				INSERT INTO usage_rollups (
+					user_id, model, bucket_start, prompt_tokens, completion_tokens, requests
+				)
+				VALUES ($1, $2, $3, $4, $5, $6)
+				ON CONFLICT (user_id, model, bucket_start) DO UPDATE SET
+				prompt_tokens = usage_rollups.prompt_tokens + EXCLUDED.prompt_tokens,
+				completion_tokens = usage_rollups.completion_tokens + EXCLUDED.completion_tokens,
+				requests = usage_rollups.requests + EXCLUDED.requests
+				""",
+				rows,
+			)
+			return True
+		except Exception as e:
+			print(f"Error storing usage: {e}")
+			return False
+
+	async def get_user_usage(self, user_id: str, hours: int) -> list[dict] | None:
+		try:
+			records = await self.fetch(
+				"""
+				SELECT model, bucket_start, prompt_tokens, completion_tokens, requests
+				FROM usage_rollups
+				WHERE user_id = $1 AND bucket_start >= NOW() - make_interval(hours => $2)
+				ORDER BY bucket_start DESC, model
+				""",
+				user_id,
+				hours,
+			)
+			return [dict(record) for record in records]
+		except Exception as e:
+			print(f"Error retrieving usage: {e}")
+			return None
+
+	async def get_top_usage(self, hours: int, limit: int) -> list[dict] | None:
+		"""Users with the most tokens over the last `hours` hours."""
+		try:
+			records = await self.fetch(
+				"""
+				SELECT user_id,
+					SUM(prompt_tokens) AS prompt_tokens,
+					SUM(completion_tokens) AS completion_tokens,
+					SUM(requests) AS requests
+				FROM usage_rollups
+				WHERE bucket_start >= NOW() - make_interval(hours => $1)
+				GROUP BY user_id
+				ORDER BY SUM(prompt_tokens + completion_tokens) DESC
+				LIMIT $2
+				""",
+				hours,
+				limit,
+			)
+			return [dict(record) for record in records]
+		except Exception as e:
+			print(f"Error retrieving usage: {e}")
+			return None
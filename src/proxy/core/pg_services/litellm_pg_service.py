@@ -1,9 +1,17 @@
 from fastapi import Header, HTTPException
 
+from ..cache import budget_cache, user_cache
 from ..classes import UserUpdatePayload
 from ..config import env
 from .pg_service import PGService
 
+# Only the columns the proxy actually reads
+USER_COLUMNS = "user_id, alias, spend, budget_id, blocked"
+# End users joined with their budget, if any
+USERS_WITH_BUDGETS = (
+	'"LiteLLM_EndUserTable" LEFT JOIN "LiteLLM_BudgetTable" USING (budget_id)'
+)
+
 
 class LiteLLMPGService(PGService):
 	"""
@@ -14,10 +22,52 @@ class LiteLLMPGService(PGService):
 		super().__init__(env.LITELLM_DB_NAME)
 
 	async def get_user(self, user_id: str):
-		query = 'SELECT * FROM "LiteLLM_EndUserTable" WHERE user_id = $1'
-		user = await self.pg.fetchrow(query, user_id)
+		query = f"""
+			SELECT {USER_COLUMNS}, max_budget FROM {USERS_WITH_BUDGETS}
+			WHERE user_id = $1
+		"""
+		user = await self.fetchrow(query, user_id)
 		return dict(user) if user else None
 
+	async def get_or_create_user(self, user_id: str) -> tuple[dict, bool]:
+		"""
+		Returns the end user, inserting them first if they don't exist, in a single
+		round trip. The SELECT branch sees the pre-insert snapshot, so at most one
+		branch yields a row; neither does when another connection inserts the user
+		concurrently, in which case their row is re-read.
+		"""
+		query = f"""
+			WITH inserted AS (
+				INSERT INTO "LiteLLM_EndUserTable" (user_id, spend, blocked)
+				VALUES ($1, 0, false)
+				ON CONFLICT (user_id) DO NOTHING
+				RETURNING {USER_COLUMNS}
+			)
+			SELECT {USER_COLUMNS}, NULL::float8 AS max_budget, true AS created
+			FROM inserted
+			UNION ALL
+			SELECT {USER_COLUMNS}, max_budget, false AS created FROM {USERS_WITH_BUDGETS}
+			WHERE user_id = $1
+			LIMIT 1
+		"""
+		record = await self.fetchrow(query, user_id)
+		if record is None:
+			user = await self.get_user(user_id)
+			if user is None:
+				raise RuntimeError(f"User {user_id} was neither created nor found")
+			return user, False
+		record = dict(record)
+		was_created = record.pop("created")
+		return record, was_created
+
+	async def get_spend(self, user_ids: list[str]) -> list[dict]:
+		"""Current spend and max budget of several users, for budget reconciliation."""
+		query = f"""
+			SELECT user_id, spend, max_budget FROM {USERS_WITH_BUDGETS}
+			WHERE user_id = ANY($1::text[])
+		"""
+		return [dict(record) for record in await self.fetch(query, user_ids)]
+
 	async def update_user(
 		self, request: UserUpdatePayload, master_key: str = Header(...)
 	):
@@ -50,7 +100,7 @@ class LiteLLMPGService(PGService):
 			where_value_index = len(values) + 1
 
 			query = f'UPDATE "LiteLLM_EndUserTable" SET {set_clause} WHERE user_id = ${where_value_index} RETURNING *'
-			updated_user_record = await self.pg.fetchrow(query, *values, user_id)
+			updated_user_record = await self.fetchrow(query, *values, user_id)
 		except Exception as e:
 			raise HTTPException(
 				status_code=500, detail={"error": f"Error updating user: {e}"}
@@ -61,4 +111,7 @@ class LiteLLMPGService(PGService):
 				status_code=404, detail=f"User with user_id '{user_id}' not found."
 			)
 
+		# Drop the cached record so changes (e.g. blocked) apply immediately
+		user_cache.pop(user_id)
+		budget_cache.pop(user_id)
 		return dict(updated_user_record)
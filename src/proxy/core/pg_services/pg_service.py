@@ -1,22 +1,36 @@
+import asyncio
 import os
+import time
+from contextlib import asynccontextmanager
 
 import asyncpg
 
 from ..config import env
+from ..prometheus_metrics import metrics
 
 
 class PGService:
-	pg: asyncpg.Connection
+	pg: asyncpg.Pool | None = None
 
 	def __init__(self, db_name: str):
 		self.db_name = db_name
 		self.db_url = os.path.join(env.PG_DB_URL, db_name)
 		self.connected = False
+		self._last_connect_attempt = 0.0
+		self._connect_lock = asyncio.Lock()
 
 	async def connect(self):
+		self._last_connect_attempt = time.time()
 		try:
-			self.pg = await asyncpg.connect(self.db_url)
+			self.pg = await asyncpg.create_pool(
+				self.db_url,
+				min_size=env.PG_POOL_MIN_SIZE,
+				max_size=env.PG_POOL_MAX_SIZE,
+				command_timeout=env.PG_COMMAND_TIMEOUT_SECONDS,
+				max_inactive_connection_lifetime=env.PG_POOL_MAX_INACTIVE_SECONDS,
+			)
 			self.connected = True
+			metrics.pg_pool_size.labels(db=self.db_name).set(self.pg.get_size())
 			print(f"Connected to /{self.db_name}")
 		except Exception as e:
 			print(f"Error connecting to database: {e}")
@@ -26,7 +40,60 @@ class PGService:
 			await self.pg.close()
 			self.connected = False
 
+	async def _ensure_connected(self):
+		"""
+		Re-create the pool if the initial connect failed or the pool was lost.
+		Broken connections inside a live pool are replaced by asyncpg itself.
+		"""
+		if self.connected and not self.pg.is_closing():
+			return
+		async with self._connect_lock:
+			if self.connected and not self.pg.is_closing():
+				return
+			if (
+				time.time() - self._last_connect_attempt
+				>= env.PG_RECONNECT_INTERVAL_SECONDS
+			):
+				self.connected = False
+				await self.connect()
+		if not self.connected:
+			raise ConnectionError(f"Database /{self.db_name} is not connected")
+
+	@asynccontextmanager
+	async def acquire(self):
+		await self._ensure_connected()
+		start_time = time.time()
+		connection = await self.pg.acquire(timeout=env.PG_POOL_ACQUIRE_TIMEOUT_SECONDS)
+		metrics.pg_pool_acquire_latency.labels(db=self.db_name).observe(
+			time.time() - start_time
+		)
+		metrics.pg_pool_in_use.labels(db=self.db_name).inc()
+		try:
+			yield connection
+		finally:
+			await self.pg.release(connection)
+			metrics.pg_pool_in_use.labels(db=self.db_name).dec()
+			metrics.pg_pool_size.labels(db=self.db_name).set(self.pg.get_size())
+
+	async def execute(self, query: str, *args):
+		async with self.acquire() as connection:
+			return await connection.execute(query, *args)
+
+	async def executemany(self, query: str, args):
+		async with self.acquire() as connection:
+			return await connection.executemany(query, args)
+
+	async def fetch(self, query: str, *args):
+		async with self.acquire() as connection:
+			return await connection.fetch(query, *args)
+
+	async def fetchrow(self, query: str, *args):
+		async with self.acquire() as connection:
+			return await connection.fetchrow(query, *args)
+
 	def check_status(self):
 		if self.pg is None or not self.connected:
 			return False
-		return not self.pg.is_closed()
+		if self.pg.is_closing():
+			return False
+		return self.pg.get_size() > 0 or env.PG_POOL_MIN_SIZE == 0
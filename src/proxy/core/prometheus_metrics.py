@@ -1,7 +1,18 @@
+import glob
+import os
 from dataclasses import dataclass
 from enum import Enum
 
-from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client import (
+	CollectorRegistry,
+	Counter,
+	Gauge,
+	Histogram,
+	generate_latest,
+	multiprocess,
+)
+
+from .config import env
 
 
 class PrometheusResult(Enum):
@@ -21,12 +32,48 @@ class PrometheusMetrics:
 	validate_fxa_latency: Histogram
 	chat_completion_latency: Histogram
 	chat_completion_ttft: Histogram  # time to first token (when stream=True)
+	chat_inter_token_latency: Histogram
+	chat_tokens_per_second: Histogram
 	chat_tokens: Counter
+	pg_pool_size: Gauge
+	pg_pool_in_use: Gauge
+	pg_pool_acquire_latency: Histogram
+	cache_requests: Counter
+	cache_evictions: Counter
+	cache_bytes: Gauge
+	crypto_queue_depth: Gauge
+	crypto_queue_latency: Histogram
+	crypto_execution_latency: Histogram
+	coalesced_requests: Counter
+	rate_limit_decisions: Counter
+	rate_limit_tracked_users: Gauge
+	upstream_concurrency_limit: Gauge
+	upstream_in_flight: Gauge
+	upstream_queue_depth: Gauge
+	upstream_shed: Counter
+	circuit_breaker_state: Gauge
+	circuit_breaker_rejections: Counter
+	upstream_retries: Counter
+	hedged_requests: Counter
+	upstream_backend_outstanding: Gauge
+	upstream_backend_healthy: Gauge
+	upstream_backend_ewma_latency: Gauge
+	upstream_backend_requests: Counter
+	upstream_backend_ejections: Counter
+	usage_ledger_pending: Gauge
+	usage_ledger_flushes: Counter
+	usage_ledger_dropped: Counter
+	budget_rejections: Counter
+	budget_reconciliations: Counter
+	metrics_log_dropped: Counter
+	request_stage_latency: Histogram
 
 
 metrics = PrometheusMetrics(
 	in_progress_requests=Gauge(
-		"in_progress_requests", "Number of requests currently in progress."
+		"in_progress_requests",
+		"Number of requests currently in progress.",
+		multiprocess_mode="livesum",
 	),
 	requests_total=Counter(
 		"requests_total",
@@ -57,20 +104,236 @@ metrics = PrometheusMetrics(
 	validate_fxa_latency=Histogram(
 		"validate_fxa_latency_seconds",
 		"FxA authentication latency in seconds.",
-		["result"],
+		["result", "source"],
 	),
 	chat_completion_latency=Histogram(
 		"chat_completion_latency_seconds",
 		"Chat completion latency in seconds.",
-		["result"],
+		["model", "result"],
+		buckets=env.COMPLETION_LATENCY_BUCKETS,
 	),
 	chat_completion_ttft=Histogram(
 		"chat_completion_ttft_seconds",
 		"Time to first token for streaming chat completions in seconds.",
+		["model"],
+		buckets=env.TTFT_BUCKETS,
+	),
+	chat_inter_token_latency=Histogram(
+		"chat_inter_token_latency_seconds",
+		"Time between content frames of streaming chat completions in seconds.",
+		["model"],
+		buckets=env.INTER_TOKEN_LATENCY_BUCKETS,
+	),
+	chat_tokens_per_second=Histogram(
+		"chat_tokens_per_second",
+		"Output tokens per second after the first token for streaming chat completions.",
+		["model"],
+		buckets=env.TOKENS_PER_SECOND_BUCKETS,
 	),
 	chat_tokens=Counter(
 		"chat_tokens",
 		"Number of tokens for chat completions.",
-		["type"],
+		["model", "type"],
+	),
+	pg_pool_size=Gauge(
+		"pg_pool_size",
+		"Number of open connections in the PostgreSQL pool.",
+		["db"],
+		multiprocess_mode="livesum",
+	),
+	pg_pool_in_use=Gauge(
+		"pg_pool_in_use",
+		"Number of PostgreSQL pool connections currently checked out.",
+		["db"],
+		multiprocess_mode="livesum",
+	),
+	pg_pool_acquire_latency=Histogram(
+		"pg_pool_acquire_latency_seconds",
+		"Time spent waiting to acquire a PostgreSQL pool connection in seconds.",
+		["db"],
+	),
+	cache_requests=Counter(
+		"cache_requests_total",
+		"In-process cache lookups by cache and result (hit/miss).",
+		["cache", "result"],
+	),
+	cache_evictions=Counter(
+		"cache_evictions_total",
+		"Entries evicted from in-process caches because they were full.",
+		["cache"],
+	),
+	cache_bytes=Gauge(
+		"cache_bytes",
+		"Approximate size of byte-budgeted in-process caches.",
+		["cache"],
+		multiprocess_mode="livesum",
+	),
+	crypto_queue_depth=Gauge(
+		"crypto_queue_depth",
+		"App Attest verifications submitted to the crypto executor and not yet finished.",
+		["operation"],
+		multiprocess_mode="livesum",
+	),
+	crypto_queue_latency=Histogram(
+		"crypto_queue_latency_seconds",
+		"Time App Attest verifications waited for a crypto worker in seconds.",
+		["operation"],
+	),
+	crypto_execution_latency=Histogram(
+		"crypto_execution_latency_seconds",
+		"Time spent running App Attest verifications on a crypto worker in seconds.",
+		["operation"],
+	),
+	coalesced_requests=Counter(
+		"coalesced_requests_total",
+		"Completion requests served by joining an identical in-flight upstream call.",
+		["mode"],
+	),
+	rate_limit_decisions=Counter(
+		"rate_limit_decisions_total",
+		"Per-user rate limiter decisions.",
+		["decision"],
+	),
+	rate_limit_tracked_users=Gauge(
+		"rate_limit_tracked_users",
+		"Number of users currently tracked by the rate limiter.",
+		multiprocess_mode="livesum",
+	),
+	upstream_concurrency_limit=Gauge(
+		"upstream_concurrency_limit",
+		"Current adaptive limit on concurrent upstream completion requests.",
+		multiprocess_mode="livesum",
+	),
+	upstream_in_flight=Gauge(
+		"upstream_in_flight",
+		"Upstream completion requests currently holding a concurrency slot.",
+		multiprocess_mode="livesum",
+	),
+	upstream_queue_depth=Gauge(
+		"upstream_queue_depth",
+		"Completion requests waiting for an upstream concurrency slot.",
+		multiprocess_mode="livesum",
+	),
+	upstream_shed=Counter(
+		"upstream_shed_total",
+		"Completion requests rejected with 503 because upstream is saturated.",
+		["reason"],
+	),
+	circuit_breaker_state=Gauge(
+		"circuit_breaker_state",
+		"Circuit breaker state: 0 closed, 1 half-open, 2 open.",
+		["circuit"],
+		multiprocess_mode="livemax",
+	),
+	circuit_breaker_rejections=Counter(
+		"circuit_breaker_rejections_total",
+		"Requests failed fast because the circuit was open.",
+		["circuit"],
+	),
+	upstream_retries=Counter(
+		"upstream_retries_total",
+		"Retried non-streaming upstream completion attempts.",
+		["reason"],
+	),
+	hedged_requests=Counter(
+		"hedged_requests_total",
+		"Non-streaming completions that fired a hedge request, by which attempt won.",
+		["winner"],
+	),
+	upstream_backend_outstanding=Gauge(
+		"upstream_backend_outstanding",
+		"Requests currently outstanding against each LiteLLM backend.",
+		["backend"],
+		multiprocess_mode="livesum",
+	),
+	upstream_backend_healthy=Gauge(
+		"upstream_backend_healthy",
+		"Whether each LiteLLM backend is in rotation (1) or ejected (0).",
+		["backend"],
+		multiprocess_mode="livemin",
+	),
+	upstream_backend_ewma_latency=Gauge(
+		"upstream_backend_ewma_latency_seconds",
+		"EWMA of observed latency (TTFT for streams) per LiteLLM backend.",
+		["backend"],
+		multiprocess_mode="liveall",
+	),
+	upstream_backend_requests=Counter(
+		"upstream_backend_requests_total",
+		"Requests sent to each LiteLLM backend, by result.",
+		["backend", "result"],
+	),
+	upstream_backend_ejections=Counter(
+		"upstream_backend_ejections_total",
+		"Times each LiteLLM backend was ejected after repeated failures.",
+		["backend"],
+	),
+	usage_ledger_pending=Gauge(
+		"usage_ledger_pending_rows",
+		"Aggregated usage rows waiting to be flushed to Postgres.",
+		multiprocess_mode="livesum",
+	),
+	usage_ledger_flushes=Counter(
+		"usage_ledger_flushes_total",
+		"Usage ledger flushes to Postgres, by result.",
+		["result"],
+	),
+	usage_ledger_dropped=Counter(
+		"usage_ledger_dropped_rows_total",
+		"Usage rows dropped because the ledger was full while Postgres was failing.",
+	),
+	budget_rejections=Counter(
+		"budget_rejections_total",
+		"Chat requests rejected locally because the user is over budget.",
+	),
+	budget_reconciliations=Counter(
+		"budget_reconciliations_total",
+		"Users whose local spend was reconciled with LiteLLM, by result.",
+		["result"],
+	),
+	metrics_log_dropped=Counter(
+		"metrics_log_dropped_total",
+		"Per-request timing entries dropped instead of written to METRICS_LOG_FILE.",
+	),
+	request_stage_latency=Histogram(
+		"request_stage_latency_seconds",
+		"Duration of each stage of a chat request (auth, user lookup, upstream, ...).",
+		["stage"],
+		buckets=env.STAGE_LATENCY_BUCKETS,
 	),
 )
+
+
+def model_label(model: str | None) -> str:
+	"""Bounds the cardinality of "model" labels to the configured models."""
+	if model in env.METRICS_MODELS or model == env.MODEL_NAME:
+		return model
+	return "other"
+
+
+def prepare_multiprocess_dir(path: str):
+	"""
+	Points prometheus_client at a shared directory, clearing metric files left
+	by previous runs. Only `*.db` files are removed, in case the directory is
+	shared. Must run before worker processes import prometheus_client, i.e. in
+	the parent process.
+	"""
+	os.makedirs(path, exist_ok=True)
+	for stale in glob.glob(os.path.join(path, "*.db")):
+		os.remove(stale)
+	os.environ["PROMETHEUS_MULTIPROC_DIR"] = path
+
+
+def latest_metrics() -> bytes:
+	"""Renders all metrics, aggregated across workers in multi-process mode."""
+	if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+		return generate_latest()
+	registry = CollectorRegistry()
+	multiprocess.MultiProcessCollector(registry)
+	return generate_latest(registry)
+
+
+def mark_worker_dead():
+	"""Drops this worker's live gauges from the multi-process aggregate."""
+	if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+		multiprocess.mark_process_dead(os.getpid())
@@ -0,0 +1,118 @@
+import time
+from collections import OrderedDict
+
+from .config import env
+from .prometheus_metrics import metrics
+
+
+class _UserBuckets:
+	__slots__ = ("requests", "tokens", "streams", "updated_at")
+
+	def __init__(self, requests: float, tokens: float, now: float):
+		self.requests = requests
+		self.tokens = tokens
+		self.streams = 0
+		self.updated_at = now
+
+
+class UserRateLimiter:
+	"""
+	In-process per-user limits: a requests/second token bucket, a tokens/minute
+	bucket that is charged with actual usage after each completion, and a cap on
+	concurrent streams. Users are kept in recency order, so every update is O(1)
+	and idle users are evicted from the front.
+	"""
+
+	def __init__(
+		self,
+		requests_per_second: float,
+		request_burst: int,
+		tokens_per_minute: int,
+		max_concurrent_streams: int,
+		idle_seconds: float,
+		max_users: int,
+	):
+		self.requests_per_second = requests_per_second
+		self.request_burst = request_burst
+		self.tokens_per_second = tokens_per_minute / 60
+		self.token_burst = tokens_per_minute
+		self.max_concurrent_streams = max_concurrent_streams
+		self.idle_seconds = idle_seconds
+		self.max_users = max_users
+		self._users: OrderedDict[str, _UserBuckets] = OrderedDict()
+
+	def _buckets(self, user_id: str) -> _UserBuckets:
+		now = time.monotonic()
+		buckets = self._users.get(user_id)
+		if buckets is None:
+			buckets = _UserBuckets(self.request_burst, self.token_burst, now)
+			self._users[user_id] = buckets
+			self._evict(now)
+		else:
+			elapsed = now - buckets.updated_at
+			buckets.requests = min(
+				self.request_burst,
+				buckets.requests + elapsed * self.requests_per_second,
+			)
+			buckets.tokens = min(
+				self.token_burst, buckets.tokens + elapsed * self.tokens_per_second
+			)
+			buckets.updated_at = now
+			self._users.move_to_end(user_id)
+		return buckets
+
+	def _evict(self, now: float):
+		# Only ever looks at the least recently used entries
+		while self._users:
+			user_id, oldest = next(iter(self._users.items()))
+			idle = now - oldest.updated_at > self.idle_seconds and not oldest.streams
+			if not idle and len(self._users) <= self.max_users:
+				break
+			del self._users[user_id]
+		metrics.rate_limit_tracked_users.set(len(self._users))
+
+	def check(self, user_id: str, stream: bool = False) -> tuple[str, float]:
+		"""
+		Takes one request from the user's bucket if allowed.
+		Returns (decision, retry_after_seconds).
+		"""
+		buckets = self._buckets(user_id)
+		if stream and buckets.streams >= self.max_concurrent_streams:
+			return "rejected_streams", 1.0
+		if buckets.tokens <= 0:
+			return "rejected_tokens", (1 - buckets.tokens) / self.tokens_per_second
+		if buckets.requests < 1:
+			return "rejected_requests", (
+				1 - buckets.requests
+			) / self.requests_per_second
+		buckets.requests -= 1
+		return "allowed", 0.0
+
+	def record_tokens(self, user_id: str, tokens: int):
+		"""Charges actual usage; the bucket may go negative and block later requests."""
+		self._buckets(user_id).tokens -= tokens
+
+	def acquire_stream(self, user_id: str) -> bool:
+		buckets = self._buckets(user_id)
+		if buckets.streams >= self.max_concurrent_streams:
+			return False
+		buckets.streams += 1
+		return True
+
+	def release_stream(self, user_id: str):
+		buckets = self._users.get(user_id)
+		if buckets is not None and buckets.streams > 0:
+			buckets.streams -= 1
+
+	def clear(self):
+		self._users.clear()
+
+
+rate_limiter = UserRateLimiter(
+	requests_per_second=env.RATE_LIMIT_REQUESTS_PER_SECOND,
+	request_burst=env.RATE_LIMIT_REQUEST_BURST,
+	tokens_per_minute=env.RATE_LIMIT_TOKENS_PER_MINUTE,
+	max_concurrent_streams=env.RATE_LIMIT_MAX_CONCURRENT_STREAMS,
+	idle_seconds=env.RATE_LIMIT_IDLE_SECONDS,
+	max_users=env.RATE_LIMIT_MAX_USERS,
+)
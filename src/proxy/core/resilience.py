@@ -0,0 +1,145 @@
+import asyncio
+import math
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, TypeVar
+
+import httpx
+
+from .prometheus_metrics import metrics
+
+T = TypeVar("T")
+
+CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+# Failures where the request never reached, or was refused by, the upstream
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+RETRYABLE_STATUS_CODES = {502, 503}
+
+
+class CircuitOpen(Exception):
+	pass
+
+
+def is_retryable(e: Exception) -> bool:
+	if isinstance(e, httpx.HTTPStatusError):
+		return e.response.status_code in RETRYABLE_STATUS_CODES
+	return isinstance(e, RETRYABLE_ERRORS)
+
+
+def is_upstream_failure(e: Exception) -> bool:
+	"""Errors that say something about upstream health, as opposed to a bad request."""
+	if isinstance(e, httpx.HTTPStatusError):
+		return e.response.status_code >= 500
+	return isinstance(e, httpx.TransportError)
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+	"""Full-jitter exponential backoff."""
+	return random.uniform(0, min(cap, base * 2**attempt))
+
+
+class CircuitBreaker:
+	"""
+	Opens after `failure_threshold` consecutive upstream failures so callers
+	fail fast instead of waiting out timeouts. After `reset_timeout` seconds a
+	single probe is let through; its outcome closes or re-opens the circuit.
+	"""
+
+	def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+		self.name = name
+		self.failure_threshold = failure_threshold
+		self.reset_timeout = reset_timeout
+		self.failures = 0
+		self.opened_at = 0.0
+		self.probing = False
+		self._set_state(CLOSED)
+
+	def _set_state(self, state: int):
+		self.state = state
+		metrics.circuit_breaker_state.labels(circuit=self.name).set(state)
+
+	def allow(self) -> bool:
+		if (
+			self.state == OPEN
+			and time.monotonic() - self.opened_at >= self.reset_timeout
+		):
+			self._set_state(HALF_OPEN)
+		if self.state == CLOSED:
+			return True
+		if self.state == HALF_OPEN and not self.probing:
+			self.probing = True
+			return True
+		metrics.circuit_breaker_rejections.labels(circuit=self.name).inc()
+		return False
+
+	def record_success(self):
+		self.failures = 0
+		self.probing = False
+		if self.state != CLOSED:
+			self._set_state(CLOSED)
+
+	def record_failure(self):
+		self.failures += 1
+		self.probing = False
+		if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+			self.opened_at = time.monotonic()
+			self._set_state(OPEN)
+
+	def release_probe(self):
+		"""Lets another probe through if the current one was abandoned."""
+		self.probing = False
+
+	def reset(self):
+		self.failures = 0
+		self.probing = False
+		self._set_state(CLOSED)
+
+
+class LatencyWindow:
+	"""Rolling window of recent latencies, used to derive the hedging delay."""
+
+	def __init__(self, size: int = 500, min_samples: int = 20):
+		self._samples: deque[float] = deque(maxlen=size)
+		self.min_samples = min_samples
+
+	def observe(self, latency: float):
+		self._samples.append(latency)
+
+	def percentile(self, quantile: float) -> float | None:
+		if len(self._samples) < self.min_samples:
+			return None
+		ordered = sorted(self._samples)
+		return ordered[min(len(ordered) - 1, math.ceil(quantile * len(ordered)) - 1)]
+
+
+async def hedged(fn: Callable[[], Awaitable[T]], delay: float) -> T:
+	"""
+	Runs `fn`, starting a second copy if the first hasn't finished after
+	`delay` seconds, and returns the first successful result.
+	"""
+	tasks = [asyncio.ensure_future(fn())]
+	try:
+		done, _ = await asyncio.wait(tasks, timeout=delay)
+		if done:
+			return tasks[0].result()
+
+		tasks.append(asyncio.ensure_future(fn()))
+		pending = set(tasks)
+		error = None
+		while pending:
+			done, pending = await asyncio.wait(
+				pending, return_when=asyncio.FIRST_COMPLETED
+			)
+			for task in done:
+				if task.exception() is None:
+					winner = "primary" if task is tasks[0] else "hedge"
+					metrics.hedged_requests.labels(winner=winner).inc()
+					return task.result()
+				error = task.exception()
+		metrics.hedged_requests.labels(winner="none").inc()
+		raise error
+	finally:
+		for task in tasks:
+			task.cancel()
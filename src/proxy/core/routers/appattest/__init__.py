@@ -1,15 +1,19 @@
 from .appattest import (
 	generate_client_challenge,
+	sweep_expired_challenges,
 	validate_challenge,
 	verify_assert,
 	verify_attest,
 )
+from .executor import crypto_executor
 from .middleware import app_attest_auth
 from .middleware import router as appattest_router
 
 __all__ = [
 	"app_attest_auth",
+	"crypto_executor",
 	"generate_client_challenge",
+	"sweep_expired_challenges",
 	"validate_challenge",
 	"verify_attest",
 	"verify_assert",
@@ -1,3 +1,4 @@
+import asyncio
 import binascii
 import hashlib
 import json
@@ -5,29 +6,37 @@ import os
 import time
 from pathlib import Path
 
-import cbor2
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import ec
 from cryptography.x509.base import load_pem_x509_certificate
 from fastapi import HTTPException
-from fastapi.concurrency import run_in_threadpool
-from pyattest.assertion import Assertion
-from pyattest.attestation import Attestation
-from pyattest.configs.apple import AppleConfig
 
+from ...app_attest_crypto import verify_assertion, verify_attestation
+from ...cache import public_key_cache
 from ...config import env
 from ...pg_services.services import app_attest_pg
 from ...prometheus_metrics import PrometheusResult, metrics
+from .executor import crypto_executor
+from .hmac_challenge import HMACChallengeSigner
 
 challenge_store = {}
 
 ROOT_CA_PEM = "Apple_App_Attestation_Root_CA.pem"
 root_ca = load_pem_x509_certificate(Path(ROOT_CA_PEM).read_bytes())
 root_ca_pem = root_ca.public_bytes(serialization.Encoding.PEM)
+app_id = f"{env.APP_DEVELOPMENT_TEAM}.{env.APP_BUNDLE_ID}"
+
+challenge_signer = HMACChallengeSigner(
+	env.CHALLENGE_SECRET.encode() if env.CHALLENGE_SECRET else os.urandom(32),
+	env.CHALLENGE_EXPIRY_SECONDS,
+)
 
 
 async def generate_client_challenge(key_id: str) -> str:
 	"""Create a unique challenge tied to a key ID"""
+	if env.CHALLENGE_MODE == "hmac":
+		return challenge_signer.issue(key_id)
+
 	# First check if challenge already exists for key_id (relevant security measure, & they're on PRIMARY KEY key_id)
 	stored_challenge = await app_attest_pg.get_challenge(key_id)
 	if (
@@ -47,8 +56,16 @@ async def generate_client_challenge(key_id: str) -> str:
 async def validate_challenge(challenge: str, key_id: str) -> bool:
 	"""Check that the challenge exists, is fresh, and matches key_id"""
 	start_time = time.time()
-	stored_challenge = await app_attest_pg.get_challenge(key_id)
-	await app_attest_pg.delete_challenge(key_id)  # Remove challenge after one use
+	if env.CHALLENGE_MODE == "hmac":
+		try:
+			return challenge_signer.validate(
+				challenge.decode("utf-8", errors="replace"), key_id
+			)
+		finally:
+			metrics.validate_challenge_latency.observe(time.time() - start_time)
+
+	# Remove challenge after one use
+	stored_challenge = await app_attest_pg.consume_challenge(key_id)
 	try:
 		if (
 			not stored_challenge
@@ -56,52 +73,37 @@ async def validate_challenge(challenge: str, key_id: str) -> bool:
 			> env.CHALLENGE_EXPIRY_SECONDS
 		):
 			return False
-		return challenge == stored_challenge["challenge"]
+		return challenge == stored_challenge["challenge"].encode()
 	finally:
 		metrics.validate_challenge_latency.observe(time.time() - start_time)
 
 
+async def sweep_expired_challenges():
+	"""Periodically deletes expired challenges in bounded batches."""
+	while True:
+		while (
+			await app_attest_pg.delete_expired_challenges(
+				env.CHALLENGE_EXPIRY_SECONDS, env.CHALLENGE_SWEEP_BATCH_SIZE
+			)
+			== env.CHALLENGE_SWEEP_BATCH_SIZE
+		):
+			await asyncio.sleep(0)  # let requests run between full batches
+		await asyncio.sleep(env.CHALLENGE_SWEEP_INTERVAL_SECONDS)
+
+
 async def verify_attest(key_id: str, challenge: str, attestation_obj: str):
 	start_time = time.time()
-	config = AppleConfig(
-		key_id=key_id,
-		app_id=f"{env.APP_DEVELOPMENT_TEAM}.{env.APP_BUNDLE_ID}",
-		root_ca=root_ca_pem,
-		production=False,
-	)
-
 	result = PrometheusResult.ERROR
 	try:
-		attestation = Attestation(attestation_obj, challenge, config)
-		await run_in_threadpool(attestation.verify)
-
-		# Retrieve verified public key
-		verified_data = attestation.data["data"]
-		credential_id = verified_data["credential_id"]
-		auth_data = verified_data["raw"]["authData"]
-		cred_id_len = len(credential_id)
-		# Offset = 37 bytes (for rpIdHash, flags, counter) + 16 (aaguid) + 2 (len) + cred_id_len
-		public_key_offset = 37 + 16 + 2 + cred_id_len
-		# Slice the authData to get the raw COSE public key
-		cose_public_key_bytes = auth_data[public_key_offset:]
-		# Decode the COSE key and convert it to PEM format.
-		cose_key_obj = cbor2.loads(cose_public_key_bytes)
-		# COSE Key Map for EC2 keys: 1=kty, -1=crv, -2=x, -3=y
-		if cose_key_obj.get(1) != 2 or cose_key_obj.get(-1) != 1:  # kty=EC2, crv=P-256
-			raise ValueError("Public key is not a P-256 elliptic curve key.")
-		x_coord = cose_key_obj.get(-2)
-		y_coord = cose_key_obj.get(-3)
-
-		public_key = ec.EllipticCurvePublicNumbers(
-			x=int.from_bytes(x_coord, "big"),
-			y=int.from_bytes(y_coord, "big"),
-			curve=ec.SECP256R1(),
-		).public_key()
-
-		public_key_pem = public_key.public_bytes(
-			encoding=serialization.Encoding.PEM,
-			format=serialization.PublicFormat.SubjectPublicKeyInfo,
-		).decode("utf-8")
+		public_key_pem = await crypto_executor.run(
+			"attest",
+			verify_attestation,
+			key_id,
+			challenge,
+			attestation_obj,
+			app_id,
+			root_ca_pem,
+		)
 		result = PrometheusResult.SUCCESS
 
 	except Exception as e:
@@ -115,33 +117,51 @@ async def verify_attest(key_id: str, challenge: str, attestation_obj: str):
 
 	# save public_key
 	await app_attest_pg.store_key(key_id, public_key_pem)
+	public_key_cache.set(
+		key_id, serialization.load_pem_public_key(public_key_pem.encode())
+	)
 
 	return {"status": "success"}
 
 
+async def get_public_key(key_id: str) -> ec.EllipticCurvePublicKey | None:
+	"""Returns the deserialized public key for key_id, loading it from PG on a cache miss."""
+	public_key = public_key_cache.get(key_id)
+	if public_key is None:
+		public_key_pem = await app_attest_pg.get_key(key_id)
+		if not public_key_pem:
+			return None
+		public_key = serialization.load_pem_public_key(public_key_pem.encode())
+		public_key_cache.set(key_id, public_key)
+	return public_key
+
+
 async def verify_assert(key_id: str, assertion: str, payload: dict):
 	start_time = time.time()
 	payload_bytes = json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()
 	expected_hash = hashlib.sha256(payload_bytes).digest()
 
-	key_info = await app_attest_pg.get_key(key_id)
-	if not key_info:
+	public_key = await get_public_key(key_id)
+	if public_key is None:
 		raise HTTPException(status_code=403, detail="public key not found for key_id")
-
-	public_key_pem = key_info["public_key_pem"].encode()
-	public_key_obj = serialization.load_pem_public_key(public_key_pem)
-
-	config = AppleConfig(
-		key_id=key_id,
-		app_id=f"{env.APP_DEVELOPMENT_TEAM}.{env.APP_BUNDLE_ID}",
-		root_ca=root_ca_pem,
-		production=False,
-	)
+	if crypto_executor.uses_processes:
+		# Key objects can't be pickled; workers cache the parsed DER instead
+		public_key = public_key.public_bytes(
+			serialization.Encoding.DER,
+			serialization.PublicFormat.SubjectPublicKeyInfo,
+		)
 
 	result = PrometheusResult.ERROR
 	try:
-		assertion_to_test = Assertion(assertion, expected_hash, public_key_obj, config)
-		assertion_to_test.verify()
+		await crypto_executor.run(
+			"assert",
+			verify_assertion,
+			assertion,
+			expected_hash,
+			public_key,
+			app_id,
+			root_ca_pem,
+		)
 		result = PrometheusResult.SUCCESS
 	except Exception as e:
 		raise HTTPException(
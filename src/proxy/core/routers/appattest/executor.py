@@ -0,0 +1,65 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from ...app_attest_crypto import timed_call
+from ...config import env
+from ...prometheus_metrics import metrics
+
+
+class CryptoExecutor:
+	"""
+	Dedicated pool for CPU-bound attestation/assertion verification, so bursts
+	don't run on the event loop or compete with the default threadpool.
+	CRYPTO_EXECUTOR=process sidesteps the GIL and uses every core.
+	"""
+
+	def __init__(self):
+		self._executor: Executor | None = None
+
+	@property
+	def uses_processes(self) -> bool:
+		return env.CRYPTO_EXECUTOR == "process"
+
+	def start(self):
+		if self._executor is not None:
+			return
+		workers = env.CRYPTO_WORKERS or os.cpu_count() or 1
+		if self.uses_processes:
+			self._executor = ProcessPoolExecutor(
+				max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+			)
+		else:
+			self._executor = ThreadPoolExecutor(
+				max_workers=workers, thread_name_prefix="crypto"
+			)
+
+	def shutdown(self):
+		if self._executor is not None:
+			self._executor.shutdown(wait=False, cancel_futures=True)
+			self._executor = None
+
+	async def run(self, operation: str, fn, *args):
+		self.start()
+		submitted_at = time.time()
+		metrics.crypto_queue_depth.labels(operation=operation).inc()
+		try:
+			(
+				result,
+				started_at,
+				duration,
+			) = await asyncio.get_running_loop().run_in_executor(
+				self._executor, timed_call, fn, *args
+			)
+		finally:
+			metrics.crypto_queue_depth.labels(operation=operation).dec()
+		metrics.crypto_queue_latency.labels(operation=operation).observe(
+			max(started_at - submitted_at, 0)
+		)
+		metrics.crypto_execution_latency.labels(operation=operation).observe(duration)
+		return result
+
+
+crypto_executor = CryptoExecutor()
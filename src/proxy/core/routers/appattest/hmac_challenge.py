@@ -0,0 +1,54 @@
+import hashlib
+import hmac
+import os
+import time
+
+
+class HMACChallengeSigner:
+	"""
+	Self-describing App Attest challenges of the form `<issued_at>.<nonce>.<mac>`,
+	where the MAC binds key_id, issue time and nonce to a server secret. Issuing
+	needs no storage; replays are blocked by remembering consumed nonces for one
+	expiry window, in two generations that rotate every `expiry_seconds`.
+	"""
+
+	def __init__(self, secret: bytes, expiry_seconds: int):
+		self.secret = secret
+		self.expiry_seconds = expiry_seconds
+		self._consumed: set[bytes] = set()
+		self._previously_consumed: set[bytes] = set()
+		self._rotated_at = time.time()
+
+	def _sign(self, key_id: str, issued_at: int, nonce: str) -> str:
+		message = f"{key_id}.{issued_at}.{nonce}".encode()
+		return hmac.new(self.secret, message, hashlib.sha256).hexdigest()
+
+	def issue(self, key_id: str) -> str:
+		issued_at = int(time.time())
+		nonce = os.urandom(16).hex()
+		return f"{issued_at}.{nonce}.{self._sign(key_id, issued_at, nonce)}"
+
+	def validate(self, challenge: str, key_id: str) -> bool:
+		"""Checks the MAC and expiry, then consumes the nonce so it can't be replayed."""
+		try:
+			issued_at, nonce, mac = challenge.split(".")
+			issued_at = int(issued_at)
+		except ValueError:
+			return False
+		if not hmac.compare_digest(mac, self._sign(key_id, issued_at, nonce)):
+			return False
+		if not 0 <= time.time() - issued_at <= self.expiry_seconds:
+			return False
+		return self._consume(bytes.fromhex(nonce))
+
+	def _consume(self, nonce: bytes) -> bool:
+		now = time.time()
+		if now - self._rotated_at >= self.expiry_seconds:
+			# Anything consumed before the previous generation has already expired
+			self._previously_consumed = self._consumed
+			self._consumed = set()
+			self._rotated_at = now
+		if nonce in self._consumed or nonce in self._previously_consumed:
+			return False
+		self._consumed.add(nonce)
+		return True
@@ -1,7 +1,8 @@
-from .fxa import fxa_auth
+from .fxa import fxa_auth, fxa_jwt_verifier
 from .fxa import router as fxa_router
 
 __all__ = [
 	"fxa_auth",
+	"fxa_jwt_verifier",
 	"fxa_router",
 ]
@@ -1,12 +1,17 @@
+import hashlib
 import time
 from typing import Annotated
 
+import jwt
 from fastapi import APIRouter, Header
+from fastapi.concurrency import run_in_threadpool
 
 from fxa.oauth import Client
 
+from ...cache import SingleFlight, TTLCache
 from ...config import env
 from ...prometheus_metrics import PrometheusResult, metrics
+from .jwks import FxAJWTVerifier
 
 router = APIRouter()
 fxa_url = (
@@ -15,19 +20,77 @@ fxa_url = (
 	else "https://oauth.accounts.firefox.com/v1"
 )
 client = Client(env.CLIENT_ID, env.CLIENT_SECRET, fxa_url)
+fxa_jwt_verifier = FxAJWTVerifier(env.FXA_JWKS_URL or f"{fxa_url}/jwks", env.CLIENT_ID)
 
+# Keyed by a hash of the token so raw bearer tokens are never held in memory
+fxa_token_cache = TTLCache(
+	"fxa_token",
+	max_size=env.FXA_TOKEN_CACHE_MAX_SIZE,
+	ttl=env.FXA_TOKEN_CACHE_TTL_SECONDS,
+)
+fxa_verifications = SingleFlight()
+
+
+def _token_cache_ttl(token: str, profile: dict) -> float:
+	"""Cache a verified token no longer than the token itself is valid."""
+	ttl = env.FXA_TOKEN_CACHE_TTL_SECONDS
+	exp = profile.get("exp")
+	if exp is None:
+		try:
+			exp = jwt.decode(token, options={"verify_signature": False}).get("exp")
+		except jwt.PyJWTError:
+			pass  # opaque token, no embedded expiry
+	if exp is not None:
+		ttl = min(ttl, exp - time.time())
+	return ttl
 
-def fxa_auth(x_fxa_authorization: Annotated[str | None, Header()]):
+
+async def _verify_remote(token: str) -> dict:
 	start_time = time.time()
-	token = x_fxa_authorization.removeprefix("Bearer ").split()[0]
 	result = PrometheusResult.ERROR
 	try:
-		profile = client.verify_token(token, scope="profile")
+		# PyFxA is synchronous; keep its network round trip off the event loop
+		profile = await run_in_threadpool(client.verify_token, token, scope="profile")
 		result = PrometheusResult.SUCCESS
-	except Exception as e:
-		return {"error": f"Invalid FxA auth: {e}"}
+		return profile
 	finally:
-		metrics.validate_fxa_latency.labels(result=result).observe(
+		metrics.validate_fxa_latency.labels(result=result, source="remote").observe(
 			time.time() - start_time
 		)
+
+
+async def fxa_auth(x_fxa_authorization: Annotated[str | None, Header()]):
+	start_time = time.time()
+	token = x_fxa_authorization.removeprefix("Bearer ").split()[0]
+	cache_key = hashlib.sha256(token.encode()).hexdigest()
+
+	profile = fxa_token_cache.get(cache_key)
+	if profile is not None:
+		metrics.validate_fxa_latency.labels(
+			result=PrometheusResult.SUCCESS, source="cache"
+		).observe(time.time() - start_time)
+		return profile
+
+	if env.FXA_LOCAL_JWT_VERIFICATION:
+		try:
+			profile = fxa_jwt_verifier.verify(token)
+		except Exception as e:
+			metrics.validate_fxa_latency.labels(
+				result=PrometheusResult.ERROR, source="local"
+			).observe(time.time() - start_time)
+			return {"error": f"Invalid FxA auth: {e}"}
+		if profile is not None:
+			metrics.validate_fxa_latency.labels(
+				result=PrometheusResult.SUCCESS, source="local"
+			).observe(time.time() - start_time)
+			return profile
+
+	try:
+		profile = await fxa_verifications.do(cache_key, lambda: _verify_remote(token))
+	except Exception as e:
+		return {"error": f"Invalid FxA auth: {e}"}
+
+	ttl = _token_cache_ttl(token, profile)
+	if profile.get("user") and ttl > 0:
+		fxa_token_cache.set(cache_key, profile, ttl=ttl)
 	return profile
@@ -0,0 +1,86 @@
+import asyncio
+import time
+
+import jwt
+
+from ...config import env
+from ...http_client import fxa_http
+
+
+class FxAJWTVerifier:
+	"""
+	Verifies JWT-format FxA access tokens in-process against a cached copy of
+	the FxA JWKS. `verify` returns None for tokens it can't check locally
+	(opaque tokens, unknown `kid`) so the caller can fall back to FxA.
+	"""
+
+	def __init__(self, jwks_url: str, client_id: str, scope: str = "profile"):
+		self.jwks_url = jwks_url
+		self.client_id = client_id
+		self.scope = scope
+		self._keys: dict[str, jwt.PyJWK] = {}
+		self._last_refresh = 0.0
+		self._refresh_task: asyncio.Task | None = None
+
+	def load_keys(self, jwks: dict):
+		jwk_set = jwt.PyJWKSet.from_dict(jwks)
+		self._keys = {key.key_id: key for key in jwk_set.keys if key.key_id}
+
+	async def refresh(self):
+		self._last_refresh = time.time()
+		response = await fxa_http.client.get(self.jwks_url, timeout=5)
+		response.raise_for_status()
+		self.load_keys(response.json())
+
+	async def refresh_forever(self):
+		while True:
+			try:
+				await self.refresh()
+			except Exception as e:
+				print(f"Error refreshing FxA JWKS: {e}")
+			await asyncio.sleep(env.FXA_JWKS_REFRESH_SECONDS)
+
+	def _schedule_refresh(self):
+		"""Pick up rotated keys early when an unknown `kid` shows up (rate limited)."""
+		if time.time() - self._last_refresh < env.FXA_JWKS_MIN_REFRESH_SECONDS:
+			return
+		if self._refresh_task is None or self._refresh_task.done():
+			self._last_refresh = time.time()
+			self._refresh_task = asyncio.create_task(self.refresh())
+
+	def verify(self, token: str) -> dict | None:
+		"""
+		Returns the FxA profile for a valid token, or None if it can't be verified
+		locally. Raises jwt.PyJWTError if the token is a JWT we know is invalid.
+		"""
+		if token.count(".") != 2:
+			return None
+		try:
+			header = jwt.get_unverified_header(token)
+		except jwt.DecodeError:
+			return None
+		key = self._keys.get(header.get("kid"))
+		if key is None:
+			self._schedule_refresh()
+			return None
+
+		claims = jwt.decode(
+			token,
+			key=key,
+			algorithms=[key.algorithm_name],
+			options={"require": ["exp", "sub"], "verify_aud": False},
+		)
+		audience = claims.get("aud", [])
+		audience = [audience] if isinstance(audience, str) else audience
+		if self.client_id != claims.get("client_id") and self.client_id not in audience:
+			raise jwt.InvalidAudienceError("Token was not issued to this client")
+		scopes = claims.get("scope", "").split()
+		if not any(s == self.scope or s.startswith(f"{self.scope}:") for s in scopes):
+			raise jwt.InvalidTokenError(f"Token is missing the '{self.scope}' scope")
+
+		return {
+			"user": claims["sub"],
+			"client_id": claims.get("client_id"),
+			"scope": scopes,
+			"exp": claims["exp"],
+		}
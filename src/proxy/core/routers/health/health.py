@@ -1,8 +1,9 @@
-import httpx
 from fastapi import APIRouter
 
-from ...config import LITELLM_HEADERS, LITELLM_READINESS_URL
+from ...config import LITELLM_HEADERS, LITELLM_READINESS_PATH
+from ...http_client import litellm_http
 from ...pg_services.services import app_attest_pg, litellm_pg
+from ...upstream import upstream_pool
 
 router = APIRouter()
 
@@ -17,13 +18,12 @@ async def readiness_probe():
 	# todo add check to PG and LiteLLM status here
 	pg_status = litellm_pg.check_status()
 	app_attest_pg_status = app_attest_pg.check_status()
-	litellm_status = {}
-	async with httpx.AsyncClient() as client:
-		response = await client.get(
-			LITELLM_READINESS_URL, headers=LITELLM_HEADERS, timeout=3
-		)
-		data = response.json()
-		litellm_status = data
+	response = await litellm_http.client.get(
+		upstream_pool.pick().url(LITELLM_READINESS_PATH),
+		headers=LITELLM_HEADERS,
+		timeout=3,
+	)
+	litellm_status = response.json()
 	return {
 		"status": "connected",
 		"pg_server_dbs": {
@@ -31,4 +31,8 @@ async def readiness_probe():
 			"app_attest": "connected" if app_attest_pg_status else "offline",
 		},
 		"litellm": litellm_status,
+		"litellm_backends": {
+			backend.base: "healthy" if backend.healthy else "ejected"
+			for backend in upstream_pool.backends
+		},
 	}
@@ -0,0 +1,5 @@
+from .usage import router as usage_router
+
+__all__ = [
+	"usage_router",
+]
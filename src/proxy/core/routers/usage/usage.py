@@ -0,0 +1,32 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+
+from ...config import env
+from ...pg_services.services import app_attest_pg
+
+
+def require_master_key(master_key: str = Header(...)):
+	if master_key != f"Bearer {env.MASTER_KEY}":
+		raise HTTPException(status_code=401, detail={"error": "Unauthorized"})
+
+
+router = APIRouter(dependencies=[Depends(require_master_key)])
+
+
+@router.get("/top", tags=["Usage"])
+async def top_usage(
+	hours: int = Query(24, ge=1, le=24 * 90), limit: int = Query(20, ge=1, le=1000)
+):
+	"""Users with the most tokens over the last `hours` hours."""
+	usage = await app_attest_pg.get_top_usage(hours, limit)
+	if usage is None:
+		raise HTTPException(status_code=503, detail={"error": "Usage is unavailable"})
+	return {"hours": hours, "users": usage}
+
+
+@router.get("/{user_id}", tags=["Usage"])
+async def user_usage(user_id: str, hours: int = Query(24, ge=1, le=24 * 90)):
+	"""Hourly token usage of one user, per model."""
+	usage = await app_attest_pg.get_user_usage(user_id, hours)
+	if usage is None:
+		raise HTTPException(status_code=503, detail={"error": "Usage is unavailable"})
+	return {"user_id": user_id, "hours": hours, "usage": usage}
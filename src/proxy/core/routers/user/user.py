@@ -1,7 +1,9 @@
-import httpx
 from fastapi import APIRouter, HTTPException
 
 from ...config import LITELLM_HEADERS, env
+from ...http_client import litellm_http
+from ...pg_services.services import litellm_pg
+from ...upstream import upstream_pool
 
 router = APIRouter()
 
@@ -11,10 +13,20 @@ async def user_info(user_id: str):
 	if not user_id:
 		raise HTTPException(status_code=400, detail="Missing user_id")
 
-	async with httpx.AsyncClient() as client:
-		params = {"end_user_id": user_id}
-		response = await client.get(
-			f"{env.LITELLM_API_BASE}/customer/info",
+	if env.USER_DB_FAST_PATH:
+		try:
+			user = await litellm_pg.get_user(user_id)
+		except Exception as e:
+			print(f"DB user lookup failed, falling back to LiteLLM API: {e}")
+		else:
+			if not user:
+				raise HTTPException(status_code=404, detail="User not found")
+			return user
+
+	params = {"end_user_id": user_id}
+	async with upstream_pool.use() as backend:
+		response = await litellm_http.client.get(
+			backend.url("/customer/info"),
 			params=params,
 			headers=LITELLM_HEADERS,
 		)
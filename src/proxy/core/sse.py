@@ -0,0 +1,50 @@
+import json
+
+
+class SSEParser:
+	"""
+	Incremental parser for OpenAI-style `data: {...}` server-sent events.
+	The caller forwards upstream bytes untouched and feeds them here; only
+	complete `data:` lines are decoded, to pull out content deltas, the
+	finish_reason and the final usage object.
+	"""
+
+	def __init__(self):
+		self._buffer = bytearray()
+		self.content_parts: list[str] = []
+		self.finish_reason: str | None = None
+		self.usage: dict | None = None
+
+	@property
+	def content(self) -> str:
+		return "".join(self.content_parts)
+
+	def feed(self, chunk: bytes):
+		self._buffer += chunk
+		start = 0
+		while (end := self._buffer.find(b"\n", start)) != -1:
+			# OpenAI puts each JSON payload on a single data line
+			if self._buffer.startswith(b"data:", start):
+				self._handle_data(self._buffer[start + 5 : end].strip())
+			start = end + 1
+		if start:
+			del self._buffer[:start]
+
+	def _handle_data(self, data: bytes):
+		if not data or data == b"[DONE]":
+			return
+		try:
+			payload = json.loads(data)
+		except ValueError:
+			return
+		if not isinstance(payload, dict):
+			return
+
+		if payload.get("usage"):
+			self.usage = payload["usage"]
+		for choice in payload.get("choices") or ():
+			content = (choice.get("delta") or {}).get("content")
+			if content:
+				self.content_parts.append(content)
+			if choice.get("finish_reason"):
+				self.finish_reason = choice["finish_reason"]
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator
+
+from .config import env
+from .prometheus_metrics import metrics
+
+
+class StageTimer:
+	"""Durations of the named stages of one request, in seconds."""
+
+	__slots__ = ("start_time", "stages")
+
+	def __init__(self):
+		self.start_time = time.perf_counter()
+		self.stages: dict[str, float] = {}
+
+	def add(self, stage: str, seconds: float):
+		self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+	def elapsed(self) -> float:
+		return time.perf_counter() - self.start_time
+
+
+_request_timer: ContextVar[StageTimer | None] = ContextVar(
+	"request_timer", default=None
+)
+
+
+def start_request_timer() -> StageTimer:
+	timer = StageTimer()
+	_request_timer.set(timer)
+	return timer
+
+
+def record_stage(stage: str, seconds: float):
+	metrics.request_stage_latency.labels(stage=stage).observe(seconds)
+	timer = _request_timer.get()
+	if timer is not None:
+		timer.add(stage, seconds)
+
+
+def server_timing() -> str:
+	"""The current request's stages as a Server-Timing header value."""
+	timer = _request_timer.get()
+	if timer is None:
+		return ""
+	entries = [
+		f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timer.stages.items()
+	]
+	entries.append(f"total;dur={timer.elapsed() * 1000:.1f}")
+	return ", ".join(entries)
+
+
+@contextmanager
+def timed_stage(stage: str):
+	"""Adds the duration of the block to the current request's timer, if any."""
+	start_time = time.perf_counter()
+	try:
+		yield
+	finally:
+		record_stage(stage, time.perf_counter() - start_time)
+
+
+async def timed_stream(
+	stream: AsyncIterator[bytes], stage: str, start_time: float
+) -> AsyncIterator[bytes]:
+	"""Records `stage` from `start_time` (perf_counter) until the stream ends."""
+	try:
+		async for chunk in stream:
+			yield chunk
+	finally:
+		record_stage(stage, time.perf_counter() - start_time)
+
+
+async def server_timing_stream(stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+	"""
+	Sends the stage timings as an SSE comment ahead of the first frame, once
+	the upstream connect and TTFT stages are known. Clients ignore comments.
+	"""
+	first = True
+	async for chunk in stream:
+		if first:
+			first = False
+			yield f": server-timing {server_timing()}\n\n".encode()
+		yield chunk
+
+
+class MetricsLogWriter:
+	"""
+	Appends one JSON line per request to a file without file I/O on the
+	request path. Entries go into a bounded queue (dropped and counted when
+	full) and a background task serializes and appends them in batches.
+	"""
+
+	def __init__(self, path: str, max_queue: int, batch_size: int):
+		self.path = path
+		self.batch_size = batch_size
+		self._queue: asyncio.Queue[dict] = asyncio.Queue(maxsize=max_queue)
+
+	def write(self, entry: dict):
+		try:
+			self._queue.put_nowait(entry)
+		except asyncio.QueueFull:
+			metrics.metrics_log_dropped.inc()
+
+	def _take_batch(self, first: dict) -> list[dict]:
+		batch = [first]
+		while len(batch) < self.batch_size and not self._queue.empty():
+			batch.append(self._queue.get_nowait())
+		return batch
+
+	def _append(self, batch: list[dict]):
+		lines = "".join(json.dumps(entry) + "\n" for entry in batch)
+		with open(self.path, "a") as f:
+			f.write(lines)
+
+	async def _write_batch(self, batch: list[dict]):
+		try:
+			await asyncio.to_thread(self._append, batch)
+		except Exception as e:
+			print(f"Error writing metrics log: {e}")
+			metrics.metrics_log_dropped.inc(len(batch))
+
+	async def run(self):
+		while True:
+			batch = self._take_batch(await self._queue.get())
+			await self._write_batch(batch)
+
+	async def flush(self):
+		"""Writes whatever is still queued, e.g. on shutdown."""
+		while not self._queue.empty():
+			await self._write_batch(self._take_batch(self._queue.get_nowait()))
+
+
+metrics_log = MetricsLogWriter(
+	env.METRICS_LOG_FILE,
+	max_queue=env.METRICS_LOG_QUEUE_SIZE,
+	batch_size=env.METRICS_LOG_BATCH_SIZE,
+)
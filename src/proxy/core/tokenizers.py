@@ -0,0 +1,57 @@
+import os
+
+import tiktoken
+from fastapi.concurrency import run_in_threadpool
+
+from .config import env
+
+
+class TokenizerRegistry:
+	"""
+	Maps model names to tiktoken encodings that are loaded once at startup.
+	Encodings are read from TOKENIZER_CACHE_DIR, which is populated at image
+	build time (`python -m proxy.core.tokenizers`) so serving never downloads.
+	"""
+
+	def __init__(self, model_encodings: dict[str, str], default_encoding: str):
+		self.model_encodings = model_encodings
+		self.default_encoding = default_encoding
+		self._encodings: dict[str, tiktoken.Encoding] = {}
+
+	def load(self):
+		if env.TOKENIZER_CACHE_DIR:
+			os.environ["TIKTOKEN_CACHE_DIR"] = env.TOKENIZER_CACHE_DIR
+		for name in {*self.model_encodings.values(), self.default_encoding}:
+			try:
+				self._encodings[name] = tiktoken.get_encoding(name)
+			except Exception as e:
+				print(f"Error loading tokenizer {name}: {e}")
+
+	def get(self, model: str) -> tiktoken.Encoding | None:
+		name = self.model_encodings.get(model, self.default_encoding)
+		return self._encodings.get(name) or self._encodings.get(self.default_encoding)
+
+	def count(self, model: str, texts: list[str]) -> int:
+		texts = [text for text in texts if isinstance(text, str)]
+		encoding = self.get(model)
+		if encoding is None:
+			# Not loaded (e.g. no cached BPE files): ~4 characters per token
+			return sum(len(text) for text in texts) // 4
+		return sum(len(encoding.encode(text, disallowed_special=())) for text in texts)
+
+	async def count_async(self, model: str, texts: list[str]) -> int:
+		"""Counts large inputs in a worker thread so the event loop isn't held."""
+		size = sum(len(text) for text in texts if isinstance(text, str))
+		if size >= env.TOKENIZER_OFFLOAD_MIN_CHARS:
+			return await run_in_threadpool(self.count, model, texts)
+		return self.count(model, texts)
+
+
+tokenizer_registry = TokenizerRegistry(
+	env.TOKENIZER_MODEL_ENCODINGS, env.TOKENIZER_DEFAULT_ENCODING
+)
+
+
+if __name__ == "__main__":
+	# Populate TOKENIZER_CACHE_DIR ahead of time (e.g. during the Docker build)
+	tokenizer_registry.load()
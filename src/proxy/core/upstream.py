@@ -0,0 +1,137 @@
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from .config import LITELLM_HEADERS, LITELLM_READINESS_PATH, env
+from .http_client import litellm_http
+from .prometheus_metrics import metrics
+from .resilience import is_upstream_failure
+
+
+class Backend:
+	__slots__ = ("base", "outstanding", "ewma", "failures", "healthy")
+
+	def __init__(self, base: str):
+		self.base = base.rstrip("/")
+		self.outstanding = 0
+		self.ewma = 0.0
+		self.failures = 0
+		self.healthy = True
+
+	def url(self, path: str) -> str:
+		return f"{self.base}{path}"
+
+
+class UpstreamPool:
+	"""
+	Balances LiteLLM requests across several API bases, by least outstanding
+	requests or by EWMA latency weighted by load. Backends are ejected after
+	`eject_failures` consecutive failures and re-admitted once their readiness
+	probe succeeds. If every backend is ejected, requests still go to the
+	least loaded one rather than failing outright.
+	"""
+
+	def __init__(
+		self,
+		bases: list[str],
+		strategy: str = "least_outstanding",
+		eject_failures: int = 3,
+		ewma_decay: float = 0.3,
+	):
+		if strategy not in ("least_outstanding", "ewma"):
+			raise ValueError(f"Unknown load balancing strategy: {strategy}")
+		self.backends = [Backend(base) for base in bases]
+		self.strategy = strategy
+		self.eject_failures = eject_failures
+		self.ewma_decay = ewma_decay
+		for backend in self.backends:
+			metrics.upstream_backend_healthy.labels(backend=backend.base).set(1)
+
+	def _score(self, backend: Backend) -> tuple:
+		if self.strategy == "ewma":
+			return ((backend.outstanding + 1) * backend.ewma, backend.outstanding)
+		return (backend.outstanding, backend.ewma)
+
+	def pick(self, exclude: Backend | None = None) -> Backend:
+		candidates = [b for b in self.backends if b.healthy and b is not exclude]
+		if not candidates:
+			candidates = [b for b in self.backends if b is not exclude] or self.backends
+		# Shuffle so ties don't always land on the first backend
+		return min(random.sample(candidates, len(candidates)), key=self._score)
+
+	@asynccontextmanager
+	async def use(self, exclude: Backend | None = None) -> AsyncIterator[Backend]:
+		"""
+		Picks a backend and counts the request against it. Upstream failures
+		raised inside the block count towards ejection; callers report latency
+		with `observe`.
+		"""
+		backend = self.pick(exclude)
+		backend.outstanding += 1
+		metrics.upstream_backend_outstanding.labels(backend=backend.base).inc()
+		try:
+			yield backend
+		except Exception as e:
+			if is_upstream_failure(e):
+				self._record_failure(backend)
+			raise
+		else:
+			backend.failures = 0
+			metrics.upstream_backend_requests.labels(
+				backend=backend.base, result="success"
+			).inc()
+		finally:
+			backend.outstanding -= 1
+			metrics.upstream_backend_outstanding.labels(backend=backend.base).dec()
+
+	def observe(self, backend: Backend, latency: float):
+		if backend.ewma == 0.0:
+			backend.ewma = latency
+		else:
+			backend.ewma += self.ewma_decay * (latency - backend.ewma)
+		metrics.upstream_backend_ewma_latency.labels(backend=backend.base).set(
+			backend.ewma
+		)
+
+	def _record_failure(self, backend: Backend):
+		metrics.upstream_backend_requests.labels(
+			backend=backend.base, result="error"
+		).inc()
+		backend.failures += 1
+		if backend.healthy and backend.failures >= self.eject_failures:
+			print(f"Ejecting LiteLLM backend {backend.base} after repeated failures")
+			backend.healthy = False
+			metrics.upstream_backend_healthy.labels(backend=backend.base).set(0)
+			metrics.upstream_backend_ejections.labels(backend=backend.base).inc()
+
+	async def probe(self, backend: Backend) -> bool:
+		try:
+			response = await litellm_http.client.get(
+				backend.url(LITELLM_READINESS_PATH), headers=LITELLM_HEADERS, timeout=3
+			)
+			ready = response.status_code == 200
+		except Exception:
+			ready = False
+		if ready and not backend.healthy:
+			print(f"LiteLLM backend {backend.base} is ready again")
+			backend.healthy = True
+			backend.failures = 0
+			metrics.upstream_backend_healthy.labels(backend=backend.base).set(1)
+		return ready
+
+	async def probe_forever(self):
+		"""Re-probes ejected backends until they pass their readiness check."""
+		while True:
+			await asyncio.sleep(env.LITELLM_PROBE_INTERVAL_SECONDS)
+			ejected = [b for b in self.backends if not b.healthy]
+			if ejected:
+				await asyncio.gather(*(self.probe(b) for b in ejected))
+
+
+upstream_pool = UpstreamPool(
+	env.LITELLM_API_BASES or [env.LITELLM_API_BASE],
+	strategy=env.LITELLM_LB_STRATEGY,
+	eject_failures=env.LITELLM_EJECT_FAILURES,
+)
@@ -0,0 +1,77 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+
+from .config import env
+from .pg_services.services import app_attest_pg
+from .prometheus_metrics import metrics
+
+# (user_id, model, hour since the epoch) -> [prompt_tokens, completion_tokens, requests]
+UsageKey = tuple[str, str, int]
+
+
+class UsageLedger:
+	"""
+	Aggregates token usage per user, model and hour in memory, so recording
+	is a dict update on the request path. `flush` hands the aggregate to
+	Postgres in one batch; rows from a failed flush are merged back and
+	retried, up to `max_pending` rows.
+	"""
+
+	def __init__(self, max_pending: int):
+		self.max_pending = max_pending
+		self._pending: dict[UsageKey, list[int]] = {}
+		self._flush_lock = asyncio.Lock()
+
+	def __len__(self) -> int:
+		return len(self._pending)
+
+	def record(
+		self, user_id: str, model: str, prompt_tokens: int, completion_tokens: int
+	):
+		key = (user_id, model, int(time.time() // 3600))
+		self._add(key, prompt_tokens, completion_tokens, 1)
+
+	def _add(
+		self, key: UsageKey, prompt_tokens: int, completion_tokens: int, requests: int
+	):
+		totals = self._pending.get(key)
+		if totals is None:
+			if len(self._pending) >= self.max_pending:
+				metrics.usage_ledger_dropped.inc()
+				return
+			totals = self._pending[key] = [0, 0, 0]
+			metrics.usage_ledger_pending.set(len(self._pending))
+		totals[0] += prompt_tokens
+		totals[1] += completion_tokens
+		totals[2] += requests
+
+	async def flush(self):
+		async with self._flush_lock:
+			if not self._pending:
+				return
+			pending, self._pending = self._pending, {}
+			metrics.usage_ledger_pending.set(0)
+			rows = [
+				(
+					user_id,
+					model,
+					datetime.fromtimestamp(hour * 3600, timezone.utc),
+					*totals,
+				)
+				for (user_id, model, hour), totals in pending.items()
+			]
+			if await app_attest_pg.store_usage(rows):
+				metrics.usage_ledger_flushes.labels(result="success").inc()
+			else:
+				metrics.usage_ledger_flushes.labels(result="error").inc()
+				for key, totals in pending.items():
+					self._add(key, *totals)
+
+	async def flush_forever(self):
+		while True:
+			await asyncio.sleep(env.USAGE_FLUSH_INTERVAL_SECONDS)
+			await self.flush()
+
+
+usage_ledger = UsageLedger(env.USAGE_LEDGER_MAX_PENDING)
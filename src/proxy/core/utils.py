@@ -1,21 +1,55 @@
+import asyncio
 import base64
+import hashlib
+import json
 import time
+from contextlib import nullcontext
+from typing import Callable
 
 import httpx
-import tiktoken
 from fastapi import HTTPException
 
+from .budget import budget_tracker, response_cost
+from .cache import SingleFlight, response_cache, user_cache
 from .classes import AuthorizedChatRequest
-from .config import LITELLM_COMPLETIONS_URL, LITELLM_HEADERS, env
-from .prometheus_metrics import PrometheusResult, metrics
+from .coalescing import StreamCoalescer
+from .concurrency import UpstreamOverloaded, upstream_limiter
+from .config import LITELLM_COMPLETIONS_PATH, LITELLM_HEADERS, env
+from .http_client import litellm_http
+from .pg_services.services import litellm_pg
+from .prometheus_metrics import PrometheusResult, metrics, model_label
+from .rate_limit import rate_limiter
+from .resilience import (
+	CLOSED,
+	CircuitBreaker,
+	CircuitOpen,
+	LatencyWindow,
+	backoff_delay,
+	hedged,
+	is_retryable,
+	is_upstream_failure,
+)
+from .sse import SSEParser
+from .timing import record_stage
+from .tokenizers import tokenizer_registry
+from .upstream import Backend, upstream_pool
+from .usage import usage_ledger
 
+user_lookups = SingleFlight()
+completion_flights = SingleFlight()
+stream_coalescer = StreamCoalescer()
+completion_breaker = CircuitBreaker(
+	"litellm_completions",
+	failure_threshold=env.UPSTREAM_BREAKER_FAILURE_THRESHOLD,
+	reset_timeout=env.UPSTREAM_BREAKER_RESET_SECONDS,
+)
+completion_latencies = LatencyWindow()
 
-async def stream_completion(authorized_chat_request: AuthorizedChatRequest):
-	"""
-	Proxies a streaming request to LiteLLM.
-	Yields response chunks as they are received and logs metrics.
-	"""
-	start_time = time.time()
+# Request fields that determine a completion; "user" is deliberately excluded
+CACHE_KEY_FIELDS = ("model", "messages", "temperature", "top_p", "max_tokens", "stream")
+
+
+def completion_body(authorized_chat_request: AuthorizedChatRequest) -> dict:
 	body = {
 		"model": authorized_chat_request.model,
 		"messages": authorized_chat_request.messages,
@@ -23,115 +57,436 @@ async def stream_completion(authorized_chat_request: AuthorizedChatRequest):
 		"top_p": authorized_chat_request.top_p,
 		"max_tokens": authorized_chat_request.max_completion_tokens,
 		"user": authorized_chat_request.user,
-		"stream": True,
+		"stream": bool(authorized_chat_request.stream),
 	}
+	if body["stream"]:
+		body["stream_options"] = {"include_usage": True}
+	return body
+
+
+def completion_cache_key(body: dict) -> str:
+	"""Canonical hash of the parts of a completion body that determine its output."""
+	canonical = json.dumps(
+		{key: body.get(key) for key in CACHE_KEY_FIELDS},
+		sort_keys=True,
+		separators=(",", ":"),
+	)
+	return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def is_response_cacheable(model: str) -> bool:
+	return env.RESPONSE_CACHE_ENABLED and (
+		not env.RESPONSE_CACHE_MODELS or model in env.RESPONSE_CACHE_MODELS
+	)
+
+
+def is_coalescable(model: str) -> bool:
+	return model in env.COALESCE_MODELS
+
+
+def record_usage(
+	authorized_chat_request: AuthorizedChatRequest,
+	prompt_tokens: int,
+	completion_tokens: int,
+):
+	"""Accounts the token usage of one completion request."""
+	model = model_label(authorized_chat_request.model)
+	metrics.chat_tokens.labels(model=model, type="prompt").inc(prompt_tokens)
+	metrics.chat_tokens.labels(model=model, type="completion").inc(completion_tokens)
+	if env.RATE_LIMIT_ENABLED:
+		rate_limiter.record_tokens(
+			authorized_chat_request.user, prompt_tokens + completion_tokens
+		)
+	if env.USAGE_LEDGER_ENABLED:
+		usage_ledger.record(
+			authorized_chat_request.user,
+			authorized_chat_request.model,
+			prompt_tokens,
+			completion_tokens,
+		)
+
+
+def record_response_usage(authorized_chat_request: AuthorizedChatRequest, data: dict):
+	usage = data.get("usage") or {}
+	record_usage(
+		authorized_chat_request,
+		usage.get("prompt_tokens", 0),
+		usage.get("completion_tokens", 0),
+	)
+
+
+def record_shared_stream_usage(
+	authorized_chat_request: AuthorizedChatRequest, summary: dict
+):
+	"""Accounts a coalesced follower for the stream it shared with the leader."""
+	if "completion_tokens" not in summary:
+		return  # the upstream stream failed
+	record_usage(
+		authorized_chat_request, summary["prompt_tokens"], summary["completion_tokens"]
+	)
+	if env.BUDGET_ENFORCEMENT_ENABLED:
+		budget_tracker.charge(authorized_chat_request.user, summary.get("cost", 0.0))
+
+
+def upstream_unavailable(e: UpstreamOverloaded | CircuitOpen) -> HTTPException:
+	return HTTPException(
+		status_code=503,
+		detail={"error": str(e)},
+		headers={"Retry-After": "1"},
+	)
+
+
+async def stream_completion(
+	authorized_chat_request: AuthorizedChatRequest,
+	on_close: list[Callable[[], None]] | None = None,
+):
+	"""
+	Proxies a streaming request to LiteLLM. When coalescing is enabled for the
+	model, identical in-flight requests share a single upstream stream.
+	With UPSTREAM_CONCURRENCY_ENABLED the upstream concurrency slot is taken
+	before the response starts, so that shed requests get a 503 rather than an
+	empty stream. Releases the response must run even if the stream is never
+	iterated are appended to `on_close`.
+	"""
+	key = None
+	if is_coalescable(authorized_chat_request.model):
+		key = completion_cache_key(completion_body(authorized_chat_request))
+		if key in stream_coalescer:
+			return _follow_stream(key, authorized_chat_request, on_close)
+
+	slot = None
+	if env.UPSTREAM_CONCURRENCY_ENABLED:
+		try:
+			slot = await upstream_limiter.stream_slot(env.UPSTREAM_TTFT_TARGET_SECONDS)
+		except UpstreamOverloaded as e:
+			raise upstream_unavailable(e)
+		if key is not None and key in stream_coalescer:
+			# Another leader started while we were queued
+			slot.release()
+			return _follow_stream(key, authorized_chat_request, on_close)
+
+	def upstream(summary: dict | None = None):
+		stream = _stream_upstream(authorized_chat_request, summary)
+		return stream if slot is None else slot.track(stream)
+
+	if key is None:
+		if slot is not None and on_close is not None:
+			on_close.append(slot.release)
+		return upstream()
+	# A shared upstream holds the slot for as long as it runs, which may
+	# outlast the leader's own response
+	return stream_coalescer.subscribe(
+		key,
+		upstream,
+		on_close=on_close,
+		on_source_done=None if slot is None else slot.release,
+	)
+
+
+def _follow_stream(
+	key: str,
+	authorized_chat_request: AuthorizedChatRequest,
+	on_close: list[Callable[[], None]] | None,
+):
+	# The leader records its own usage upstream; followers account theirs from
+	# the summary it leaves once they have read the whole stream
+	return stream_coalescer.subscribe(
+		key,
+		None,
+		on_complete=lambda summary: record_shared_stream_usage(
+			authorized_chat_request, summary
+		),
+		on_close=on_close,
+	)
+
+
+async def _stream_upstream(
+	authorized_chat_request: AuthorizedChatRequest, summary: dict | None = None
+):
+	"""
+	Yields response chunks as they are received and logs metrics.
+	The usage and cost are also left in `summary` for coalesced followers.
+	"""
+	start_time = time.time()
+	body = completion_body(authorized_chat_request)
+	model = model_label(authorized_chat_request.model)
 	result = PrometheusResult.ERROR
-	is_first_token = True
-	num_completion_tokens = 0
+	first_token_time = last_frame_time = None
+	# Time spent blocked on the client, since the last frame and in total
+	downstream_time = total_downstream_time = 0.0
+	parser = SSEParser()
 	try:
-		async with httpx.AsyncClient() as client:
-			async with client.stream(
+		async with (
+			upstream_pool.use() as backend,
+			litellm_http.client.stream(
 				"POST",
-				LITELLM_COMPLETIONS_URL,
+				backend.url(LITELLM_COMPLETIONS_PATH),
 				headers=LITELLM_HEADERS,
 				json=body,
 				timeout=30,
-			) as response:
-				response.raise_for_status()
-				async for chunk in response.aiter_bytes():
-					num_completion_tokens += 1
-					if is_first_token:
-						metrics.chat_completion_ttft.observe(time.time() - start_time)
-						is_first_token = False
-					yield chunk
-
-				# Update token metrics after streaming is complete
-				try:
-					tokenizer = tiktoken.encoding_for_model(
-						authorized_chat_request.model
-					)
-				except KeyError:
-					tokenizer = tiktoken.get_encoding("cl100k_base")
-				prompt_tokens = len(
-					tokenizer.encode(
-						message["content"]
+			) as response,
+		):
+			record_stage("upstream_connect", time.time() - start_time)
+			if response.is_error:
+				await response.aread()  # so the error body can be logged below
+			response.raise_for_status()
+			# Usually 0 for streams, which are charged once they finish so that
+			# reconciliation picks up the spend LiteLLM records
+			cost = response_cost(response.headers)
+			async for chunk in response.aiter_bytes():
+				now = time.time()
+				if first_token_time is None:
+					first_token_time = now
+					ttft = first_token_time - start_time
+					metrics.chat_completion_ttft.labels(model=model).observe(ttft)
+					record_stage("ttft", ttft)
+					upstream_pool.observe(backend, ttft)
+				frames = len(parser.content_parts)
+				parser.feed(chunk)
+				if new_frames := len(parser.content_parts) - frames:
+					itl = metrics.chat_inter_token_latency.labels(model=model)
+					if last_frame_time is not None:
+						# Chunks are only read once the client took the previous
+						# one, so time spent waiting on it isn't upstream latency
+						itl.observe(max(0.0, now - last_frame_time - downstream_time))
+					# Further frames in the same network chunk arrived with no gap
+					for _ in range(new_frames - 1):
+						itl.observe(0)
+					last_frame_time = now
+					downstream_time = 0.0
+				yield_start = time.time()
+				yield chunk
+				blocked = time.time() - yield_start
+				downstream_time += blocked
+				total_downstream_time += blocked
+			upstream_done_time = time.time()
+
+			# Update token metrics after streaming is complete
+			if parser.usage:
+				prompt_tokens = parser.usage.get("prompt_tokens", 0)
+				completion_tokens = parser.usage.get("completion_tokens", 0)
+			else:
+				# Upstream ignored stream_options.include_usage; count locally
+				prompt_tokens = await tokenizer_registry.count_async(
+					authorized_chat_request.model,
+					[
+						message.get("content")
 						for message in authorized_chat_request.messages
-					)
+					],
+				)
+				completion_tokens = await tokenizer_registry.count_async(
+					authorized_chat_request.model, [parser.content]
+				)
+			record_usage(authorized_chat_request, prompt_tokens, completion_tokens)
+			if env.BUDGET_ENFORCEMENT_ENABLED:
+				budget_tracker.charge(body["user"], cost)
+			if summary is not None:
+				summary.update(
+					prompt_tokens=prompt_tokens,
+					completion_tokens=completion_tokens,
+					cost=cost,
 				)
-				metrics.chat_tokens.labels(type="prompt").inc(prompt_tokens)
-				metrics.chat_tokens.labels(type="completion").inc(num_completion_tokens)
-				result = PrometheusResult.SUCCESS
+			if first_token_time is not None and completion_tokens:
+				generation_time = (
+					upstream_done_time - first_token_time - total_downstream_time
+				)
+				if generation_time > 0:
+					metrics.chat_tokens_per_second.labels(model=model).observe(
+						completion_tokens / generation_time
+					)
+			result = PrometheusResult.SUCCESS
 	except httpx.HTTPStatusError as e:
 		print(
 			f"Upstream service returned an error: {e.response.status_code} - {e.response.text}"
 		)
 		return
 	except Exception as e:
-		print(f"Failed to proxy request to {LITELLM_COMPLETIONS_URL}: {e}")
+		print(f"Failed to proxy request to LiteLLM: {e}")
 		return
 	finally:
-		metrics.chat_completion_latency.labels(result=result).observe(
+		metrics.chat_completion_latency.labels(model=model, result=result).observe(
 			time.time() - start_time
 		)
 
 
-async def get_completion(authorized_chat_request: AuthorizedChatRequest):
+async def get_completion(
+	authorized_chat_request: AuthorizedChatRequest, use_cache: bool = True
+):
 	"""
 	Proxies a non-streaming request to LiteLLM.
+	Identical requests may be answered from `response_cache`, or share one
+	in-flight upstream call, when enabled for the model.
 	"""
 	start_time = time.time()
-	body = {
-		"model": authorized_chat_request.model,
-		"messages": authorized_chat_request.messages,
-		"temperature": authorized_chat_request.temperature,
-		"top_p": authorized_chat_request.top_p,
-		"max_tokens": authorized_chat_request.max_completion_tokens,
-		"user": authorized_chat_request.user,
-		"stream": False,
-	}
+	body = completion_body(authorized_chat_request)
+	model = authorized_chat_request.model
+	cacheable = is_response_cacheable(model)
+	key = None
+	if cacheable or is_coalescable(model):
+		key = completion_cache_key(body)
+	if cacheable and use_cache:
+		data = response_cache.get(key)
+		if data is not None:
+			record_response_usage(authorized_chat_request, data)
+			return data
+
 	result = PrometheusResult.ERROR
 	try:
-		async with httpx.AsyncClient() as client:
-			response = await client.post(
-				LITELLM_COMPLETIONS_URL, headers=LITELLM_HEADERS, json=body, timeout=10
+		if is_coalescable(model):
+			if key in completion_flights:
+				metrics.coalesced_requests.labels(mode="completion").inc()
+			data, size, cost = await completion_flights.do(
+				key, lambda: _post_completion(body)
 			)
-			response.raise_for_status()
-			data = response.json()
-			usage = data.get("usage", {})
-			prompt_tokens = usage.get("prompt_tokens", 0)
-			completion_tokens = usage.get("completion_tokens", 0)
+		else:
+			data, size, cost = await _post_completion(body)
+		# Every caller sharing the call is accounted, not just body["user"]
+		record_response_usage(authorized_chat_request, data)
+		if env.BUDGET_ENFORCEMENT_ENABLED:
+			budget_tracker.charge(authorized_chat_request.user, cost)
+		if cacheable:
+			response_cache.set(key, data, size=size)
 
-			metrics.chat_tokens.labels(type="prompt").inc(prompt_tokens)
-			metrics.chat_tokens.labels(type="completion").inc(completion_tokens)
-
-			result = PrometheusResult.SUCCESS
-			return data
+		result = PrometheusResult.SUCCESS
+		return data
+	except (UpstreamOverloaded, CircuitOpen) as e:
+		raise upstream_unavailable(e)
 	except Exception as e:
 		raise HTTPException(
 			status_code=500,
-			detail={
-				"error": f"Failed to proxy request to {LITELLM_COMPLETIONS_URL}: {e}"
-			},
+			detail={"error": f"Failed to proxy request to LiteLLM: {e}"},
 		)
 	finally:
-		metrics.chat_completion_latency.labels(result=result).observe(
-			time.time() - start_time
-		)
+		metrics.chat_completion_latency.labels(
+			model=model_label(model), result=result
+		).observe(time.time() - start_time)
+
+
+async def _post_completion(body: dict) -> tuple[dict, int, float]:
+	"""
+	Returns the upstream response body, its size in bytes and its cost.
+	Connect errors and 502/503 responses are retried with jittered backoff,
+	and slow requests may be hedged, unless `completion_breaker` is open.
+	"""
+	if not completion_breaker.allow():
+		raise CircuitOpen("LiteLLM circuit breaker is open")
+	if env.UPSTREAM_CONCURRENCY_ENABLED:
+		upstream_slot = upstream_limiter.slot(env.UPSTREAM_LATENCY_TARGET_SECONDS)
+	else:
+		upstream_slot = nullcontext()
+	async with upstream_slot:
+		start_time = time.perf_counter()
+		attempt = 0
+		tried: list[Backend] = []
+		while True:
+			try:
+				# Retries go to a different backend than the one that just failed
+				response = await _send_completion_hedged(
+					body, tried, exclude=tried[-1] if tried else None
+				)
+				# Retries and hedges included, excluding the wait for a slot
+				record_stage("upstream", time.perf_counter() - start_time)
+				return (
+					response.json(),
+					len(response.content),
+					response_cost(response.headers),
+				)
+			except Exception as e:
+				if attempt >= env.UPSTREAM_RETRY_ATTEMPTS or not is_retryable(e):
+					raise
+				reason = (
+					str(e.response.status_code)
+					if isinstance(e, httpx.HTTPStatusError)
+					else "connect_error"
+				)
+				metrics.upstream_retries.labels(reason=reason).inc()
+				await asyncio.sleep(
+					backoff_delay(
+						attempt,
+						env.UPSTREAM_RETRY_BACKOFF_SECONDS,
+						env.UPSTREAM_RETRY_MAX_BACKOFF_SECONDS,
+					)
+				)
+				attempt += 1
+				if not completion_breaker.allow():
+					raise CircuitOpen("LiteLLM circuit breaker is open")
+
+
+async def _send_completion_hedged(
+	body: dict, tried: list[Backend], exclude: Backend | None
+) -> httpx.Response:
+	if env.UPSTREAM_HEDGE_ENABLED and completion_breaker.state == CLOSED:
+		p95 = completion_latencies.percentile(env.UPSTREAM_HEDGE_QUANTILE)
+		if p95 is not None:
+			delay = max(p95, env.UPSTREAM_HEDGE_MIN_DELAY_SECONDS)
+			return await hedged(lambda: _send_completion(body, tried, exclude), delay)
+	return await _send_completion(body, tried, exclude)
+
+
+async def _send_completion(
+	body: dict, tried: list[Backend], exclude: Backend | None
+) -> httpx.Response:
+	start_time = time.monotonic()
+	try:
+		async with upstream_pool.use(exclude) as backend:
+			tried.append(backend)
+			response = await litellm_http.client.post(
+				backend.url(LITELLM_COMPLETIONS_PATH),
+				headers=LITELLM_HEADERS,
+				json=body,
+				timeout=10,
+			)
+			response.raise_for_status()
+	except asyncio.CancelledError:
+		completion_breaker.release_probe()
+		raise
+	except Exception as e:
+		if is_upstream_failure(e):
+			completion_breaker.record_failure()
+		else:
+			completion_breaker.record_success()
+		raise
+	latency = time.monotonic() - start_time
+	completion_breaker.record_success()
+	completion_latencies.observe(latency)
+	upstream_pool.observe(backend, latency)
+	return response
 
 
 async def get_or_create_user(user_id: str):
 	"""Returns user info from LiteLLM, creating the user if they don't exist.
+	Served from `user_cache` when possible; concurrent misses for the same
+	user share a single lookup.
 	Args:
 		user_id (str): The user ID to look up or create.
 	Returns:
 		[user_info: dict, was_created: bool]
 	"""
+	user = user_cache.get(user_id)
+	if user is not None:
+		return [user, False]
+
+	user, was_created = await user_lookups.do(
+		user_id, lambda: _fetch_or_create_user(user_id)
+	)
+	if user.get("user_id"):
+		user_cache.set(user_id, user)
+	return [user, was_created]
+
 
-	async with httpx.AsyncClient() as client:
+async def _fetch_or_create_user(user_id: str):
+	if env.USER_DB_FAST_PATH:
 		try:
-			params = {"end_user_id": user_id}
+			return list(await litellm_pg.get_or_create_user(user_id))
+		except Exception as e:
+			print(f"DB user lookup failed, falling back to LiteLLM API: {e}")
+
+	client = litellm_http.client
+	try:
+		params = {"end_user_id": user_id}
+		async with upstream_pool.use() as backend:
 			response = await client.get(
-				f"{env.LITELLM_API_BASE}/customer/info",
+				backend.url("/customer/info"),
 				params=params,
 				headers=LITELLM_HEADERS,
 			)
@@ -139,21 +494,21 @@ async def get_or_create_user(user_id: str):
 			if not user.get("user_id"):
 				# add budget details or budget_id if necessary
 				await client.post(
-					f"{env.LITELLM_API_BASE}/customer/new",
+					backend.url("/customer/new"),
 					json={"user_id": user_id},
 					headers=LITELLM_HEADERS,
 				)
 				response = await client.get(
-					f"{env.LITELLM_API_BASE}/customer/info",
+					backend.url("/customer/info"),
 					params=params,
 					headers=LITELLM_HEADERS,
 				)
 				return [response.json(), True]
 			return [user, False]
-		except Exception as e:
-			raise HTTPException(
-				status_code=500, detail={"error": f"Error fetching user info: {e}"}
-			)
+	except Exception as e:
+		raise HTTPException(
+			status_code=500, detail={"error": f"Error fetching user info: {e}"}
+		)
 
 
 def b64decode_safe(data_b64: str, obj_name: str = "object") -> str:
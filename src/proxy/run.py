@@ -1,21 +1,50 @@
+import asyncio
+import math
 import time
 from contextlib import asynccontextmanager
-from typing import Annotated, Optional
+from typing import Annotated, Callable, Optional
 
 import sentry_sdk
 import uvicorn
-from fastapi import Depends, FastAPI, Header, HTTPException, Request, Response
+from fastapi import Depends, FastAPI, Header, HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import StreamingResponse
-from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client import CONTENT_TYPE_LATEST
 
+from .core.budget import budget_tracker
 from .core.classes import AssertionRequest, AuthorizedChatRequest, ChatRequest
 from .core.config import env
+from .core.http_client import fxa_http, litellm_http
+from .core.instrumentation import InstrumentationMiddleware
 from .core.pg_services.services import app_attest_pg, litellm_pg
-from .core.prometheus_metrics import metrics
-from .core.routers.appattest import app_attest_auth, appattest_router
-from .core.routers.fxa import fxa_auth, fxa_router
+from .core.prometheus_metrics import (
+	latest_metrics,
+	mark_worker_dead,
+	metrics,
+	prepare_multiprocess_dir,
+)
+from .core.rate_limit import rate_limiter
+from .core.routers.appattest import (
+	app_attest_auth,
+	appattest_router,
+	crypto_executor,
+	sweep_expired_challenges,
+)
+from .core.routers.fxa import fxa_auth, fxa_jwt_verifier, fxa_router
 from .core.routers.health import health_router
+from .core.routers.usage import usage_router
 from .core.routers.user import user_router
+from .core.timing import (
+	metrics_log,
+	record_stage,
+	server_timing,
+	server_timing_stream,
+	timed_stage,
+	timed_stream,
+)
+from .core.tokenizers import tokenizer_registry
+from .core.upstream import upstream_pool
+from .core.usage import usage_ledger
 from .core.utils import get_completion, get_or_create_user, stream_completion
 
 tags_metadata = [
@@ -26,6 +55,7 @@ tags_metadata = [
 		"description": "Endpoints for verifying App Attest payloads.",
 	},
 	{"name": "LiteLLM", "description": "Endpoints for interacting with LiteLLM."},
+	{"name": "Usage", "description": "Per-user token usage (master key only)."},
 ]
 
 
@@ -34,7 +64,8 @@ async def authorize(
 	x_fxa_authorization: Annotated[str | None, Header()] = None,
 ) -> AuthorizedChatRequest:
 	if isinstance(chat_request, AssertionRequest):
-		data = await app_attest_auth(chat_request)
+		with timed_stage("app_attest_verification"):
+			data = await app_attest_auth(chat_request)
 		if data:
 			if data.get("error"):
 				raise HTTPException(status_code=400, detail=data["error"])
@@ -45,7 +76,8 @@ async def authorize(
 				),
 			)
 	if x_fxa_authorization:
-		fxa_user_id = fxa_auth(x_fxa_authorization)
+		with timed_stage("fxa_verification"):
+			fxa_user_id = await fxa_auth(x_fxa_authorization)
 		if fxa_user_id:
 			if fxa_user_id.get("error"):
 				raise HTTPException(status_code=401, detail=fxa_user_id["error"])
@@ -58,13 +90,77 @@ async def authorize(
 	)
 
 
+def rate_limit_exceeded(decision: str, retry_after: float):
+	metrics.rate_limit_decisions.labels(decision=decision).inc()
+	raise HTTPException(
+		status_code=429,
+		detail={"error": "Rate limit exceeded."},
+		headers={"Retry-After": str(math.ceil(retry_after))},
+	)
+
+
+def check_rate_limit(user_id: str, stream: bool):
+	decision, retry_after = rate_limiter.check(user_id, stream)
+	if decision != "allowed":
+		rate_limit_exceeded(decision, retry_after)
+	metrics.rate_limit_decisions.labels(decision=decision).inc()
+
+
+def budget_exceeded():
+	metrics.budget_rejections.inc()
+	raise HTTPException(status_code=403, detail={"error": "Budget exceeded."})
+
+
+class ClosingStreamingResponse(StreamingResponse):
+	"""
+	Runs `on_close` once the response has been sent or abandoned. Unlike a
+	`finally` in the body generator, this also runs when the body is never
+	iterated, e.g. when the client disconnects before the first send.
+	"""
+
+	def __init__(self, content, on_close: list[Callable[[], None]], **kwargs):
+		super().__init__(content, **kwargs)
+		self.on_close = on_close
+
+	async def __call__(self, scope, receive, send):
+		try:
+			await super().__call__(scope, receive, send)
+		finally:
+			for callback in self.on_close:
+				callback()
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
 	await litellm_pg.connect()
 	await app_attest_pg.connect()
+	await litellm_http.connect()
+	crypto_executor.start()
+	await run_in_threadpool(tokenizer_registry.load)
+	background_tasks = [asyncio.create_task(upstream_pool.probe_forever())]
+	if env.CHALLENGE_MODE == "pg":
+		background_tasks.append(asyncio.create_task(sweep_expired_challenges()))
+	if env.FXA_LOCAL_JWT_VERIFICATION:
+		background_tasks.append(asyncio.create_task(fxa_jwt_verifier.refresh_forever()))
+	if env.USAGE_LEDGER_ENABLED:
+		background_tasks.append(asyncio.create_task(usage_ledger.flush_forever()))
+	if env.BUDGET_ENFORCEMENT_ENABLED:
+		background_tasks.append(asyncio.create_task(budget_tracker.reconcile_forever()))
+	if env.METRICS_LOG_ENABLED:
+		background_tasks.append(asyncio.create_task(metrics_log.run()))
 	yield
+	for task in background_tasks:
+		task.cancel()
+	if env.USAGE_LEDGER_ENABLED:
+		await usage_ledger.flush()
+	if env.METRICS_LOG_ENABLED:
+		await metrics_log.flush()
+	crypto_executor.shutdown()
+	await litellm_http.disconnect()
+	await fxa_http.disconnect()
 	await litellm_pg.disconnect()
 	await app_attest_pg.disconnect()
+	mark_worker_dead()
 
 
 sentry_sdk.init(dsn=env.SENTRY_DSN, send_default_pii=True)
@@ -79,40 +175,19 @@ app = FastAPI(
 )
 
 
-# run before all requests
-@app.middleware("http")
-async def instrument_requests(request: Request, call_next):
-	"""
-	Measures request latency, counts total requests, and tracks requests in progress.
-	"""
-	start_time = time.time()
-	metrics.in_progress_requests.inc()
-
-	try:
-		response = await call_next(request)
-
-		route = request.scope.get("route")
-		endpoint = route.path if route else request.url.path
-
-		metrics.request_latency.labels(
-			method=request.method, endpoint=endpoint
-		).observe(time.time() - start_time)
-		metrics.requests_total.labels(method=request.method, endpoint=endpoint).inc()
-		metrics.response_status_codes.labels(status_code=response.status_code).inc()
-		return response
-	finally:
-		metrics.in_progress_requests.dec()
+app.add_middleware(InstrumentationMiddleware, skip_paths=env.INSTRUMENTATION_SKIP_PATHS)
 
 
 @app.get("/metrics", tags=["Metrics"])
 async def get_metrics():
-	return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+	return Response(content=latest_metrics(), media_type=CONTENT_TYPE_LATEST)
 
 
 app.include_router(health_router, prefix="/health")
 app.include_router(appattest_router, prefix="/verify")
 app.include_router(fxa_router, prefix="/fxa")
 app.include_router(user_router, prefix="/user")
+app.include_router(usage_router, prefix="/usage")
 
 
 @app.post(
@@ -124,6 +199,8 @@ async def chat_completion(
 	authorized_chat_request: Annotated[
 		Optional[AuthorizedChatRequest], Depends(authorize)
 	],
+	response: Response,
+	cache_control: Annotated[str | None, Header()] = None,
 ):
 	user_id = authorized_chat_request.user
 	if not user_id:
@@ -131,21 +208,67 @@ async def chat_completion(
 			status_code=400,
 			detail={"error": "User not found from authorization response."},
 		)
-	user, _ = await get_or_create_user(user_id)
+	if env.RATE_LIMIT_ENABLED:
+		check_rate_limit(user_id, bool(authorized_chat_request.stream))
+	if env.BUDGET_ENFORCEMENT_ENABLED and budget_tracker.is_exceeded(user_id):
+		budget_exceeded()
+	start_time = time.perf_counter()
+	user, was_created = await get_or_create_user(user_id)
+	record_stage(
+		"create_user" if was_created else "get_user", time.perf_counter() - start_time
+	)
 	if user.get("blocked"):
 		raise HTTPException(status_code=403, detail={"error": "User is blocked."})
+	if env.BUDGET_ENFORCEMENT_ENABLED:
+		budget_tracker.track(user_id, user)
+		if budget_tracker.is_exceeded(user_id):
+			budget_exceeded()
 
 	if authorized_chat_request.stream:
-		return StreamingResponse(
-			stream_completion(authorized_chat_request),
+		start_time = time.perf_counter()
+		on_close = []
+		if env.RATE_LIMIT_ENABLED:
+			if not rate_limiter.acquire_stream(user_id):
+				rate_limit_exceeded("rejected_streams", 1.0)
+			on_close.append(lambda: rate_limiter.release_stream(user_id))
+		try:
+			stream = await stream_completion(authorized_chat_request, on_close)
+		except BaseException:
+			for callback in on_close:
+				callback()
+			raise
+		if env.SERVER_TIMING_ENABLED:
+			stream = server_timing_stream(stream)
+		return ClosingStreamingResponse(
+			timed_stream(stream, "completion", start_time),
+			on_close=on_close,
 			media_type="text/event-stream",
 		)
 	else:
-		return await get_completion(authorized_chat_request)
+		# "Cache-Control: no-cache" bypasses the response cache
+		use_cache = "no-cache" not in (cache_control or "")
+		with timed_stage("completion"):
+			data = await get_completion(authorized_chat_request, use_cache=use_cache)
+		if env.SERVER_TIMING_ENABLED:
+			response.headers["Server-Timing"] = server_timing()
+		return data
 
 
 def main():
-	uvicorn.run(app, host="0.0.0.0", port=env.PORT, timeout_keep_alive=10)
+	if env.WORKERS > 1:
+		if env.CHALLENGE_MODE == "hmac":
+			# Consumed nonces live in each process, so a challenge could be
+			# replayed against another worker
+			raise RuntimeError("Multiple workers require CHALLENGE_MODE=pg")
+		prepare_multiprocess_dir(env.PROMETHEUS_MULTIPROC_DIR)
+	# Each worker imports the app and runs its own lifespan (DB pools, HTTP client)
+	uvicorn.run(
+		"proxy.run:app",
+		host="0.0.0.0",
+		port=env.PORT,
+		timeout_keep_alive=10,
+		workers=env.WORKERS,
+	)
 
 
 if __name__ == "__main__":
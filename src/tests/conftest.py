@@ -28,13 +28,18 @@ def mocked_client(mocker):
 		"proxy.core.routers.appattest.appattest.app_attest_pg", mock_app_attest_pg
 	)
 	mocker.patch("proxy.core.routers.health.health.app_attest_pg", mock_app_attest_pg)
+	mocker.patch("proxy.core.routers.usage.usage.app_attest_pg", mock_app_attest_pg)
+	mocker.patch("proxy.core.usage.app_attest_pg", mock_app_attest_pg)
 	mocker.patch(
 		"proxy.core.routers.appattest.appattest.app_attest_pg", mock_app_attest_pg
 	)
 	mocker.patch("proxy.run.litellm_pg", mock_litellm_pg)
 	mocker.patch("proxy.core.routers.health.health.litellm_pg", mock_litellm_pg)
+	mocker.patch("proxy.core.routers.user.user.litellm_pg", mock_litellm_pg)
+	mocker.patch("proxy.core.utils.litellm_pg", mock_litellm_pg)
 
 	mocker.patch("proxy.core.routers.fxa.fxa.client", mock_fxa_client)
+	mocker.patch("proxy.run.tokenizer_registry.load")
 
 	mocker.patch(
 		"proxy.core.routers.appattest.middleware.verify_assert",
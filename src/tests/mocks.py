@@ -22,7 +22,9 @@ async def mock_get_or_create_user(mock_litellm_pg, user_id: str):
 	return [{"user_id": user_id, "data": "testdata"}, False]
 
 
-async def mock_get_completion(authorized_chat_request: AuthorizedChatRequest):
+async def mock_get_completion(
+	authorized_chat_request: AuthorizedChatRequest, use_cache: bool = True
+):
 	return SUCCESSFUL_CHAT_RESPONSE
 
 
@@ -34,6 +36,7 @@ class MockAppAttestPGService:
 		self.connected = True
 		self.challenges = {}
 		self.keys = {}
+		self.usage = []
 
 	async def connect(self):
 		pass
@@ -47,12 +50,20 @@ class MockAppAttestPGService:
 	async def store_challenge(self, key_id: str, challenge: str):
 		self.challenges[key_id] = {
 			"created_at": datetime.now(),
-			"challenge": challenge.encode(),
+			"challenge": challenge,
 		}
 
 	async def get_challenge(self, key_id: str) -> dict | None:
 		return self.challenges.get(key_id)
 
+	async def consume_challenge(self, key_id: str) -> dict | None:
+		return self.challenges.pop(key_id, None)
+
+	async def delete_expired_challenges(
+		self, max_age_seconds: float, batch_size: int
+	) -> int:
+		return 0
+
 	async def delete_challenge(self, key_id: str):
 		try:
 			del self.challenges[key_id]
@@ -68,6 +79,33 @@ class MockAppAttestPGService:
 	async def delete_key(self, key_id: str):
 		del self.keys[key_id]
 
+	async def store_usage(self, rows: list[tuple]) -> bool:
+		self.usage.extend(rows)
+		return True
+
+	async def get_user_usage(self, user_id: str, hours: int) -> list[dict] | None:
+		return [
+			{
+				"model": model,
+				"bucket_start": bucket_start,
+				"prompt_tokens": prompt_tokens,
+				"completion_tokens": completion_tokens,
+				"requests": requests,
+			}
+			for (
+				row_user_id,
+				model,
+				bucket_start,
+				prompt_tokens,
+				completion_tokens,
+				requests,
+			) in self.usage
+			if row_user_id == user_id
+		]
+
+	async def get_top_usage(self, hours: int, limit: int) -> list[dict] | None:
+		return []
+
 
 class MockLiteLLMPGService:
 	def __init__(self):
@@ -90,6 +128,13 @@ class MockLiteLLMPGService:
 		print("mock get_user called with user_id:", user_id)
 		return self.users.get(user_id)
 
+	async def get_or_create_user(self, user_id: str):
+		user = self.users.get(user_id)
+		if user:
+			return user, False
+		self.users[user_id] = {"user_id": user_id, "blocked": False}
+		return self.users[user_id], True
+
 	async def store_user(self, user_id: str, data: dict):
 		print("mock store_user called with user_id:", user_id, "data:", data)
 		self.users[user_id] = data
@@ -105,3 +150,35 @@ class MockFxAService:
 		if token == TEST_FXA_TOKEN:
 			return {"user": TEST_USER_ID}
 		return {"error": "Invalid token"}
+
+
+class MockPGConnection:
+	def __init__(self, row=None):
+		self.row = row
+
+	async def fetchrow(self, query: str, *args):
+		return self.row
+
+
+class MockPGPool:
+	"""Stands in for an asyncpg.Pool, handing out a single connection."""
+
+	def __init__(self, row=None, size: int = 1):
+		self.connection = MockPGConnection(row)
+		self.size = size
+		self.closing = False
+
+	async def acquire(self, timeout=None):
+		return self.connection
+
+	async def release(self, connection):
+		pass
+
+	async def close(self):
+		self.closing = True
+
+	def is_closing(self) -> bool:
+		return self.closing
+
+	def get_size(self) -> int:
+		return self.size
@@ -1,6 +1,27 @@
+import asyncio
 import base64
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
 
+import cbor2
+import pytest
 from consts import SUCCESSFUL_CHAT_RESPONSE, TEST_KEY_ID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from mocks import MockAppAttestPGService
+
+from proxy.core.cache import public_key_cache
+from proxy.core.config import env
+from proxy.core.routers.appattest import (
+	crypto_executor,
+	sweep_expired_challenges,
+	verify_assert,
+)
+from proxy.core.routers.appattest.hmac_challenge import HMACChallengeSigner
 
 
 def test_get_challenge(mocked_client):
@@ -82,3 +103,113 @@ def test_successful_request_with_mocked_app_attest_auth(mocked_client):
 	assert response.status_code != 401
 	assert response.status_code != 400
 	assert response.json() == SUCCESSFUL_CHAT_RESPONSE
+
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_verify_assert_caches_public_key(mocker, executor):
+	mocker.patch.object(env, "CRYPTO_EXECUTOR", executor)
+	mocker.patch.object(env, "CRYPTO_WORKERS", 1)
+	crypto_executor.shutdown()
+	private_key = ec.generate_private_key(ec.SECP256R1())
+	public_key_pem = (
+		private_key.public_key()
+		.public_bytes(
+			serialization.Encoding.PEM,
+			serialization.PublicFormat.SubjectPublicKeyInfo,
+		)
+		.decode()
+	)
+	mock_app_attest_pg = MockAppAttestPGService()
+	mock_app_attest_pg.keys[TEST_KEY_ID] = public_key_pem
+	mocker.patch(
+		"proxy.core.routers.appattest.appattest.app_attest_pg", mock_app_attest_pg
+	)
+	get_key = mocker.spy(mock_app_attest_pg, "get_key")
+	public_key_cache.clear()
+
+	payload = {"messages": [{"role": "user", "content": "Hello!"}]}
+	payload_hash = hashlib.sha256(
+		json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()
+	).digest()
+	authenticator_data = bytes(37)
+	nonce = hashlib.sha256(authenticator_data + payload_hash).digest()
+	assertion = cbor2.dumps(
+		{
+			"signature": private_key.sign(nonce, ec.ECDSA(hashes.SHA256())),
+			"authenticatorData": authenticator_data,
+		}
+	)
+
+	for _ in range(2):
+		result = asyncio.run(verify_assert(TEST_KEY_ID, assertion, payload))
+		assert result == {"status": "success"}
+	assert get_key.call_count == 1
+	public_key_cache.clear()
+	crypto_executor.shutdown()
+
+
+def test_hmac_challenge_round_trip(mocked_client, mocker):
+	mocker.patch.object(env, "CHALLENGE_MODE", "hmac")
+	challenge = mocked_client.get(
+		"/verify/challenge", params={"key_id": TEST_KEY_ID}
+	).json()["challenge"]
+	request = {
+		"key_id": TEST_KEY_ID,
+		"challenge_b64": base64.b64encode(challenge.encode()).decode(),
+		"assertion_obj_b64": "VEVTVF9BU1NFUlRJT05fQkFTRTY0VVJM",
+	}
+
+	response = mocked_client.post("/v1/chat/completions", json=request)
+	assert response.json() == SUCCESSFUL_CHAT_RESPONSE
+
+	# Each challenge can only be used once
+	response = mocked_client.post("/v1/chat/completions", json=request)
+	assert response.status_code == 400
+
+
+def test_hmac_challenge_rejects_tampering_and_expiry(mocker):
+	signer = HMACChallengeSigner(b"test-secret", expiry_seconds=300)
+	assert not signer.validate(signer.issue(TEST_KEY_ID), "other-key-id")
+	assert not signer.validate("not-a-challenge", TEST_KEY_ID)
+
+	challenge = signer.issue(TEST_KEY_ID)
+	mocker.patch(
+		"proxy.core.routers.appattest.hmac_challenge.time.time",
+		return_value=time.time() + 301,
+	)
+	assert not signer.validate(challenge, TEST_KEY_ID)
+
+
+def test_sweep_expired_challenges_drains_full_batches(mocker):
+	mock_app_attest_pg = MockAppAttestPGService()
+	mocker.patch(
+		"proxy.core.routers.appattest.appattest.app_attest_pg", mock_app_attest_pg
+	)
+	delete_expired = mocker.patch.object(
+		mock_app_attest_pg,
+		"delete_expired_challenges",
+		side_effect=[env.CHALLENGE_SWEEP_BATCH_SIZE] * 2 + [3],
+	)
+
+	async def run():
+		task = asyncio.create_task(sweep_expired_challenges())
+		while delete_expired.call_count < 3:
+			await asyncio.sleep(0)
+		task.cancel()
+
+	asyncio.run(run())
+	assert delete_expired.call_count == 3
+
+
+def test_crypto_module_imports_no_app_state():
+	# What a process-pool worker imports when it unpickles `timed_call`
+	check = (
+		"import sys; import proxy.core.app_attest_crypto; "
+		"loaded = [m for m in sys.modules if m.startswith('proxy.')]; "
+		"assert loaded == ['proxy.core', 'proxy.core.app_attest_crypto'], loaded"
+	)
+	subprocess.run(
+		[sys.executable, "-c", check],
+		check=True,
+		env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)},
+	)
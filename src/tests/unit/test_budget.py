@@ -0,0 +1,171 @@
+import asyncio
+
+from consts import SUCCESSFUL_CHAT_RESPONSE, TEST_FXA_TOKEN, TEST_USER_ID
+from pytest_httpx import IteratorStream
+
+from proxy.core.budget import BudgetTracker, UserBudget, response_cost
+from proxy.core.cache import budget_cache
+from proxy.core.classes import AuthorizedChatRequest
+from proxy.core.config import LITELLM_COMPLETIONS_PATH, env
+from proxy.core.upstream import upstream_pool
+from proxy.core.utils import get_completion, stream_completion
+
+
+def test_tracks_budget_and_local_charges():
+	budget_cache.clear()
+	tracker = BudgetTracker()
+	# Shape of a LiteLLM customer/info response
+	tracker.track(
+		TEST_USER_ID, {"spend": 0.5, "litellm_budget_table": {"max_budget": 1.0}}
+	)
+	tracker.track("no-budget-user", {"spend": 100.0, "litellm_budget_table": None})
+	assert not tracker.is_exceeded(TEST_USER_ID)
+
+	tracker.charge(TEST_USER_ID, response_cost({"x-litellm-response-cost": "0.6"}))
+	tracker.charge("no-budget-user", 5.0)
+	assert tracker.is_exceeded(TEST_USER_ID)
+	assert not tracker.is_exceeded("no-budget-user")
+	assert not tracker.is_exceeded("unknown-user")
+	assert response_cost({"x-litellm-response-cost": "bogus"}) == 0
+	budget_cache.clear()
+
+
+def test_reconcile_replaces_local_estimate(mocker):
+	budget_cache.clear()
+	tracker = BudgetTracker()
+	mocker.patch.object(env, "USER_DB_FAST_PATH", True)
+	tracker.track(TEST_USER_ID, {"spend": 0.0, "max_budget": 1.0})
+	tracker.charge(TEST_USER_ID, 0.4)
+
+	async def get_spend(user_ids):
+		# A request finishing while LiteLLM is being asked stays pending
+		tracker.charge(TEST_USER_ID, 0.1)
+		return [{"user_id": TEST_USER_ID, "spend": 0.95, "max_budget": 2.0}]
+
+	mocker.patch("proxy.core.budget.litellm_pg.get_spend", side_effect=get_spend)
+	asyncio.run(tracker.reconcile())
+
+	budget = budget_cache.get(TEST_USER_ID)
+	assert (budget.spend, budget.max_budget) == (0.95, 2.0)
+	assert round(budget.pending, 6) == 0.1
+	budget_cache.clear()
+
+
+def test_reconcile_through_litellm_api(httpx_mock):
+	budget_cache.clear()
+	tracker = BudgetTracker()
+	tracker.track(TEST_USER_ID, {"spend": 0.0, "max_budget": 1.0})
+	tracker.charge(TEST_USER_ID, 0.2)
+	httpx_mock.add_response(
+		method="GET",
+		url=f"{env.LITELLM_API_BASE}/customer/info?end_user_id={TEST_USER_ID}",
+		json={
+			"user_id": TEST_USER_ID,
+			"spend": 1.5,
+			"litellm_budget_table": {"max_budget": 1.0},
+		},
+	)
+
+	asyncio.run(tracker.reconcile())
+	assert tracker.is_exceeded(TEST_USER_ID)
+	budget_cache.clear()
+
+
+def test_rejected_user_is_unblocked_by_a_spend_reset(mocker):
+	budget_cache.clear()
+	tracker = BudgetTracker()
+	mocker.patch.object(env, "USER_DB_FAST_PATH", True)
+	# Already over budget when first seen, so never charged locally
+	tracker.track(TEST_USER_ID, {"spend": 1.0, "max_budget": 1.0})
+	assert tracker.is_exceeded(TEST_USER_ID)
+
+	# LiteLLM resets the spend when the budget period rolls over
+	mocker.patch(
+		"proxy.core.budget.litellm_pg.get_spend",
+		return_value=[{"user_id": TEST_USER_ID, "spend": 0.0, "max_budget": 1.0}],
+	)
+	asyncio.run(tracker.reconcile())
+	assert not tracker.is_exceeded(TEST_USER_ID)
+	budget_cache.clear()
+
+
+def test_over_budget_user_is_rejected_before_upstream(mocked_client, mocker):
+	mocker.patch.object(env, "BUDGET_ENFORCEMENT_ENABLED", True)
+	budget_cache.clear()
+	headers = {"x-fxa-authorization": "Bearer " + TEST_FXA_TOKEN}
+
+	response = mocked_client.post("/v1/chat/completions", headers=headers, json={})
+	assert response.json() == SUCCESSFUL_CHAT_RESPONSE
+
+	budget_cache.set(TEST_USER_ID, UserBudget(max_budget=1.0, spend=1.0))
+	get_or_create_user = mocker.patch("proxy.run.get_or_create_user")
+	response = mocked_client.post("/v1/chat/completions", headers=headers, json={})
+	assert response.status_code == 403
+	assert response.json() == {"detail": {"error": "Budget exceeded."}}
+	get_or_create_user.assert_not_called()
+	budget_cache.clear()
+
+
+def test_streams_queue_reconciliation_without_a_cost_header(httpx_mock, mocker):
+	mocker.patch.object(env, "BUDGET_ENFORCEMENT_ENABLED", True)
+	mocker.patch.object(env, "USER_DB_FAST_PATH", True)
+	budget_cache.clear()
+	tracker = BudgetTracker()
+	mocker.patch("proxy.core.utils.budget_tracker", tracker)
+	tracker.track(TEST_USER_ID, {"spend": 0.0, "max_budget": 1.0})
+	# LiteLLM sends the headers before generating, so the cost header is empty
+	httpx_mock.add_response(
+		method="POST",
+		url=upstream_pool.backends[0].url(LITELLM_COMPLETIONS_PATH),
+		headers={"x-litellm-response-cost": ""},
+		stream=IteratorStream([b'data: {"choices": []}\n\n', b"data: [DONE]\n\n"]),
+	)
+	request = AuthorizedChatRequest(
+		user=TEST_USER_ID, stream=True, messages=[{"role": "user", "content": "Hi"}]
+	)
+
+	async def run():
+		stream = await stream_completion(request)
+		return [chunk async for chunk in stream]
+
+	asyncio.run(run())
+	assert not tracker.is_exceeded(TEST_USER_ID)
+
+	mocker.patch(
+		"proxy.core.budget.litellm_pg.get_spend",
+		return_value=[{"user_id": TEST_USER_ID, "spend": 1.2, "max_budget": 1.0}],
+	)
+	asyncio.run(tracker.reconcile())
+	assert tracker.is_exceeded(TEST_USER_ID)
+	budget_cache.clear()
+
+
+def test_coalesced_completions_charge_every_caller(httpx_mock, mocker):
+	mocker.patch.object(env, "BUDGET_ENFORCEMENT_ENABLED", True)
+	budget_cache.clear()
+	tracker = BudgetTracker()
+	mocker.patch("proxy.core.utils.budget_tracker", tracker)
+	request = AuthorizedChatRequest(
+		user=TEST_USER_ID, messages=[{"role": "user", "content": "Hi"}]
+	)
+	follower_request = request.model_copy(update={"user": "other-user"})
+	mocker.patch.object(env, "COALESCE_MODELS", [request.model])
+	for user_id in (TEST_USER_ID, "other-user"):
+		tracker.track(user_id, {"spend": 0.0, "max_budget": 1.0})
+	httpx_mock.add_response(
+		method="POST",
+		url=upstream_pool.backends[0].url(LITELLM_COMPLETIONS_PATH),
+		headers={"x-litellm-response-cost": "0.25"},
+		json=SUCCESSFUL_CHAT_RESPONSE,
+	)
+
+	async def run():
+		return await asyncio.gather(
+			get_completion(request), get_completion(follower_request)
+		)
+
+	asyncio.run(run())
+	assert len(httpx_mock.get_requests()) == 1
+	assert budget_cache.get(TEST_USER_ID).pending == 0.25
+	assert budget_cache.get("other-user").pending == 0.25
+	budget_cache.clear()
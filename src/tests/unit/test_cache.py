@@ -0,0 +1,87 @@
+import asyncio
+import time
+
+from consts import TEST_USER_ID
+
+from proxy.core import utils
+from proxy.core.cache import SingleFlight, TTLCache, user_cache
+from proxy.core.config import env
+
+
+def test_ttl_cache_expiry(mocker):
+	cache = TTLCache("test", max_size=10, ttl=60)
+	cache.set("key", "value")
+	assert cache.get("key") == "value"
+
+	mocker.patch("proxy.core.cache.time.monotonic", return_value=time.monotonic() + 61)
+	assert cache.get("key") is None
+	assert "key" not in cache
+
+
+def test_ttl_cache_evicts_least_recently_used():
+	cache = TTLCache("test", max_size=2)
+	cache.set("a", 1)
+	cache.set("b", 2)
+	cache.get("a")
+	cache.set("c", 3)
+	assert "a" in cache
+	assert "b" not in cache
+	assert len(cache) == 2
+
+
+def test_single_flight_collapses_concurrent_calls():
+	calls = 0
+
+	async def lookup():
+		nonlocal calls
+		calls += 1
+		await asyncio.sleep(0.01)
+		return calls
+
+	async def run():
+		single_flight = SingleFlight()
+		return await asyncio.gather(
+			*(single_flight.do("key", lookup) for _ in range(5))
+		)
+
+	assert asyncio.run(run()) == [1] * 5
+	assert calls == 1
+
+
+def test_get_or_create_user_is_cached(httpx_mock):
+	user_cache.clear()
+	info_url = f"{env.LITELLM_API_BASE}/customer/info?end_user_id={TEST_USER_ID}"
+	httpx_mock.add_response(method="GET", url=info_url, json={})
+	httpx_mock.add_response(
+		method="POST", url=f"{env.LITELLM_API_BASE}/customer/new", json={}
+	)
+	httpx_mock.add_response(
+		method="GET", url=info_url, json={"user_id": TEST_USER_ID, "blocked": False}
+	)
+
+	async def run():
+		return await asyncio.gather(
+			*(utils.get_or_create_user(TEST_USER_ID) for _ in range(3))
+		)
+
+	results = asyncio.run(run())
+	assert all(user["user_id"] == TEST_USER_ID for user, _ in results)
+	assert len(httpx_mock.get_requests()) == 3
+
+	user, was_created = asyncio.run(utils.get_or_create_user(TEST_USER_ID))
+	assert user["user_id"] == TEST_USER_ID
+	assert was_created is False
+	assert len(httpx_mock.get_requests()) == 3
+	user_cache.clear()
+
+
+def test_ttl_cache_respects_byte_budget():
+	cache = TTLCache("test", max_size=10, max_bytes=100)
+	cache.set("a", "a", size=60)
+	cache.set("b", "b", size=30)
+	cache.set("c", "c", size=30)
+	assert "a" not in cache
+	assert cache.size_bytes == 60
+
+	cache.set("too-big", "x", size=101)
+	assert "too-big" not in cache
@@ -0,0 +1,351 @@
+import asyncio
+import json
+
+from consts import SUCCESSFUL_CHAT_RESPONSE, TEST_USER_ID
+from prometheus_client import REGISTRY
+from pytest_httpx import IteratorStream
+
+from proxy.core.cache import response_cache
+from proxy.core.classes import AuthorizedChatRequest
+from proxy.core.coalescing import StreamCoalescer
+from proxy.core.concurrency import AdaptiveConcurrencyLimiter
+from proxy.core.config import LITELLM_COMPLETIONS_PATH, env
+from proxy.core.prometheus_metrics import model_label
+from proxy.core.sse import SSEParser
+from proxy.core.tokenizers import tokenizer_registry
+from proxy.core.upstream import upstream_pool
+from proxy.core.utils import get_completion, stream_completion
+
+COMPLETIONS_URL = upstream_pool.backends[0].url(LITELLM_COMPLETIONS_PATH)
+
+
+def sse_frame(payload) -> bytes:
+	data = payload if isinstance(payload, str) else json.dumps(payload)
+	return f"data: {data}\n\n".encode()
+
+
+STREAM_BODY = b"".join(
+	[
+		sse_frame({"choices": [{"delta": {"content": "Hello"}}]}),
+		sse_frame({"choices": [{"delta": {"content": " world"}}]}),
+		sse_frame({"choices": [{"delta": {}, "finish_reason": "stop"}]}),
+		sse_frame(
+			{
+				"choices": [],
+				"usage": {"prompt_tokens": 12, "completion_tokens": 2},
+			}
+		),
+		sse_frame("[DONE]"),
+	]
+)
+
+
+def completion_tokens() -> float:
+	return (
+		REGISTRY.get_sample_value(
+			"chat_tokens_total", {"model": env.MODEL_NAME, "type": "completion"}
+		)
+		or 0
+	)
+
+
+def stream_sample(name: str, labels: dict) -> float:
+	return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def collect_stream(request: AuthorizedChatRequest) -> bytes:
+	async def run():
+		stream = await stream_completion(request)
+		return b"".join([chunk async for chunk in stream])
+
+	return asyncio.run(run())
+
+
+def test_sse_parser_handles_arbitrary_chunk_boundaries():
+	parser = SSEParser()
+	for i in range(0, len(STREAM_BODY), 7):
+		parser.feed(STREAM_BODY[i : i + 7])
+	assert parser.content == "Hello world"
+	assert parser.finish_reason == "stop"
+	assert parser.usage == {"prompt_tokens": 12, "completion_tokens": 2}
+
+
+def test_stream_completion_uses_upstream_usage(httpx_mock):
+	httpx_mock.add_response(
+		method="POST",
+		url=COMPLETIONS_URL,
+		stream=IteratorStream([STREAM_BODY[:20], STREAM_BODY[20:]]),
+	)
+	before = completion_tokens()
+	labels = {"model": env.MODEL_NAME}
+	itl_before = stream_sample("chat_inter_token_latency_seconds_count", labels)
+	tps_before = stream_sample("chat_tokens_per_second_count", labels)
+
+	request = AuthorizedChatRequest(
+		user=TEST_USER_ID, stream=True, messages=[{"role": "user", "content": "Hi"}]
+	)
+	assert collect_stream(request) == STREAM_BODY
+	assert completion_tokens() - before == 2
+	# Two content frames, one gap between them
+	assert stream_sample("chat_inter_token_latency_seconds_count", labels) == (
+		itl_before + 1
+	)
+	assert stream_sample("chat_tokens_per_second_count", labels) == tps_before + 1
+
+	body = json.loads(httpx_mock.get_request().content)
+	assert body["stream_options"] == {"include_usage": True}
+
+
+def test_stream_timings_exclude_time_spent_on_the_client(httpx_mock, mocker):
+	frames = [
+		sse_frame({"choices": [{"delta": {"content": str(i)}}]}) for i in range(4)
+	]
+	httpx_mock.add_response(
+		method="POST",
+		url=COMPLETIONS_URL,
+		# The last two frames share a network chunk
+		stream=IteratorStream([frames[0], frames[1], frames[2] + frames[3]]),
+	)
+	labels = {"model": env.MODEL_NAME}
+	count = stream_sample("chat_inter_token_latency_seconds_count", labels)
+	total = stream_sample("chat_inter_token_latency_seconds_sum", labels)
+	request = AuthorizedChatRequest(
+		user=TEST_USER_ID, stream=True, messages=[{"role": "user", "content": "Hi"}]
+	)
+
+	async def run():
+		async for _ in await stream_completion(request):
+			# A slow client must not show up as upstream latency
+			await asyncio.sleep(0.05)
+
+	tps = stream_sample("chat_tokens_per_second_sum", labels)
+	asyncio.run(run())
+	assert stream_sample("chat_inter_token_latency_seconds_count", labels) == count + 3
+	assert stream_sample("chat_inter_token_latency_seconds_sum", labels) - total < 0.05
+	# Generation time excludes the 0.2s spent waiting on the client
+	tokens = tokenizer_registry.count(request.model, ["0123"])
+	assert stream_sample("chat_tokens_per_second_sum", labels) - tps > tokens / 0.05
+
+
+def test_stream_completion_counts_locally_without_usage(httpx_mock, mocker):
+	body_without_usage = b"".join(
+		[
+			sse_frame({"choices": [{"delta": {"content": "12345678"}}]}),
+			sse_frame("[DONE]"),
+		]
+	)
+	httpx_mock.add_response(
+		method="POST",
+		url=COMPLETIONS_URL,
+		stream=IteratorStream([body_without_usage]),
+	)
+	count_async = mocker.spy(tokenizer_registry, "count_async")
+	before = completion_tokens()
+
+	request = AuthorizedChatRequest(
+		user=TEST_USER_ID, stream=True, messages=[{"role": "user", "content": "Hi"}]
+	)
+	assert collect_stream(request) == body_without_usage
+	count_async.assert_any_call(request.model, ["12345678"])
+	assert completion_tokens() - before == tokenizer_registry.count(
+		request.model, ["12345678"]
+	)
+
+
+def test_get_completion_response_cache(httpx_mock, mocker):
+	mocker.patch.object(env, "RESPONSE_CACHE_ENABLED", True)
+	response_cache.clear()
+	httpx_mock.add_response(
+		method="POST",
+		url=COMPLETIONS_URL,
+		json=SUCCESSFUL_CHAT_RESPONSE,
+		is_reusable=True,
+	)
+	request = AuthorizedChatRequest(
+		user=TEST_USER_ID, messages=[{"role": "user", "content": "Hi"}]
+	)
+	other_user_request = request.model_copy(update={"user": "other-user"})
+	before = completion_tokens()
+
+	assert asyncio.run(get_completion(request)) == SUCCESSFUL_CHAT_RESPONSE
+	assert asyncio.run(get_completion(other_user_request)) == SUCCESSFUL_CHAT_RESPONSE
+	assert len(httpx_mock.get_requests()) == 1
+	# Cached responses still count towards token metrics
+	assert completion_tokens() - before == 2 * 27
+
+	asyncio.run(get_completion(request, use_cache=False))
+	assert len(httpx_mock.get_requests()) == 2
+	response_cache.clear()
+
+
+def test_get_completion_coalesces_identical_requests(httpx_mock, mocker):
+	request = AuthorizedChatRequest(
+		user=TEST_USER_ID, messages=[{"role": "user", "content": "Hi"}]
+	)
+	mocker.patch.object(env, "COALESCE_MODELS", [request.model])
+	httpx_mock.add_response(
+		method="POST", url=COMPLETIONS_URL, json=SUCCESSFUL_CHAT_RESPONSE
+	)
+
+	async def run():
+		return await asyncio.gather(*(get_completion(request) for _ in range(3)))
+
+	assert asyncio.run(run()) == [SUCCESSFUL_CHAT_RESPONSE] * 3
+	assert len(httpx_mock.get_requests()) == 1
+
+
+def test_stream_coalescer_fans_out_to_late_and_leaving_subscribers():
+	async def run():
+		chunks = asyncio.Queue()
+		source_closed = asyncio.Event()
+
+		async def source():
+			try:
+				while (chunk := await chunks.get()) is not None:
+					yield chunk
+			finally:
+				source_closed.set()
+
+		coalescer = StreamCoalescer()
+		first = coalescer.subscribe("key", lambda _summary: source())
+		leaving = coalescer.subscribe("key", lambda _summary: source())
+		await chunks.put(b"a")
+		assert await anext(first) == b"a"
+		assert await anext(leaving) == b"a"
+		await leaving.aclose()
+
+		await chunks.put(b"b")
+		assert await anext(first) == b"b"
+		late = coalescer.subscribe("key", lambda _summary: source())
+		assert [await anext(late), await anext(late)] == [b"a", b"b"]
+
+		await chunks.put(None)
+		assert [chunk async for chunk in first] == []
+		assert [chunk async for chunk in late] == []
+		assert source_closed.is_set()
+
+		# Once every subscriber is gone the upstream is cancelled
+		abandoned = coalescer.subscribe("other-key", lambda _summary: source())
+		await chunks.put(b"c")
+		assert await anext(abandoned) == b"c"
+		source_closed.clear()
+		await abandoned.aclose()
+		await asyncio.wait_for(source_closed.wait(), timeout=1)
+
+	asyncio.run(run())
+
+
+def test_coalesced_stream_followers_are_charged_their_usage(httpx_mock, mocker):
+	request = AuthorizedChatRequest(
+		user=TEST_USER_ID, stream=True, messages=[{"role": "user", "content": "Hi"}]
+	)
+	follower_request = request.model_copy(update={"user": "other-user"})
+	mocker.patch.object(env, "COALESCE_MODELS", [request.model])
+	mocker.patch.object(env, "USAGE_LEDGER_ENABLED", True)
+	record = mocker.patch("proxy.core.utils.usage_ledger.record")
+	httpx_mock.add_response(
+		method="POST",
+		url=COMPLETIONS_URL,
+		stream=IteratorStream([STREAM_BODY]),
+	)
+	before = completion_tokens()
+
+	async def run():
+		leader = await stream_completion(request)
+		follower = await stream_completion(follower_request)
+
+		async def collect(stream):
+			return b"".join([chunk async for chunk in stream])
+
+		return await asyncio.gather(collect(leader), collect(follower))
+
+	assert asyncio.run(run()) == [STREAM_BODY, STREAM_BODY]
+	assert len(httpx_mock.get_requests()) == 1
+	assert completion_tokens() - before == 2 * 2
+	assert {call.args[0] for call in record.call_args_list} == {
+		TEST_USER_ID,
+		"other-user",
+	}
+
+
+def test_unread_subscribers_release_the_shared_stream_on_close():
+	async def run():
+		chunks = asyncio.Queue()
+		source_closed = asyncio.Event()
+
+		async def source():
+			try:
+				while (chunk := await chunks.get()) is not None:
+					yield chunk
+			finally:
+				source_closed.set()
+
+		coalescer = StreamCoalescer()
+		leader_close, follower_close = [], []
+		leader = coalescer.subscribe(
+			"key", lambda _summary: source(), on_close=leader_close
+		)
+		# The follower's client leaves before its body is ever read
+		coalescer.subscribe("key", None, on_close=follower_close)
+		await chunks.put(b"a")
+		assert await anext(leader) == b"a"
+		await leader.aclose()
+		for callback in leader_close + follower_close:
+			callback()
+		await asyncio.wait_for(source_closed.wait(), timeout=1)
+		assert "key" not in coalescer
+
+	asyncio.run(run())
+
+
+def test_shared_stream_holds_its_slot_until_the_upstream_ends(mocker):
+	limiter = AdaptiveConcurrencyLimiter(
+		initial_limit=2,
+		min_limit=1,
+		max_limit=4,
+		backoff_ratio=0.5,
+		max_queue=1,
+		queue_timeout=0.05,
+	)
+	mocker.patch("proxy.core.utils.upstream_limiter", limiter)
+	mocker.patch.object(env, "UPSTREAM_CONCURRENCY_ENABLED", True)
+	request = AuthorizedChatRequest(
+		user=TEST_USER_ID, stream=True, messages=[{"role": "user", "content": "Hi"}]
+	)
+	mocker.patch.object(env, "COALESCE_MODELS", [request.model])
+
+	async def run():
+		chunks = asyncio.Queue()
+
+		async def upstream(_request, _summary):
+			while (chunk := await chunks.get()) is not None:
+				yield chunk
+
+		mocker.patch("proxy.core.utils._stream_upstream", upstream)
+		leader_close, follower_close = [], []
+		leader = await stream_completion(request, leader_close)
+		follower = await stream_completion(request, follower_close)
+		await chunks.put(b"a")
+		assert await anext(leader) == b"a"
+		# The leader's client leaves; the follower still needs the upstream
+		await leader.aclose()
+		for callback in leader_close:
+			callback()
+		assert limiter.in_flight == 1
+
+		await chunks.put(b"b")
+		await chunks.put(None)
+		assert [chunk async for chunk in follower] == [b"a", b"b"]
+		for callback in follower_close:
+			callback()
+		await asyncio.sleep(0)
+		assert limiter.in_flight == 0
+
+	asyncio.run(run())
+
+
+def test_model_label_is_bounded(mocker):
+	mocker.patch.object(env, "METRICS_MODELS", ["openai/gpt-4o"])
+	assert model_label("openai/gpt-4o") == "openai/gpt-4o"
+	assert model_label(env.MODEL_NAME) == env.MODEL_NAME
+	assert model_label("some/unlisted-model") == "other"
@@ -0,0 +1,154 @@
+import asyncio
+
+import pytest
+from consts import TEST_USER_ID
+from fastapi import HTTPException
+from prometheus_client import REGISTRY
+
+from proxy.core.classes import AuthorizedChatRequest
+from proxy.core.concurrency import AdaptiveConcurrencyLimiter, UpstreamOverloaded
+from proxy.core.config import LITELLM_COMPLETIONS_PATH, env
+from proxy.core.upstream import upstream_pool
+from proxy.core.utils import get_completion, stream_completion
+
+COMPLETIONS_URL = upstream_pool.backends[0].url(LITELLM_COMPLETIONS_PATH)
+
+
+def make_limiter(**overrides) -> AdaptiveConcurrencyLimiter:
+	settings = {
+		"initial_limit": 2,
+		"min_limit": 1,
+		"max_limit": 4,
+		"backoff_ratio": 0.5,
+		"max_queue": 1,
+		"queue_timeout": 0.05,
+		**overrides,
+	}
+	return AdaptiveConcurrencyLimiter(**settings)
+
+
+def shed_count(reason: str) -> float:
+	return REGISTRY.get_sample_value("upstream_shed_total", {"reason": reason}) or 0
+
+
+def test_limit_grows_on_fast_success_and_backs_off_on_failure():
+	limiter = make_limiter()
+
+	async def run():
+		for _ in range(4):
+			await limiter.acquire()
+			limiter.release(0.1, target=1.0)
+		assert int(limiter.limit) == 3
+
+		await limiter.acquire()
+		limiter.release(2.0, target=1.0)
+		assert int(limiter.limit) == 1
+		cut = limiter.limit
+
+		# A request that was already in flight at the last cut can't cut again
+		await limiter.acquire()
+		limiter.release(0.5, target=1.0, success=False)
+		assert limiter.limit == cut
+
+		# Requests started since can, down to the floor
+		for _ in range(10):
+			await limiter.acquire()
+			limiter.release(0.0, target=1.0, success=False)
+		assert limiter.limit == 1
+
+	asyncio.run(run())
+
+
+def test_queued_requests_get_freed_slots_or_are_shed():
+	limiter = make_limiter(initial_limit=1)
+
+	async def run():
+		await limiter.acquire()
+		waiter = asyncio.ensure_future(limiter.acquire())
+		await asyncio.sleep(0)
+		assert limiter.in_flight == 1
+
+		# The queue holds a single waiter
+		before = shed_count("queue_full")
+		with pytest.raises(UpstreamOverloaded):
+			await limiter.acquire()
+		assert shed_count("queue_full") - before == 1
+
+		limiter.release()
+		await waiter
+		assert limiter.in_flight == 1
+
+		# Nobody releases, so the next waiter hits its deadline
+		before = shed_count("timeout")
+		with pytest.raises(UpstreamOverloaded):
+			await limiter.acquire()
+		assert shed_count("timeout") - before == 1
+		assert limiter.in_flight == 1
+
+	asyncio.run(run())
+
+
+def test_get_completion_sheds_with_503(mocker):
+	limiter = make_limiter(initial_limit=1, max_queue=0)
+	mocker.patch("proxy.core.utils.upstream_limiter", limiter)
+	mocker.patch.object(env, "UPSTREAM_CONCURRENCY_ENABLED", True)
+	request = AuthorizedChatRequest(
+		user=TEST_USER_ID, messages=[{"role": "user", "content": "Hi"}]
+	)
+
+	async def run():
+		await limiter.acquire()
+		with pytest.raises(HTTPException) as exc_info:
+			await get_completion(request)
+		return exc_info.value
+
+	error = asyncio.run(run())
+	assert error.status_code == 503
+	assert error.headers["Retry-After"] == "1"
+
+
+def test_client_errors_do_not_cut_the_limit(httpx_mock, mocker):
+	limiter = make_limiter(initial_limit=4, max_limit=4)
+	mocker.patch("proxy.core.utils.upstream_limiter", limiter)
+	mocker.patch.object(env, "UPSTREAM_CONCURRENCY_ENABLED", True)
+	httpx_mock.add_response(
+		method="POST", url=COMPLETIONS_URL, status_code=400, is_reusable=True
+	)
+	request = AuthorizedChatRequest(
+		user=TEST_USER_ID, messages=[{"role": "user", "content": "Hi"}]
+	)
+	stream_request = request.model_copy(update={"stream": True})
+
+	async def run():
+		for _ in range(5):
+			with pytest.raises(HTTPException):
+				await get_completion(request)
+			# A rejected stream yields nothing, which isn't a capacity signal either
+			stream = await stream_completion(stream_request)
+			assert [chunk async for chunk in stream] == []
+
+	asyncio.run(run())
+	assert limiter.limit == 4
+	assert limiter.in_flight == 0
+
+
+def test_unstarted_stream_releases_its_slot_on_close(mocker):
+	limiter = make_limiter()
+	mocker.patch("proxy.core.utils.upstream_limiter", limiter)
+	mocker.patch.object(env, "UPSTREAM_CONCURRENCY_ENABLED", True)
+	request = AuthorizedChatRequest(
+		user=TEST_USER_ID, stream=True, messages=[{"role": "user", "content": "Hi"}]
+	)
+	on_close = []
+
+	async def run():
+		# The client goes away before the body is ever iterated
+		await stream_completion(request, on_close)
+		assert limiter.in_flight == 1
+		for callback in on_close:
+			callback()
+			callback()
+
+	asyncio.run(run())
+	assert limiter.in_flight == 0
+	assert limiter.limit == 2
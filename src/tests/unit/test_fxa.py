@@ -1,4 +1,39 @@
-from consts import SUCCESSFUL_CHAT_RESPONSE, TEST_FXA_TOKEN
+import time
+
+import jwt
+import pytest
+from consts import SUCCESSFUL_CHAT_RESPONSE, TEST_FXA_TOKEN, TEST_USER_ID
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from proxy.core.config import env
+from proxy.core.routers.fxa import fxa
+from proxy.core.routers.fxa.jwks import FxAJWTVerifier
+
+TEST_KID = "test-kid"
+
+
+@pytest.fixture
+def signing_key():
+	return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+@pytest.fixture
+def jwt_verifier(signing_key):
+	jwk = jwt.algorithms.RSAAlgorithm.to_jwk(signing_key.public_key(), as_dict=True)
+	verifier = FxAJWTVerifier("https://test-fxa.com/jwks", env.CLIENT_ID)
+	verifier.load_keys({"keys": [{**jwk, "kid": TEST_KID, "alg": "RS256"}]})
+	return verifier
+
+
+def make_access_token(signing_key, kid=TEST_KID, **claims):
+	claims = {
+		"sub": TEST_USER_ID,
+		"client_id": env.CLIENT_ID,
+		"scope": "profile",
+		"exp": int(time.time()) + 300,
+		**claims,
+	}
+	return jwt.encode(claims, signing_key, algorithm="RS256", headers={"kid": kid})
 
 
 def test_missing_auth(mocked_client):
@@ -27,3 +62,56 @@ def test_successful_request_with_mocked_fxa_auth(mocked_client):
 	assert response.status_code != 401
 	assert response.status_code != 400
 	assert response.json() == SUCCESSFUL_CHAT_RESPONSE
+
+
+def test_fxa_token_is_cached(mocked_client, mocker):
+	fxa.fxa_token_cache.clear()
+	verify_token = mocker.spy(fxa.client, "verify_token")
+	for _ in range(3):
+		response = mocked_client.post(
+			"/v1/chat/completions",
+			headers={"x-fxa-authorization": "Bearer " + TEST_FXA_TOKEN},
+			json={},
+		)
+		assert response.json() == SUCCESSFUL_CHAT_RESPONSE
+	assert verify_token.call_count == 1
+
+
+def test_local_jwt_verification(jwt_verifier, signing_key):
+	profile = jwt_verifier.verify(make_access_token(signing_key))
+	assert profile["user"] == TEST_USER_ID
+
+	# Opaque tokens and unknown key ids fall back to remote verification
+	assert jwt_verifier.verify(TEST_FXA_TOKEN) is None
+	jwt_verifier._last_refresh = time.time()
+	assert jwt_verifier.verify(make_access_token(signing_key, kid="unknown")) is None
+
+
+@pytest.mark.parametrize(
+	"claims",
+	[
+		{"exp": int(time.time()) - 10},
+		{"client_id": "other-client"},
+		{"scope": "openid"},
+	],
+)
+def test_local_jwt_verification_rejects_invalid_tokens(
+	jwt_verifier, signing_key, claims
+):
+	with pytest.raises(jwt.PyJWTError):
+		jwt_verifier.verify(make_access_token(signing_key, **claims))
+
+
+def test_successful_request_with_local_jwt_verification(
+	mocked_client, mocker, jwt_verifier, signing_key
+):
+	mocker.patch.object(env, "FXA_LOCAL_JWT_VERIFICATION", True)
+	mocker.patch.object(fxa, "fxa_jwt_verifier", jwt_verifier)
+	verify_token = mocker.spy(fxa.client, "verify_token")
+	response = mocked_client.post(
+		"/v1/chat/completions",
+		headers={"x-fxa-authorization": "Bearer " + make_access_token(signing_key)},
+		json={},
+	)
+	assert response.json() == SUCCESSFUL_CHAT_RESPONSE
+	assert verify_token.call_count == 0
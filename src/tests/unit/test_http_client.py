@@ -0,0 +1,49 @@
+import asyncio
+
+from proxy.core.http_client import HTTPClientService, fxa_http, litellm_http
+
+URL = "http://litellm:4000/health/readiness"
+
+
+def test_client_is_reused_across_requests(httpx_mock):
+	httpx_mock.add_response(url=URL, is_reusable=True)
+	service = HTTPClientService(max_connections=10, max_keepalive_connections=5)
+
+	async def run():
+		first = service.client
+		await service.client.get(URL)
+		await service.client.get(URL)
+		assert service.client is first
+
+		await service.disconnect()
+		assert first.is_closed
+		# A closed client is replaced rather than reused
+		assert service.client is not first
+		await service.disconnect()
+
+	asyncio.run(run())
+	assert len(httpx_mock.get_requests()) == 2
+
+
+def test_connect_opens_the_pooled_client():
+	service = HTTPClientService(max_connections=10, max_keepalive_connections=5)
+
+	async def run():
+		await service.connect()
+		client = service._client
+		assert client is not None and not client.is_closed
+		await service.connect()
+		assert service._client is client
+		await service.disconnect()
+		assert service._client is None
+
+	asyncio.run(run())
+
+
+def test_fxa_and_litellm_use_separate_pools():
+	async def run():
+		assert fxa_http.client is not litellm_http.client
+		await fxa_http.disconnect()
+		await litellm_http.disconnect()
+
+	asyncio.run(run())
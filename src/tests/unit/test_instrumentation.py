@@ -0,0 +1,61 @@
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from proxy.core.instrumentation import InstrumentationMiddleware
+
+
+def sample(name: str, **labels) -> float:
+	return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def make_app() -> tuple[FastAPI, dict]:
+	app = FastAPI()
+	app.add_middleware(InstrumentationMiddleware, skip_paths=["/health"])
+	observed = {}
+
+	@app.get("/stream/{item}")
+	async def stream(item: str):
+		async def chunks():
+			for _ in range(3):
+				await asyncio.sleep(0.05)
+				yield b"data: chunk\n\n"
+			observed["in_progress"] = sample("in_progress_requests")
+
+		return StreamingResponse(chunks(), media_type="text/event-stream")
+
+	@app.get("/health/liveness")
+	async def liveness():
+		return {"status": "alive"}
+
+	return app, observed
+
+
+def test_streaming_request_is_timed_to_last_chunk():
+	app, observed = make_app()
+	labels = {"method": "GET", "endpoint": "/stream/{item}"}
+	count_before = sample("request_latency_seconds_count", **labels)
+	sum_before = sample("request_latency_seconds_sum", **labels)
+	in_progress_before = sample("in_progress_requests")
+
+	with TestClient(app) as client:
+		response = client.get("/stream/abc")
+	assert response.status_code == 200
+
+	assert observed["in_progress"] == in_progress_before + 1
+	assert sample("in_progress_requests") == in_progress_before
+	assert sample("request_latency_seconds_count", **labels) == count_before + 1
+	assert sample("request_latency_seconds_sum", **labels) - sum_before >= 0.15
+
+
+def test_skipped_paths_are_not_recorded():
+	app, _ = make_app()
+	labels = {"method": "GET", "endpoint": "/health/liveness"}
+	before = sample("requests_total", **labels)
+
+	with TestClient(app) as client:
+		assert client.get("/health/liveness").status_code == 200
+	assert sample("requests_total", **labels) == before
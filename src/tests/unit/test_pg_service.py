@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+import pytest
+from mocks import MockPGPool
+from prometheus_client import REGISTRY
+
+from proxy.core.config import env
+from proxy.core.pg_services.pg_service import PGService
+
+DB_NAME = "test_db"
+CREATE_POOL = "proxy.core.pg_services.pg_service.asyncpg.create_pool"
+
+
+def sample(name: str) -> float:
+	return REGISTRY.get_sample_value(name, {"db": DB_NAME}) or 0
+
+
+def test_failed_connect_is_retried_on_next_use(mocker):
+	mocker.patch.object(env, "PG_RECONNECT_INTERVAL_SECONDS", 0)
+	create_pool = mocker.patch(
+		CREATE_POOL,
+		new_callable=mocker.AsyncMock,
+		side_effect=[OSError("connection refused"), MockPGPool({"ok": 1})],
+	)
+	service = PGService(DB_NAME)
+	acquired = sample("pg_pool_acquire_latency_seconds_count")
+
+	async def run():
+		await service.connect()
+		assert not service.connected
+		return await service.fetchrow("SELECT 1 AS ok")
+
+	assert asyncio.run(run()) == {"ok": 1}
+	assert service.connected
+	assert create_pool.call_count == 2
+	assert sample("pg_pool_acquire_latency_seconds_count") == acquired + 1
+	assert sample("pg_pool_in_use") == 0
+
+
+def test_reconnects_are_rate_limited(mocker):
+	mocker.patch.object(env, "PG_RECONNECT_INTERVAL_SECONDS", 60)
+	create_pool = mocker.patch(
+		CREATE_POOL,
+		new_callable=mocker.AsyncMock,
+		side_effect=[OSError("connection refused"), MockPGPool({"ok": 1})],
+	)
+	service = PGService(DB_NAME)
+	asyncio.run(service.connect())
+
+	# Within the interval, callers fail fast instead of reconnecting
+	with pytest.raises(ConnectionError):
+		asyncio.run(service.fetchrow("SELECT 1 AS ok"))
+	assert create_pool.call_count == 1
+
+	mocker.patch(
+		"proxy.core.pg_services.pg_service.time.time",
+		return_value=time.time() + 61,
+	)
+	assert asyncio.run(service.fetchrow("SELECT 1 AS ok")) == {"ok": 1}
+	assert create_pool.call_count == 2
+
+
+def test_check_status_reports_a_closing_pool(mocker):
+	pool = MockPGPool()
+	mocker.patch(CREATE_POOL, new_callable=mocker.AsyncMock, return_value=pool)
+	service = PGService(DB_NAME)
+	assert not service.check_status()
+
+	asyncio.run(service.connect())
+	assert service.check_status()
+
+	pool.closing = True
+	assert not service.check_status()
+
+	pool.closing = False
+	pool.size = 0
+	mocker.patch.object(env, "PG_POOL_MIN_SIZE", 2)
+	assert not service.check_status()
@@ -0,0 +1,103 @@
+import asyncio
+import time
+
+import pytest
+from consts import SUCCESSFUL_CHAT_RESPONSE, TEST_FXA_TOKEN, TEST_USER_ID
+from starlette.requests import ClientDisconnect
+
+from proxy.core.config import env
+from proxy.core.rate_limit import UserRateLimiter
+from proxy.run import ClosingStreamingResponse
+
+
+def make_limiter(**overrides) -> UserRateLimiter:
+	settings = {
+		"requests_per_second": 1.0,
+		"request_burst": 2,
+		"tokens_per_minute": 600,
+		"max_concurrent_streams": 1,
+		"idle_seconds": 60,
+		"max_users": 100,
+		**overrides,
+	}
+	return UserRateLimiter(**settings)
+
+
+def test_request_bucket_refills(mocker):
+	limiter = make_limiter()
+	assert limiter.check(TEST_USER_ID)[0] == "allowed"
+	assert limiter.check(TEST_USER_ID)[0] == "allowed"
+	decision, retry_after = limiter.check(TEST_USER_ID)
+	assert decision == "rejected_requests"
+	assert 0 < retry_after <= 1
+
+	mocker.patch(
+		"proxy.core.rate_limit.time.monotonic", return_value=time.monotonic() + 1
+	)
+	assert limiter.check(TEST_USER_ID)[0] == "allowed"
+
+
+def test_token_bucket_and_stream_cap():
+	limiter = make_limiter(request_burst=100)
+	limiter.record_tokens(TEST_USER_ID, 700)
+	decision, retry_after = limiter.check(TEST_USER_ID)
+	assert decision == "rejected_tokens"
+	assert retry_after > 0
+
+	assert limiter.acquire_stream("other-user")
+	assert limiter.check("other-user", stream=True)[0] == "rejected_streams"
+	assert not limiter.acquire_stream("other-user")
+	limiter.release_stream("other-user")
+	assert limiter.acquire_stream("other-user")
+
+
+def test_idle_and_overflow_eviction(mocker):
+	limiter = make_limiter(max_users=2)
+	for user_id in ("a", "b", "c"):
+		limiter.check(user_id)
+	assert list(limiter._users) == ["b", "c"]
+
+	mocker.patch(
+		"proxy.core.rate_limit.time.monotonic", return_value=time.monotonic() + 61
+	)
+	limiter.check("d")
+	assert list(limiter._users) == ["d"]
+
+
+def test_chat_completion_rate_limited(mocked_client, mocker):
+	mocker.patch.object(env, "RATE_LIMIT_ENABLED", True)
+	mocker.patch("proxy.run.rate_limiter", make_limiter(request_burst=1))
+	headers = {"x-fxa-authorization": "Bearer " + TEST_FXA_TOKEN}
+
+	response = mocked_client.post("/v1/chat/completions", headers=headers, json={})
+	assert response.json() == SUCCESSFUL_CHAT_RESPONSE
+
+	response = mocked_client.post("/v1/chat/completions", headers=headers, json={})
+	assert response.status_code == 429
+	assert response.headers["Retry-After"] == "1"
+
+
+def test_stream_slot_is_released_when_the_body_is_never_sent():
+	limiter = make_limiter()
+	assert limiter.acquire_stream(TEST_USER_ID)
+	started = []
+
+	async def body():
+		started.append(True)
+		yield b"data: [DONE]\n\n"
+
+	response = ClosingStreamingResponse(
+		body(), on_close=[lambda: limiter.release_stream(TEST_USER_ID)]
+	)
+
+	async def send(message):
+		raise OSError("client disconnected")
+
+	async def receive():
+		return {"type": "http.disconnect"}
+
+	scope = {"type": "http", "asgi": {"spec_version": "2.4"}}
+	with pytest.raises(ClientDisconnect):
+		asyncio.run(response(scope, receive, send))
+	assert not started
+	assert limiter.acquire_stream(TEST_USER_ID)
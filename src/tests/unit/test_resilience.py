@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+from consts import SUCCESSFUL_CHAT_RESPONSE, TEST_USER_ID
+from fastapi import HTTPException
+from prometheus_client import REGISTRY
+
+from proxy.core import resilience
+from proxy.core.classes import AuthorizedChatRequest
+from proxy.core.config import LITELLM_COMPLETIONS_PATH, env
+from proxy.core.resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, hedged
+from proxy.core.upstream import upstream_pool
+from proxy.core.utils import get_completion
+
+COMPLETIONS_URL = upstream_pool.backends[0].url(LITELLM_COMPLETIONS_PATH)
+
+REQUEST = AuthorizedChatRequest(
+	user=TEST_USER_ID, messages=[{"role": "user", "content": "Hi"}]
+)
+
+
+@pytest.fixture
+def breaker(mocker):
+	breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=10)
+	mocker.patch("proxy.core.utils.completion_breaker", breaker)
+	mocker.patch.object(env, "UPSTREAM_RETRY_BACKOFF_SECONDS", 0)
+	return breaker
+
+
+def test_circuit_breaker_opens_and_probes(mocker):
+	clock = mocker.patch.object(resilience.time, "monotonic", return_value=100.0)
+	breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=10)
+
+	breaker.record_failure()
+	assert breaker.allow()
+	breaker.record_failure()
+	assert breaker.state == OPEN
+	assert not breaker.allow()
+
+	clock.return_value = 110.0
+	assert breaker.allow()
+	assert breaker.state == HALF_OPEN
+	# Only one probe at a time
+	assert not breaker.allow()
+	breaker.record_failure()
+	assert breaker.state == OPEN
+
+	clock.return_value = 120.0
+	assert breaker.allow()
+	breaker.record_success()
+	assert breaker.state == CLOSED
+
+
+def test_get_completion_retries_unavailable_upstream(httpx_mock, breaker):
+	httpx_mock.add_response(method="POST", url=COMPLETIONS_URL, status_code=503)
+	httpx_mock.add_response(
+		method="POST", url=COMPLETIONS_URL, json=SUCCESSFUL_CHAT_RESPONSE
+	)
+	before = REGISTRY.get_sample_value("upstream_retries_total", {"reason": "503"}) or 0
+
+	assert asyncio.run(get_completion(REQUEST)) == SUCCESSFUL_CHAT_RESPONSE
+	assert len(httpx_mock.get_requests()) == 2
+	assert REGISTRY.get_sample_value("upstream_retries_total", {"reason": "503"}) == (
+		before + 1
+	)
+	assert breaker.state == CLOSED
+
+
+def test_get_completion_fails_fast_while_circuit_is_open(httpx_mock, breaker):
+	httpx_mock.add_response(
+		method="POST", url=COMPLETIONS_URL, status_code=502, is_reusable=True
+	)
+
+	with pytest.raises(HTTPException) as exc_info:
+		asyncio.run(get_completion(REQUEST))
+	assert exc_info.value.status_code == 503
+	assert breaker.state == OPEN
+	requests_sent = len(httpx_mock.get_requests())
+	assert requests_sent == 2
+
+	with pytest.raises(HTTPException) as exc_info:
+		asyncio.run(get_completion(REQUEST))
+	assert exc_info.value.status_code == 503
+	assert len(httpx_mock.get_requests()) == requests_sent
+
+
+def test_get_completion_does_not_retry_client_errors(httpx_mock, breaker):
+	httpx_mock.add_response(method="POST", url=COMPLETIONS_URL, status_code=400)
+
+	with pytest.raises(HTTPException) as exc_info:
+		asyncio.run(get_completion(REQUEST))
+	assert exc_info.value.status_code == 500
+	assert len(httpx_mock.get_requests()) == 1
+	assert breaker.failures == 0
+
+
+def test_hedged_returns_first_success():
+	calls = []
+
+	async def fn():
+		calls.append(None)
+		if len(calls) == 1:
+			await asyncio.sleep(1)
+			return "primary"
+		return "hedge"
+
+	assert asyncio.run(hedged(fn, delay=0.01)) == "hedge"
+	assert len(calls) == 2
+	assert asyncio.run(hedged(lambda: asyncio.sleep(0, "fast"), delay=1)) == "fast"
@@ -0,0 +1,107 @@
+import asyncio
+import json
+
+from consts import TEST_FXA_TOKEN
+from prometheus_client import REGISTRY
+
+from proxy.core.config import env
+from proxy.core.timing import MetricsLogWriter, record_stage
+
+
+def test_writer_batches_entries_and_drops_on_overflow(tmp_path):
+	path = tmp_path / "metrics.jsonl"
+	writer = MetricsLogWriter(str(path), max_queue=2, batch_size=10)
+	dropped = REGISTRY.get_sample_value("metrics_log_dropped_total") or 0
+
+	writer.write({"total": 1.0})
+	writer.write({"total": 2.0})
+	writer.write({"total": 3.0})
+	assert REGISTRY.get_sample_value("metrics_log_dropped_total") == dropped + 1
+
+	async def run():
+		task = asyncio.create_task(writer.run())
+		while not writer._queue.empty():
+			await asyncio.sleep(0.01)
+		await asyncio.sleep(0.05)
+		task.cancel()
+
+	asyncio.run(run())
+	lines = path.read_text().splitlines()
+	assert [json.loads(line) for line in lines] == [{"total": 1.0}, {"total": 2.0}]
+
+
+def test_chat_request_logs_stage_timings(mocked_client, mocker, tmp_path):
+	path = tmp_path / "metrics.jsonl"
+	writer = MetricsLogWriter(str(path), max_queue=10, batch_size=10)
+	mocker.patch.object(env, "METRICS_LOG_ENABLED", True)
+	mocker.patch("proxy.core.instrumentation.metrics_log", writer)
+	headers = {"x-fxa-authorization": "Bearer " + TEST_FXA_TOKEN}
+
+	mocked_client.post("/v1/chat/completions", headers=headers, json={})
+	mocked_client.post("/v1/chat/completions", headers=headers, json={})
+	# Requests without stages, like health checks, aren't logged
+	mocked_client.get("/health/liveness")
+	asyncio.run(writer.flush())
+
+	first, second = [json.loads(line) for line in path.read_text().splitlines()]
+	assert {"fxa_verification", "create_user", "completion", "total"} <= first.keys()
+	assert "get_user" in second
+	assert first["total"] >= first["completion"]
+
+
+def test_chat_response_carries_server_timing_header(mocked_client, mocker):
+	mocker.patch.object(env, "SERVER_TIMING_ENABLED", True)
+	headers = {"x-fxa-authorization": "Bearer " + TEST_FXA_TOKEN}
+	count = (
+		REGISTRY.get_sample_value(
+			"request_stage_latency_seconds_count", {"stage": "fxa_verification"}
+		)
+		or 0
+	)
+
+	response = mocked_client.post("/v1/chat/completions", headers=headers, json={})
+
+	stages = [
+		entry.split(";")[0] for entry in response.headers["server-timing"].split(", ")
+	]
+	assert stages[0] == "fxa_verification"
+	assert {"create_user", "completion"} <= set(stages)
+	assert stages[-1] == "total"
+	assert (
+		REGISTRY.get_sample_value(
+			"request_stage_latency_seconds_count", {"stage": "fxa_verification"}
+		)
+		== count + 1
+	)
+
+
+def test_server_timing_is_off_by_default(mocked_client):
+	headers = {"x-fxa-authorization": "Bearer " + TEST_FXA_TOKEN}
+	response = mocked_client.post("/v1/chat/completions", headers=headers, json={})
+	assert "server-timing" not in response.headers
+
+
+def test_stream_sends_server_timing_comment_first(mocked_client, mocker):
+	mocker.patch.object(env, "SERVER_TIMING_ENABLED", True)
+
+	async def upstream():
+		record_stage("upstream_connect", 0.01)
+		record_stage("ttft", 0.02)
+		yield b'data: {"choices": []}\n\n'
+		yield b"data: [DONE]\n\n"
+
+	async def stream_completion(_request, _on_close):
+		return upstream()
+
+	mocker.patch("proxy.run.stream_completion", stream_completion)
+	headers = {"x-fxa-authorization": "Bearer " + TEST_FXA_TOKEN}
+
+	response = mocked_client.post(
+		"/v1/chat/completions", headers=headers, json={"stream": True}
+	)
+
+	comment, *frames = response.text.split("\n\n")
+	assert comment.startswith(": server-timing fxa_verification;dur=")
+	assert "upstream_connect;dur=10.0" in comment
+	assert "ttft;dur=20.0" in comment
+	assert frames[0] == 'data: {"choices": []}'
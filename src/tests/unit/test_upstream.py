@@ -0,0 +1,89 @@
+import asyncio
+
+import httpx
+import pytest
+from consts import SUCCESSFUL_CHAT_RESPONSE, TEST_USER_ID
+
+from proxy.core.classes import AuthorizedChatRequest
+from proxy.core.config import LITELLM_COMPLETIONS_PATH, LITELLM_READINESS_PATH, env
+from proxy.core.upstream import UpstreamPool
+from proxy.core.utils import get_completion
+
+BASES = ["http://litellm-a:4000", "http://litellm-b:4000/"]
+
+
+def test_least_outstanding_spreads_concurrent_requests():
+	pool = UpstreamPool(BASES)
+
+	async def run():
+		async with pool.use() as first, pool.use() as second:
+			assert {first.base, second.base} == {
+				"http://litellm-a:4000",
+				"http://litellm-b:4000",
+			}
+			assert first.outstanding == second.outstanding == 1
+		assert all(backend.outstanding == 0 for backend in pool.backends)
+
+	asyncio.run(run())
+
+
+def test_ewma_prefers_the_faster_backend():
+	pool = UpstreamPool(BASES, strategy="ewma")
+	slow, fast = pool.backends
+	pool.observe(slow, 2.0)
+	pool.observe(fast, 0.2)
+	assert pool.pick() is fast
+	# Load counts too: a busy fast backend loses to an idle slow one
+	fast.outstanding = 20
+	assert pool.pick() is slow
+
+
+def test_failing_backend_is_ejected_and_reprobed(httpx_mock):
+	pool = UpstreamPool(BASES, eject_failures=2)
+	bad, good = pool.backends
+	error = httpx.ConnectError("connection refused")
+
+	async def fail():
+		with pytest.raises(httpx.ConnectError):
+			async with pool.use(exclude=good):
+				raise error
+
+	asyncio.run(fail())
+	assert bad.healthy
+	asyncio.run(fail())
+	assert not bad.healthy
+	assert all(pool.pick() is good for _ in range(5))
+
+	# With every backend ejected requests still go somewhere
+	good.healthy = False
+	assert pool.pick() in pool.backends
+	good.healthy = True
+
+	httpx_mock.add_response(url=bad.url(LITELLM_READINESS_PATH), status_code=503)
+	assert not asyncio.run(pool.probe(bad))
+	httpx_mock.add_response(url=bad.url(LITELLM_READINESS_PATH), json={})
+	assert asyncio.run(pool.probe(bad))
+	assert bad.healthy and bad.failures == 0
+
+
+def test_get_completion_retries_on_another_backend(httpx_mock, mocker):
+	pool = UpstreamPool(BASES)
+	first, second = pool.backends
+	mocker.patch("proxy.core.utils.upstream_pool", pool)
+	mocker.patch.object(env, "UPSTREAM_RETRY_BACKOFF_SECONDS", 0)
+	mocker.patch.object(pool, "pick", side_effect=[first, second])
+	httpx_mock.add_response(
+		method="POST", url=first.url(LITELLM_COMPLETIONS_PATH), status_code=502
+	)
+	httpx_mock.add_response(
+		method="POST",
+		url=second.url(LITELLM_COMPLETIONS_PATH),
+		json=SUCCESSFUL_CHAT_RESPONSE,
+	)
+	request = AuthorizedChatRequest(
+		user=TEST_USER_ID, messages=[{"role": "user", "content": "Hi"}]
+	)
+
+	assert asyncio.run(get_completion(request)) == SUCCESSFUL_CHAT_RESPONSE
+	assert pool.pick.call_args_list[1].args == (first,)
+	assert first.failures == 1 and second.failures == 0
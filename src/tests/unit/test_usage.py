@@ -0,0 +1,88 @@
+import asyncio
+
+from consts import TEST_USER_ID
+from mocks import MockAppAttestPGService
+from prometheus_client import REGISTRY
+
+from proxy.core.classes import AuthorizedChatRequest
+from proxy.core.config import env
+from proxy.core.usage import UsageLedger
+from proxy.core.utils import record_usage
+
+MASTER_KEY_HEADER = {"master-key": f"Bearer {env.MASTER_KEY}"}
+
+
+def test_ledger_aggregates_per_user_and_model(mocker):
+	mock_pg = MockAppAttestPGService()
+	mocker.patch("proxy.core.usage.app_attest_pg", mock_pg)
+	ledger = UsageLedger(max_pending=10)
+	ledger.record(TEST_USER_ID, "model-a", 10, 5)
+	ledger.record(TEST_USER_ID, "model-a", 1, 2)
+	ledger.record(TEST_USER_ID, "model-b", 3, 4)
+	ledger.record("other-user", "model-a", 7, 7)
+	assert len(ledger) == 3
+
+	asyncio.run(ledger.flush())
+	assert len(ledger) == 0
+	totals = {(row[0], row[1]): row[3:] for row in mock_pg.usage}
+	assert totals == {
+		(TEST_USER_ID, "model-a"): (11, 7, 2),
+		(TEST_USER_ID, "model-b"): (3, 4, 1),
+		("other-user", "model-a"): (7, 7, 1),
+	}
+	assert all(row[2].tzinfo is not None for row in mock_pg.usage)
+
+
+def test_failed_flush_keeps_rows_for_the_next_one(mocker):
+	mock_pg = MockAppAttestPGService()
+	mocker.patch("proxy.core.usage.app_attest_pg", mock_pg)
+	store_usage = mocker.patch.object(mock_pg, "store_usage", return_value=False)
+	ledger = UsageLedger(max_pending=2)
+	ledger.record(TEST_USER_ID, "model-a", 10, 5)
+
+	asyncio.run(ledger.flush())
+	assert store_usage.call_count == 1
+	# Requests keep being recorded while the DB is down, up to max_pending
+	ledger.record(TEST_USER_ID, "model-a", 1, 1)
+	ledger.record(TEST_USER_ID, "model-b", 1, 1)
+	dropped = REGISTRY.get_sample_value("usage_ledger_dropped_rows_total") or 0
+	ledger.record("other-user", "model-a", 1, 1)
+	assert REGISTRY.get_sample_value("usage_ledger_dropped_rows_total") == dropped + 1
+
+	store_usage.return_value = True
+	asyncio.run(ledger.flush())
+	rows = store_usage.call_args.args[0]
+	assert {row[1]: row[3:] for row in rows} == {
+		"model-a": (11, 6, 2),
+		"model-b": (1, 1, 1),
+	}
+
+
+def test_usage_endpoint_requires_master_key(mocked_client):
+	assert mocked_client.get(f"/usage/{TEST_USER_ID}").status_code == 422
+	response = mocked_client.get(
+		f"/usage/{TEST_USER_ID}", headers={"master-key": "Bearer wrong"}
+	)
+	assert response.status_code == 401
+	assert mocked_client.get("/usage/top", headers=MASTER_KEY_HEADER).json() == {
+		"hours": 24,
+		"users": [],
+	}
+
+
+def test_recorded_usage_is_served_by_endpoint(mocked_client, mocker):
+	mocker.patch.object(env, "USAGE_LEDGER_ENABLED", True)
+	ledger = UsageLedger(max_pending=10)
+	mocker.patch("proxy.core.utils.usage_ledger", ledger)
+	request = AuthorizedChatRequest(
+		user=TEST_USER_ID, messages=[{"role": "user", "content": "Hi"}]
+	)
+	record_usage(request, 18, 27)
+	asyncio.run(ledger.flush())
+
+	response = mocked_client.get(f"/usage/{TEST_USER_ID}", headers=MASTER_KEY_HEADER)
+	assert response.status_code == 200
+	assert [
+		(row["model"], row["prompt_tokens"], row["completion_tokens"], row["requests"])
+		for row in response.json()["usage"]
+	] == [(env.MODEL_NAME, 18, 27, 1)]
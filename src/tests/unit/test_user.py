@@ -1,6 +1,12 @@
+import asyncio
+
 from consts import TEST_FXA_TOKEN, TEST_USER_ID
+from mocks import MockPGPool
 
+from proxy.core import utils
 from proxy.core.config import env
+from proxy.core.pg_services.litellm_pg_service import LiteLLMPGService
+from proxy.core.routers.user import user as user_router
 
 
 def test_user_info_wrong_params(mocked_client):
@@ -63,3 +69,64 @@ def test_user_info_endpoint_for_existing_user(mocked_client, httpx_mock):
 		"default_model": None,
 		"litellm_budget_table": None,
 	}
+
+
+def test_user_info_endpoint_db_fast_path(mocked_client, mocker):
+	mocker.patch.object(env, "USER_DB_FAST_PATH", True)
+	response = mocked_client.get(f"/user/{TEST_USER_ID}")
+	assert response.status_code == 404
+
+	user = {"user_id": TEST_USER_ID, "alias": None, "spend": 0.0, "blocked": False}
+	user_router.litellm_pg.users[TEST_USER_ID] = user
+	response = mocked_client.get(f"/user/{TEST_USER_ID}")
+	assert response.status_code == 200
+	assert response.json() == user
+
+
+def test_get_or_create_user_rereads_a_concurrently_inserted_user(mocker):
+	service = LiteLLMPGService()
+	row = {"user_id": TEST_USER_ID, "blocked": False, "max_budget": None}
+	# Another worker inserted the user after this query's snapshot was taken
+	fetchrow = mocker.patch.object(service, "fetchrow", side_effect=[None, row])
+
+	user, was_created = asyncio.run(service.get_or_create_user(TEST_USER_ID))
+
+	assert user == row
+	assert was_created is False
+	assert fetchrow.call_count == 2
+
+
+def test_fast_path_recovers_once_the_db_comes_back(httpx_mock, mocker):
+	mocker.patch.object(env, "USER_DB_FAST_PATH", True)
+	mocker.patch.object(env, "PG_RECONNECT_INTERVAL_SECONDS", 0)
+	service = LiteLLMPGService()
+	mocker.patch("proxy.core.utils.litellm_pg", service)
+	row = {"user_id": TEST_USER_ID, "blocked": False, "created": False}
+	# The DB is down at startup, then comes back
+	down = OSError("connection refused")
+	create_pool = mocker.patch(
+		"proxy.core.pg_services.pg_service.asyncpg.create_pool",
+		new_callable=mocker.AsyncMock,
+		side_effect=[down, down, MockPGPool(row)],
+	)
+	httpx_mock.add_response(
+		method="GET",
+		url=f"{env.LITELLM_API_BASE}/customer/info?end_user_id={TEST_USER_ID}",
+		json={"user_id": TEST_USER_ID},
+	)
+
+	async def run():
+		await service.connect()
+		assert not service.connected
+		# Falls back to the LiteLLM API while the DB is down...
+		assert await utils._fetch_or_create_user(TEST_USER_ID) == [
+			{"user_id": TEST_USER_ID},
+			False,
+		]
+		# ...and goes back to the DB without a restart
+		return await utils._fetch_or_create_user(TEST_USER_ID)
+
+	user, was_created = asyncio.run(run())
+	assert user == {"user_id": TEST_USER_ID, "blocked": False}
+	assert was_created is False
+	assert create_pool.call_count == 3
@@ -0,0 +1,58 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from proxy import run
+from proxy.core.config import env
+from proxy.core.prometheus_metrics import latest_metrics
+
+
+@pytest.fixture
+def multiproc_dir(tmp_path, mocker):
+	path = tmp_path / "prometheus_multiproc"
+	mocker.patch.object(env, "PROMETHEUS_MULTIPROC_DIR", str(path))
+	# Undoes the variable set by prepare_multiprocess_dir
+	mocker.patch.dict(os.environ)
+	return path
+
+
+def test_main_runs_multiple_workers(mocker, multiproc_dir):
+	uvicorn_run = mocker.patch("proxy.run.uvicorn.run")
+	mocker.patch.object(env, "WORKERS", 4)
+	multiproc_dir.mkdir()
+	(multiproc_dir / "stale.db").write_bytes(b"")
+	(multiproc_dir / "unrelated.txt").write_text("kept")
+
+	run.main()
+
+	uvicorn_run.assert_called_once()
+	assert uvicorn_run.call_args.args == ("proxy.run:app",)
+	assert uvicorn_run.call_args.kwargs["workers"] == 4
+	assert os.environ["PROMETHEUS_MULTIPROC_DIR"] == str(multiproc_dir)
+	assert [p.name for p in multiproc_dir.iterdir()] == ["unrelated.txt"]
+
+
+def test_main_refuses_hmac_challenges_with_multiple_workers(mocker):
+	uvicorn_run = mocker.patch("proxy.run.uvicorn.run")
+	mocker.patch.object(env, "WORKERS", 2)
+	mocker.patch.object(env, "CHALLENGE_MODE", "hmac")
+	# Even a shared secret can't stop replays across per-process nonce sets
+	mocker.patch.object(env, "CHALLENGE_SECRET", "shared-secret")
+	with pytest.raises(RuntimeError):
+		run.main()
+	uvicorn_run.assert_not_called()
+
+
+def test_metrics_are_aggregated_across_processes(multiproc_dir):
+	multiproc_dir.mkdir()
+	os.environ["PROMETHEUS_MULTIPROC_DIR"] = str(multiproc_dir)
+	worker = (
+		"from prometheus_client import Counter; "
+		"Counter('worker_test', 'Test counter.').inc(3)"
+	)
+	for _ in range(2):
+		subprocess.run([sys.executable, "-c", worker], check=True)
+
+	assert b"worker_test_total 6.0" in latest_metrics()